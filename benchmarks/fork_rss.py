@@ -0,0 +1,141 @@
+"""Measure the memory used by forked worker processes sharing one database.
+
+A parent process loads a rule set and starts a number of worker processes which
+each answer a few queries and run a full garbage collection. Once all of them
+are done, and still alive, every worker reports from /proc/self/smaps_rollup
+(so this only runs on Linux):
+
+- RSS, the memory the worker can see, including the pages shared with others,
+- PSS, which splits every shared page evenly between the processes sharing it,
+- USS, the pages private to the worker, i.e. what each extra worker costs.
+
+Scenarios:
+
+- reparse: every worker parses the rules itself, like spawned workers do,
+- fork: workers are forked once the parent has loaded the rules,
+- fork + freeze: the database is frozen with Database.freeze() before forking,
+- fork + freeze + fact tables: the same, with the facts in NumPy fact tables.
+
+Usage: python benchmarks/fork_rss.py [facts] [workers]
+"""
+
+import multiprocessing
+import os
+import statistics
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The benchmark runs from a checkout, where the package isn't installed
+sys.path.insert(0, ROOT)
+
+from prologpy.solver import Solver  # noqa: E402
+
+SCENARIOS = [
+    ("reparse", dict(fork=False, freeze=False, fact_tables=False)),
+    ("fork", dict(fork=True, freeze=False, fact_tables=False)),
+    ("fork + freeze", dict(fork=True, freeze=True, fact_tables=False)),
+    (
+        "fork + freeze + fact tables",
+        dict(fork=True, freeze=True, fact_tables=True),
+    ),
+]
+
+
+def make_rules(fact_count):
+    facts = "".join(
+        "edge(n{0}, n{1}).\n".format(index, (index * 7 + 1) % fact_count)
+        for index in range(fact_count)
+    )
+    return facts + "two_steps(X, Z) :- edge(X, Y), edge(Y, Z).\n"
+
+
+def memory_kilobytes():
+    """Return the RSS, PSS and USS of this process in kilobytes"""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as smaps:
+        for line in smaps:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1])
+    return (
+        fields["Rss"],
+        fields["Pss"],
+        fields["Private_Clean"] + fields["Private_Dirty"],
+    )
+
+
+def worker(solver, rules_text, fact_tables, fact_count, barrier, results):
+    import gc
+
+    if solver is None:
+        solver = Solver(rules_text, fact_tables=fact_tables)
+
+    for index in range(0, fact_count, max(1, fact_count // 200)):
+        solver.find_solutions("two_steps(n{0}, Z)".format(index))
+    gc.collect()
+
+    # Every worker measures itself while all of the others are still alive, so
+    # the shared pages are split between all of them.
+    barrier.wait()
+    results.put(memory_kilobytes())
+    barrier.wait()
+
+
+def measure(fact_count, worker_count, fork, freeze, fact_tables):
+    """Return the mean RSS, PSS and USS of the workers in megabytes"""
+    context = multiprocessing.get_context("fork")
+    rules_text = make_rules(fact_count)
+
+    solver = None
+    if fork:
+        solver = Solver(rules_text, fact_tables=fact_tables)
+        if freeze:
+            solver.database.freeze()
+
+    barrier = context.Barrier(worker_count)
+    results = context.Queue()
+    processes = [
+        context.Process(
+            target=worker,
+            args=(
+                solver,
+                rules_text,
+                fact_tables,
+                fact_count,
+                barrier,
+                results,
+            ),
+        )
+        for _ in range(worker_count)
+    ]
+    for process in processes:
+        process.start()
+
+    memory = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    if solver is not None and freeze:
+        solver.database.unfreeze()
+
+    return [statistics.mean(values) / 1024 for values in zip(*memory)]
+
+
+def main():
+    fact_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    worker_count = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    print(
+        "{} facts, {} workers, mean per worker in MB".format(
+            fact_count, worker_count
+        )
+    )
+    print("{:<30} {:>8} {:>8} {:>8}".format("", "RSS", "PSS", "USS"))
+    for name, options in SCENARIOS:
+        rss, pss, uss = measure(fact_count, worker_count, **options)
+        print("{:<30} {:8.1f} {:8.1f} {:8.1f}".format(name, rss, pss, uss))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Measure the cold start time of prologpy.
+
+Every measurement runs in a fresh Python process, since modules are only ever
+imported once per process. We report the median of several runs for:
+
+- importing the package,
+- importing the package and solving a small query,
+- importing every submodule up front, which is what importing the package used
+  to cost before its submodules were loaded lazily.
+
+Usage: python benchmarks/import_time.py [runs]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    ("import prologpy", "import prologpy"),
+    (
+        "import and solve",
+        "import prologpy\n"
+        "solver = prologpy.Solver('parent(a, b). parent(b, c).')\n"
+        "solver.find_solutions('parent(X, c)')",
+    ),
+    (
+        "import all submodules",
+        "import prologpy.solver, prologpy.datalog, prologpy.columns, "
+        "prologpy.distinct, prologpy.sqlite_tables, prologpy.builtins, "
+        "prologpy.indexing",
+    ),
+]
+
+
+def measure(code, runs):
+    """Return the median wall time in milliseconds of running the code in a new
+    interpreter. """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+    baseline = measure("pass", runs)
+    for name, code in SCENARIOS:
+        timing = measure(code, runs)
+        print(
+            "{:<24} {:8.1f} ms  ({:+.1f} ms over startup)".format(
+                name, timing, timing - baseline
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,32 @@
-from tkinter import Tk, Text, Menu, filedialog, Label, Button, END, W, E, FALSE
+import queue
+import threading
+
+from tkinter import (
+    Tk,
+    Text,
+    Menu,
+    filedialog,
+    Label,
+    Button,
+    END,
+    W,
+    E,
+    FALSE,
+    DISABLED,
+    NORMAL,
+)
 from tkinter.scrolledtext import ScrolledText
+from prologpy.context import QueryCancelled, QueryContext
+from prologpy.interpreter import query_variables
+from prologpy.parser import Parser
 from prologpy.solver import Solver
 
+# How often (in milliseconds) the editor checks for answers from the worker
+# thread, and the most answers it displays per check so the window stays
+# responsive while a query produces answers quickly.
+POLL_INTERVAL = 50
+MAX_ANSWERS_PER_POLL = 200
+
 
 def is_file_path_selected(file_path):
     return file_path is not None and file_path != ""
@@ -23,6 +48,15 @@ class Editor(object):
         self.file_path = None
         self.root.title("Prolog Interpreter")
 
+        # Queries run on a worker thread which sends its results back through a
+        # queue. The solver is kept between runs, and when the rules text changes
+        # only the edited clauses are parsed again.
+        self.solver = None
+        self.solver_rules_text = None
+        self.results = queue.Queue()
+        self.context = None
+        self.answer_count = 0
+
         # Create a rule label
 
         self.rule_editor_label = Label(
@@ -80,10 +114,20 @@ class Editor(object):
             root, text="Query Solutions:", padx=10, pady=1
         )
 
-        self.solutions_label.grid(
-            sticky="W", row=4, column=0, columnspan=2, padx=10, pady=3
+        self.solutions_label.grid(sticky="W", row=4, column=0, padx=10, pady=3)
+
+        # Create a stop button which cancels the running query
+
+        self.stop_button = Button(
+            root,
+            text="Stop",
+            width=20,
+            command=self.stop_query,
+            state=DISABLED,
         )
 
+        self.stop_button.grid(sticky=E, row=4, column=1, pady=3, padx=10)
+
         # Create a text box which we'll use to display our Prolog query solutions:
 
         self.solutions_display = ScrolledText(
@@ -94,6 +138,14 @@ class Editor(object):
             row=5, column=0, columnspan=2, padx=10, pady=7
         )
 
+        # Create a status line showing the progress of the running query
+
+        self.status_label = Label(root, text="", padx=10, pady=1)
+
+        self.status_label.grid(
+            sticky=W, row=6, column=0, columnspan=2, padx=10, pady=3
+        )
+
         # Finally, let's create the file menu
         self.menu_bar = self.create_file_menu()
 
@@ -137,8 +189,12 @@ class Editor(object):
         self.root.config(cursor="")
 
     def run_query(self):
-        """Interpret the entered rules and query and display the results in the
-        solutions text box """
+        """Start solving the entered query against the entered rules on a worker
+        thread. The answers are displayed as they're found. """
+
+        # Only one query runs at a time
+        if self.context is not None:
+            return
 
         # Delete all of the text in our solutions display text box
         self.solutions_display.delete("1.0", END)
@@ -149,44 +205,151 @@ class Editor(object):
         rules_text = self.rule_editor.get(1.0, "end-1c")
         query_text = self.query_editor.get(1.0, "end-1c")
 
-        # Create a new solver so we can try to query for solutions.
+        self.context = QueryContext()
+        self.answer_count = 0
+        self.results = queue.Queue()
+
+        self.run_button.config(state=DISABLED)
+        self.stop_button.config(state=NORMAL)
+
+        threading.Thread(
+            target=self.solve_query,
+            args=(rules_text, query_text, self.context, self.results),
+            daemon=True,
+        ).start()
+
+        self.root.after(POLL_INTERVAL, self.poll_results)
+
+    def get_solver(self, rules_text):
+        """Return a solver for the rules text. The previous solver is reused, and
+        if the rules changed since the last run, its database is patched with
+        just the clauses which were added, removed or edited. """
+        if self.solver is None:
+            # The solver is filled through update_rules, so the text of every
+            # clause is kept from the start and the first edit is incremental too
+            self.solver = Solver("")
+            self.solver.update_rules(rules_text)
+            self.solver_rules_text = rules_text
+        elif rules_text != self.solver_rules_text:
+            self.solver.update_rules(rules_text)
+            self.solver_rules_text = rules_text
+        return self.solver
+
+    def solve_query(self, rules_text, query_text, context, results):
+        """Solve the query on the worker thread and put every result on the
+        results queue: ("answer", solution) for each answer, followed by one of
+        ("done", has_variables), ("cancelled", None) or ("error", (message,
+        exception)). """
+
+        # Create (or reuse) a solver so we can try to query for solutions.
         try:
-            solver = Solver(rules_text)
+            solver = self.get_solver(rules_text)
         except Exception as e:
-            self.handle_exception("Error processing prolog rules.", str(e))
+            results.put(("error", ("Error processing prolog rules.", e)))
             return
 
         # Attempt to find the solutions and handle any exceptions gracefully
         try:
-            solutions = solver.find_solutions(query_text)
+            has_variables = bool(
+                query_variables(Parser(query_text).parse_query())
+            )
+
+            for solution in solver.iter_solutions(query_text, context=context):
+                results.put(("answer", solution))
+
+                # A query without variables is answered by its first solution
+                if not solution:
+                    break
+
+        except QueryCancelled:
+            results.put(("cancelled", None))
+            return
+
         except Exception as e:
-            self.handle_exception("Error processing prolog query.", str(e))
+            results.put(("error", ("Error processing prolog query.", e)))
+            return
+
+        results.put(("done", has_variables))
+
+    def poll_results(self):
+        """Display the results the worker thread has produced since the last poll
+        and schedule the next poll until the query has finished. """
+        finished = False
+
+        for _ in range(MAX_ANSWERS_PER_POLL):
+            try:
+                kind, value = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if kind == "answer":
+                self.show_answer(value)
+            else:
+                self.show_end_of_query(kind, value)
+                finished = True
+                break
+
+        self.update_status(finished)
+
+        if finished:
+            self.context = None
+            self.run_button.config(state=NORMAL)
+            self.stop_button.config(state=DISABLED)
+            self.set_not_busy()
+        else:
+            self.root.after(POLL_INTERVAL, self.poll_results)
+
+    def show_answer(self, solution):
+        self.answer_count += 1
+
+        # If our query has no variables, we simply display a 'Yes'
+        if not solution:
+            self.solutions_display.insert(END, "Yes.\n")
             return
 
-        # If our query returns a boolean, we simply display a 'Yes' or a 'No'
-        # depending on its value
-        if isinstance(solutions, bool):
-            self.solutions_display.insert(END, "Yes." if solutions else "No.")
+        # Otherwise we display the variable name to value mappings
+        self.solutions_display.insert(
+            END,
+            ", ".join(
+                "{} = {}".format(variable, value)
+                for variable, value in solution.items()
+            )
+            + "\n",
+        )
+        self.solutions_display.see(END)
+
+    def show_end_of_query(self, kind, value):
+        if kind == "error":
+            error_message, exception = value
+            self.handle_exception(error_message, str(exception))
+
+        elif kind == "cancelled":
+            self.solutions_display.insert(END, "Query stopped.\n")
 
-        # Our solver returned a map, so we display the variable name to value mappings
-        elif isinstance(solutions, dict):
+        elif self.answer_count == 0:
+            # We know we have no matching solutions in this instance so we
+            # provide relevant feedback. A query without variables is simply
+            # answered with a 'No'.
             self.solutions_display.insert(
-                END,
-                "\n".join(
-                    "{} = {}"
-                    # If our solution is a list contining one item, we show that
-                    # item, otherwise we display the entire list
-                    .format(variable, value[0] if len(value) == 1 else value)
-                    for variable, value in solutions.items()
-                ),
+                END, "No solutions found.\n" if value else "No.\n"
             )
-        else:
 
-            # We know we have no matching solutions in this instance so we provide
-            # relevant feedback
-            self.solutions_display.insert(END, "No solutions found.")
+    def update_status(self, finished):
+        context = self.context
+        self.status_label.config(
+            text="{} {} answers, {:,} inferences ({:,.0f} inferences/sec)".format(
+                "Finished:" if finished else "Running:",
+                self.answer_count,
+                context.inferences,
+                context.inferences_per_second,
+            )
+        )
 
-        self.set_not_busy()
+    def stop_query(self):
+        """Cancel the running query. The worker thread stops the next time the
+        search tries to prove a goal. """
+        if self.context is not None:
+            self.context.cancel()
 
     def handle_exception(self, error_message, exception=""):
         """Handle the exception by printing an error message as well as exception in
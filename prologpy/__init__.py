@@ -1 +1,15 @@
-from prologpy.solver import Solver
+"""A Prolog interpreter written in Python.
+
+The submodules are imported the first time one of their names is used, so that
+importing the package itself stays cheap for short lived processes.
+"""
+
+__all__ = ["Solver"]
+
+
+def __getattr__(name):
+    if name == "Solver":
+        from prologpy.solver import Solver
+
+        return Solver
+    raise AttributeError("module 'prologpy' has no attribute " + repr(name))
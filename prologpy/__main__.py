@@ -0,0 +1,189 @@
+"""Run queries against rule files from the command line.
+
+    python -m prologpy rules.pl [more_rules.pl ...] [--queries FILE]
+        [--limit N] [--timeout SECONDS] [--jobs N] [--distinct]
+
+Queries are read one per line from the queries file, or from stdin. Every answer
+is written to stdout as one JSON object per line (NDJSON) as soon as it's found:
+
+    {"query": "parent(X, c)", "answer": {"X": "b"}}
+
+and every query ends with a line reporting how it finished:
+
+    {"query": "parent(X, c)", "answers": 1, "inferences": 3, "seconds": 0.0001}
+
+A query which fails to parse, raises an error or times out reports an "error"
+field in its last line instead. With --jobs N, the queries are solved by N worker
+processes, and the lines of each query are written once it has finished, in the
+order the queries were read.
+
+With --serve, the rules stay loaded and queries are answered for any number of
+clients over TCP (--host, --port) or a Unix socket (--socket), see
+prologpy.server. --jobs then sets the number of query threads and --timeout the
+default timeout of a query.
+"""
+
+import argparse
+import json
+import sys
+from itertools import chain
+
+from prologpy.interpreter import Database
+from prologpy.messages import DEFAULT_PORT, query_messages
+from prologpy.parser import parse_rules_from_lines
+from prologpy.solver import Solver
+
+# The solver used by the worker processes. Forked workers inherit the solver of
+# the parent process, other workers load the rule files again.
+_worker_solver = None
+_worker_options = None
+
+
+def load_solver(rule_paths):
+    """Return a solver for the rules in the files, which are parsed rule by rule
+    as they're read. """
+    rule_files = [open(path) for path in rule_paths]
+    try:
+        rules = list(
+            chain.from_iterable(
+                parse_rules_from_lines(rule_file) for rule_file in rule_files
+            )
+        )
+    finally:
+        for rule_file in rule_files:
+            rule_file.close()
+
+    return Solver.from_database(Database(rules))
+
+
+def run_query(solver, query_text, options):
+    """Return a generator over the output lines for one query"""
+    for message in query_messages(
+        solver,
+        query_text,
+        limit=options.limit,
+        timeout=options.timeout,
+        distinct=options.distinct,
+    ):
+        yield json.dumps(message)
+
+
+def _init_worker(rule_paths, options):
+    global _worker_solver, _worker_options
+    if _worker_solver is None:
+        _worker_solver = load_solver(rule_paths)
+    _worker_options = options
+
+
+def _run_worker_query(query_text):
+    return list(run_query(_worker_solver, query_text, _worker_options))
+
+
+def read_queries(query_file):
+    """Return a generator over the queries in the file, one per line. Blank lines
+    and lines starting with '%' are skipped. """
+    for line in query_file:
+        query_text = line.strip()
+        if query_text and not query_text.startswith("%"):
+            yield query_text
+
+
+def main(arguments=None):
+    argument_parser = argparse.ArgumentParser(
+        prog="python -m prologpy",
+        description="Run Prolog queries and write the answers as NDJSON.",
+    )
+    argument_parser.add_argument(
+        "rules", nargs="+", help="files containing the rules to load"
+    )
+    argument_parser.add_argument(
+        "--queries",
+        help="file containing one query per line (defaults to stdin)",
+    )
+    argument_parser.add_argument(
+        "--limit", type=int, help="maximum number of answers per query"
+    )
+    argument_parser.add_argument(
+        "--timeout", type=float, help="maximum number of seconds per query"
+    )
+    argument_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of worker processes solving queries in parallel",
+    )
+    argument_parser.add_argument(
+        "--distinct",
+        action="store_true",
+        help="only report each distinct answer once",
+    )
+    argument_parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="keep the rules loaded and answer queries from clients over TCP "
+        "or a Unix socket instead of reading queries",
+    )
+    argument_parser.add_argument(
+        "--host", default="127.0.0.1", help="address the server listens on"
+    )
+    argument_parser.add_argument(
+        "--port",
+        type=int,
+        default=DEFAULT_PORT,
+        help="TCP port the server listens on",
+    )
+    argument_parser.add_argument(
+        "--socket", help="Unix socket path the server listens on"
+    )
+    options = argument_parser.parse_args(arguments)
+
+    global _worker_solver
+    _worker_solver = load_solver(options.rules)
+
+    if options.serve:
+        from prologpy.server import serve
+
+        serve(
+            _worker_solver,
+            host=options.host,
+            port=options.port,
+            path=options.socket,
+            max_workers=options.jobs if options.jobs > 1 else None,
+            timeout=options.timeout,
+        )
+        return
+
+    query_file = open(options.queries) if options.queries else sys.stdin
+    try:
+        queries = read_queries(query_file)
+
+        if options.jobs <= 1:
+            for query_text in queries:
+                for line in run_query(_worker_solver, query_text, options):
+                    print(line, flush=True)
+            return
+
+        # The worker processes are only imported and started when they're needed
+        import multiprocessing
+
+        # Forked workers keep sharing the pages of the loaded rules
+        _worker_solver.database.freeze()
+
+        with multiprocessing.Pool(
+            options.jobs,
+            initializer=_init_worker,
+            initargs=(options.rules, options),
+        ) as pool:
+            _worker_solver.database.unfreeze()
+
+            for lines in pool.imap(_run_worker_query, queries):
+                for line in lines:
+                    print(line)
+                sys.stdout.flush()
+    finally:
+        if query_file is not sys.stdin:
+            query_file.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""Builtin predicates implemented in Python.
+
+Every builtin is a function taking the database, the goal, the frame of the goal
+variables and the current bindings, and returning a generator over the bindings
+which prove the goal, just like Database._solve_goal does for regular rules.
+"""
+
+from prologpy.clpfd import CLPFD_BUILTINS
+from prologpy.interpreter import Term, Variable, make_list, term_key
+
+
+def _unify_result(bindings, term, frame, result):
+    """Unify the term with a result built from resolved terms.
+
+    Any variables left in the result are numbered like the variables of a clause
+    and get a fresh frame of slots, so they become new variables of the search
+    which don't share anything with the solutions they were copied from. """
+    variables = {}
+    result = result._rename_variables(variables)
+    result_frame, bindings = bindings.allocate(len(variables))
+    return bindings.unify(term, frame, result, result_frame)
+
+
+def _number(term):
+    """Return the value of a number term, or raise an exception if the term isn't
+    a number. """
+    if (
+        isinstance(term, Variable)
+        or term.arguments
+        or not isinstance(term.functor, (int, float))
+    ):
+        raise Exception("Expected a number but got " + str(term))
+    return term.functor
+
+
+def findall(database, goal, frame, bindings):
+    """findall(Template, Goal, List): List holds a copy of the template for every
+    solution of the goal, in the order they were found. """
+    template, sub_goal, result = goal.arguments
+
+    items = [
+        solution.resolve(template, frame)
+        for solution in sub_goal._solve(database, frame, bindings)
+    ]
+
+    matching_bindings = _unify_result(
+        bindings, result, frame, make_list(items)
+    )
+    if matching_bindings is not None:
+        yield matching_bindings
+
+
+def _witness_variables(template, sub_goal, frame, bindings):
+    """Return the free variables of the goal which don't occur in the template.
+
+    The variables are returned as variables of the first frame numbered with the
+    slot of their representative, so they can be resolved and unified directly
+    against any bindings extending the current ones. """
+    variables = {}
+    bindings.resolve(template, frame, variables)
+    template_slots = set(variables)
+    bindings.resolve(sub_goal, frame, variables)
+
+    witness_variables = []
+    for slot, variable in variables.items():
+        if slot not in template_slots:
+            witness_variable = Variable(variable.name)
+            witness_variable.index = slot
+            witness_variables.append(witness_variable)
+
+    return Term("witness", witness_variables)
+
+
+def _bags(database, goal, frame, bindings, unique):
+    """Return a generator over the bindings of bagof/3 and setof/3.
+
+    Solutions are grouped by the values of the free variables of the goal, and
+    the groups are returned in the standard order of those values. With unique
+    set, duplicate solutions are dropped by their term key and each bag is
+    sorted. """
+    template, sub_goal, result = goal.arguments
+    witness = _witness_variables(template, sub_goal, frame, bindings)
+
+    groups = {}
+    for solution in sub_goal._solve(database, frame, bindings):
+        # The witness and the template share one variables map, so variables
+        # left unbound in both are copied as the same variable.
+        variables = {}
+        witness_value = solution.resolve(witness, 0, variables)
+        item = solution.resolve(template, frame, variables)
+
+        witness_key = term_key(witness_value)
+        group = groups.get(witness_key)
+        if group is None:
+            group = groups[witness_key] = (witness_value, {}, [])
+
+        if unique:
+            group[1].setdefault(term_key(item), item)
+        else:
+            group[2].append(item)
+
+    for key in sorted(groups):
+        witness_value, unique_items, items = groups[key]
+
+        if unique:
+            items = [
+                unique_items[item_key] for item_key in sorted(unique_items)
+            ]
+
+        renamed = Term("bag", [witness_value, make_list(items)])
+        variables = {}
+        renamed = renamed._rename_variables(variables)
+        bag_frame, bag_bindings = bindings.allocate(len(variables))
+
+        matching_bindings = bag_bindings.unify(
+            witness, 0, renamed.arguments[0], bag_frame
+        )
+        if matching_bindings is not None:
+            matching_bindings = matching_bindings.unify(
+                result, frame, renamed.arguments[1], bag_frame
+            )
+        if matching_bindings is not None:
+            yield matching_bindings
+
+
+def bagof(database, goal, frame, bindings):
+    """bagof(Template, Goal, Bag): like findall/3, but fails when the goal has no
+    solutions and backtracks over the values of the free goal variables. """
+    yield from _bags(database, goal, frame, bindings, unique=False)
+
+
+def setof(database, goal, frame, bindings):
+    """setof(Template, Goal, Set): like bagof/3, but every set is sorted in the
+    standard order of terms and holds no duplicates. """
+    yield from _bags(database, goal, frame, bindings, unique=True)
+
+
+def aggregate_all(database, goal, frame, bindings):
+    """aggregate_all(Spec, Goal, Result) where Spec is count, sum(Expr),
+    max(Expr) or min(Expr).
+
+    The aggregate is updated as each solution is found, so only the running
+    value is kept in memory rather than a list of the solutions. max and min
+    fail when the goal has no solutions. """
+    spec, sub_goal, result = goal.arguments
+    spec, spec_frame = bindings.dereference(spec, frame)
+
+    if isinstance(spec, Variable):
+        raise Exception("Unbound aggregate_all specification")
+
+    solutions = sub_goal._solve(database, frame, bindings)
+
+    if spec.functor == "count" and not spec.arguments:
+        value = 0
+        for _ in solutions:
+            value += 1
+
+    elif spec.functor in ("sum", "max", "min") and len(spec.arguments) == 1:
+        expression = spec.arguments[0]
+        value = 0 if spec.functor == "sum" else None
+
+        for solution in solutions:
+            number = _number(solution.resolve(expression, spec_frame))
+            if spec.functor == "sum":
+                value += number
+            elif value is None:
+                value = number
+            elif spec.functor == "max":
+                value = max(value, number)
+            else:
+                value = min(value, number)
+
+        if value is None:
+            return
+
+    else:
+        raise Exception("Unknown aggregate_all specification: " + str(spec))
+
+    matching_bindings = bindings.unify(result, frame, Term(value), 0)
+    if matching_bindings is not None:
+        yield matching_bindings
+
+
+def _first_solution(database, goal, frame, bindings):
+    """Return the bindings of the first solution of the goal, or None if it has
+    none. The search is closed as soon as the solution is found, so none of the
+    choice points left within the goal are kept around or ever resumed. """
+    solutions = goal._solve(database, frame, bindings)
+    try:
+        return next(solutions, None)
+    finally:
+        solutions.close()
+
+
+def negation(database, goal, frame, bindings):
+    """\\+ Goal: succeeds once, without binding anything, if the goal has no
+    solutions (negation as failure). """
+    if _first_solution(database, goal.arguments[0], frame, bindings) is None:
+        yield bindings
+
+
+def if_then(database, goal, frame, bindings):
+    """(Condition -> Then): proves Then for the first solution of the condition,
+    and fails if the condition has none. """
+    condition, then = goal.arguments
+    condition_bindings = _first_solution(database, condition, frame, bindings)
+    if condition_bindings is not None:
+        yield from then._solve(database, frame, condition_bindings)
+
+
+def disjunction(database, goal, frame, bindings):
+    """(Either ; Or): the solutions of Either followed by those of Or. When
+    Either is (Condition -> Then), this is an if-then-else which proves Or only
+    if the condition has no solutions. """
+    either, other = goal.arguments
+    either, either_frame = bindings.dereference(either, frame)
+
+    if (
+        not isinstance(either, Variable)
+        and either.functor == "->"
+        and len(either.arguments) == 2
+    ):
+        condition, then = either.arguments
+        condition_bindings = _first_solution(
+            database, condition, either_frame, bindings
+        )
+        if condition_bindings is None:
+            yield from other._solve(database, frame, bindings)
+        else:
+            yield from then._solve(database, either_frame, condition_bindings)
+        return
+
+    yield from either._solve(database, either_frame, bindings)
+    yield from other._solve(database, frame, bindings)
+
+
+BUILTINS = {
+    ("\\+", 1): negation,
+    ("->", 2): if_then,
+    (";", 2): disjunction,
+    ("findall", 3): findall,
+    ("bagof", 3): bagof,
+    ("setof", 3): setof,
+    ("aggregate_all", 3): aggregate_all,
+    **CLPFD_BUILTINS,
+}
@@ -0,0 +1,171 @@
+"""A client for the query server in prologpy.server.
+
+The client keeps a pool of open connections, so consecutive queries don't pay
+for a new connection each time:
+
+    client = QueryClient(port=7474)
+    for solution in client.query("parent(X, c)"):
+        print(solution["X"])
+
+Only the standard library is needed, so the client can be used by processes
+which never load any rules themselves.
+"""
+
+import socket
+import threading
+from contextlib import contextmanager
+from itertools import count
+
+from prologpy.messages import (
+    DEFAULT_PORT,
+    HEADER,
+    decode_length,
+    decode_message,
+    encode_message,
+)
+
+
+class QueryError(Exception):
+    """Raised when the server reports an error for a query"""
+
+
+class Connection(object):
+    """One connection to the server, sending and receiving whole messages"""
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.file = sock.makefile("rb")
+
+    def send(self, message):
+        self.socket.sendall(encode_message(message))
+
+    def receive(self):
+        header = self.file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ConnectionError("Connection closed by the server")
+
+        length = decode_length(header)
+        body = self.file.read(length)
+        if len(body) < length:
+            raise ConnectionError("Connection closed by the server")
+        return decode_message(body)
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+
+class QueryClient(object):
+    """A thread-safe client for a query server listening on the Unix socket path
+    if one is given, otherwise on the TCP host and port.
+
+    Every query borrows a connection from the pool and gives it back once all of
+    its messages have been read, even if the query failed on the server. A
+    query which is abandoned half way through, or whose connection fails,
+    closes its connection instead, since the rest of its answers may still be
+    on the way. At most max_idle connections are kept open. """
+
+    def __init__(
+        self, host="127.0.0.1", port=DEFAULT_PORT, path=None, max_idle=4
+    ):
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+        self._ids = count(1)
+
+    def _connect(self):
+        if self.path is not None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.connect(self.path)
+        else:
+            sock = socket.create_connection((self.host, self.port))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return Connection(sock)
+
+    @contextmanager
+    def connection(self):
+        """Lend out a connection and return it to the pool if it was used up
+        cleanly. """
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+
+        if connection is None:
+            connection = self._connect()
+
+        reusable = False
+        try:
+            yield connection
+            reusable = True
+        finally:
+            if reusable:
+                with self._lock:
+                    if len(self._idle) < self.max_idle:
+                        self._idle.append(connection)
+                        connection = None
+            if connection is not None:
+                connection.close()
+
+    def _request(self, query_text, limit, timeout, distinct):
+        request = {"id": next(self._ids), "query": query_text}
+        if limit is not None:
+            request["limit"] = limit
+        if timeout is not None:
+            request["timeout"] = timeout
+        if distinct:
+            request["distinct"] = True
+        return request
+
+    def query(self, query_text, limit=None, timeout=None, distinct=False):
+        """Return a generator over the solutions of the query, one dict of query
+        variable names to JSON values per answer, as the server streams them.
+        Raises QueryError if the query fails on the server. """
+        with self.connection() as connection:
+            connection.send(
+                self._request(query_text, limit, timeout, distinct)
+            )
+
+            while True:
+                message = connection.receive()
+                if "answer" not in message:
+                    break
+                yield message["answer"]
+
+        # An error is reported in the last message of the query, which leaves
+        # the connection usable, so it's back in the pool before we raise.
+        if "error" in message:
+            raise QueryError(message["error"])
+
+    def query_all(self, queries, limit=None, timeout=None, distinct=False):
+        """Send all of the queries on one connection without waiting for any of
+        them to finish, and return a list with one (solutions, summary) pair per
+        query, in order. Errors are reported in the summaries. """
+        with self.connection() as connection:
+            requests = [
+                self._request(query_text, limit, timeout, distinct)
+                for query_text in queries
+            ]
+            for request in requests:
+                connection.send(request)
+
+            results = {request["id"]: ([], None) for request in requests}
+            pending = len(requests)
+            while pending:
+                message = connection.receive()
+                solutions, _ = results[message["id"]]
+                if "answer" in message:
+                    solutions.append(message["answer"])
+                else:
+                    results[message["id"]] = (solutions, message)
+                    pending -= 1
+
+            return [results[request["id"]] for request in requests]
+
+    def close(self):
+        """Close the idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
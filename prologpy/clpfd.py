@@ -0,0 +1,693 @@
+"""Constraints over finite domains of integers.
+
+Constraints are posted with builtin predicates:
+
+    X in 1..9            X can only take the values from 1 to 9
+    [X, Y] ins 0..5      the same for every variable of a list
+    X + Y #= 2 * Z       the linear expressions are equal
+    X #\\= Y + 1          the linear expressions are different
+    all_different(List)  the elements of the list are pairwise different
+    label(List)          tries the values left for each variable in turn
+
+The domain of a variable and the constraints on it are stored as an attribute of
+the variable in the bindings (see Bindings). Posting a constraint, narrowing a
+domain or binding a constrained variable wakes up the constraints on it, which
+narrow the domains of the other variables in turn until nothing changes any more
+or some domain runs empty, in which case the branch fails. A domain narrowed to
+a single value binds its variable. Linear constraints keep the bounds of their
+variables consistent, and differences remove the values of bound variables from
+the domains of the others, so most of the search space is pruned before label/1
+has to enumerate anything.
+"""
+
+from itertools import islice
+
+from prologpy.interpreter import Bindings, ListTerm, Term, Variable, _find
+from prologpy.persistent import PersistentMap
+
+
+def _ceil_div(numerator, denominator):
+    return -(-numerator // denominator)
+
+
+class Domain(object):
+    """The integers from low to high, without the values in holes. Either bound
+    may be None, for a domain which is unbounded on that side. Domains never
+    change, narrowing one returns a new domain. """
+
+    __slots__ = ("low", "high", "holes")
+
+    def __init__(self, low=None, high=None, holes=frozenset()):
+        # The bounds are moved inwards past the holes, so they're always part
+        # of the domain unless it's empty.
+        if holes:
+            while low is not None and low in holes:
+                low += 1
+            while high is not None and high in holes:
+                high -= 1
+            if low is not None and high is not None:
+                holes = frozenset(
+                    value for value in holes if low < value < high
+                )
+
+        self.low = low
+        self.high = high
+        self.holes = holes
+
+    @property
+    def empty(self):
+        return (
+            self.low is not None
+            and self.high is not None
+            and self.low > self.high
+        )
+
+    @property
+    def size(self):
+        """Return the number of values in the domain, or None if unbounded"""
+        if self.low is None or self.high is None:
+            return None
+        return max(0, self.high - self.low + 1 - len(self.holes))
+
+    def __contains__(self, value):
+        return (
+            (self.low is None or value >= self.low)
+            and (self.high is None or value <= self.high)
+            and value not in self.holes
+        )
+
+    def __eq__(self, other):
+        return (
+            self.low == other.low
+            and self.high == other.high
+            and self.holes == other.holes
+        )
+
+    def __ne__(self, other):
+        return not self == other
+
+    def intersect(self, low, high):
+        """Return the values of the domain from low to high"""
+        if low is not None and self.low is not None:
+            low = max(low, self.low)
+        elif low is None:
+            low = self.low
+        if high is not None and self.high is not None:
+            high = min(high, self.high)
+        elif high is None:
+            high = self.high
+        return Domain(low, high, self.holes)
+
+    def intersect_domain(self, other):
+        domain = self.intersect(other.low, other.high)
+        return Domain(domain.low, domain.high, domain.holes | other.holes)
+
+    def remove(self, value):
+        if value not in self:
+            return self
+        return Domain(self.low, self.high, self.holes | {value})
+
+    def values(self):
+        """Return a generator over the values in increasing order"""
+        if self.size is None:
+            raise Exception(
+                "Arguments are not sufficiently instantiated: unbounded "
+                "domain " + str(self)
+            )
+        for value in range(self.low, self.high + 1):
+            if value not in self.holes:
+                yield value
+
+    def __str__(self):
+        text = (
+            ("inf" if self.low is None else str(self.low))
+            + ".."
+            + ("sup" if self.high is None else str(self.high))
+        )
+        for hole in sorted(self.holes):
+            text += " \\ " + str(hole)
+        return text
+
+
+UNBOUNDED = Domain()
+
+
+class Attribute(object):
+    """The domain of a constrained variable and the propagators watching it"""
+
+    __slots__ = ("domain", "propagators")
+
+    def __init__(self, domain, propagators=()):
+        self.domain = domain
+        self.propagators = propagators
+
+
+class Store(object):
+    """The constraint store of one branch of the search while it's updated.
+
+    Bindings and attributes are changed in transients of the persistent maps of
+    the bindings. Narrowing a domain schedules the propagators of its variable,
+    and propagate() runs them until no more domains change. """
+
+    def __init__(self, bindings, values=None):
+        self.base = bindings
+        self.values = (
+            values if values is not None else bindings.values.transient()
+        )
+        attributes = bindings.attributes
+        if attributes is None:
+            attributes = PersistentMap()
+        self.attributes = attributes.transient()
+        self._queue = []
+        self._queued = set()
+
+    def dereference(self, term, frame):
+        """Follow the bindings of a variable until we reach a term or an unbound
+        variable. An unbound variable is returned with the slot of its
+        representative as its frame and None as the term. """
+        while isinstance(term, Variable):
+            root, value = _find(self.values, frame + term.index)
+            if value.__class__ is not tuple:
+                return None, root
+            term, frame = value
+        return term, frame
+
+    def value(self, term, frame):
+        """Return (slot, None) for an unbound variable, where slot is its
+        representative, or (None, value) for an integer. Any other term returns
+        (None, None). """
+        term, frame = self.dereference(term, frame)
+        if term is None:
+            return frame, None
+        if not term.arguments and isinstance(term.functor, int):
+            return None, term.functor
+        return None, None
+
+    def slot_value(self, slot):
+        """Like value(), for the variable in the slot"""
+        root, value = _find(self.values, slot)
+        if value.__class__ is not tuple:
+            return root, None
+        return self.value(*value)
+
+    def domain(self, slot):
+        attribute = self.attributes.get(slot)
+        return UNBOUNDED if attribute is None else attribute.domain
+
+    def restrict(self, slot, domain):
+        """Replace the domain of the unbound variable in the slot with a domain
+        which is a subset of it. Returns False if the new domain is empty. A
+        variable left with a single value is bound to it. """
+        attribute = self.attributes.get(slot)
+        old_domain = UNBOUNDED if attribute is None else attribute.domain
+        if domain == old_domain:
+            return True
+        if domain.empty:
+            return False
+
+        propagators = () if attribute is None else attribute.propagators
+        self.attributes[slot] = Attribute(domain, propagators)
+        self.schedule(propagators)
+
+        if domain.low is not None and domain.low == domain.high:
+            self.values[slot] = (Term(domain.low), 0)
+        return True
+
+    def narrow(self, slot, low, high):
+        """Keep only the values from low to high in the domain of the slot.
+        Returns False if none are left. """
+        return self.restrict(slot, self.domain(slot).intersect(low, high))
+
+    def exclude(self, slot, value):
+        return self.restrict(slot, self.domain(slot).remove(value))
+
+    def attach(self, slot, propagator):
+        """Wake the propagator whenever the variable in the slot changes"""
+        attribute = self.attributes.get(slot)
+        if attribute is None:
+            attribute = Attribute(UNBOUNDED)
+        self.attributes[slot] = Attribute(
+            attribute.domain, attribute.propagators + (propagator,)
+        )
+
+    def schedule(self, propagators):
+        for propagator in propagators:
+            if id(propagator) not in self._queued:
+                self._queued.add(id(propagator))
+                self._queue.append(propagator)
+
+    def propagate(self):
+        """Run the scheduled propagators until they reach a fixpoint. Returns
+        False if a constraint can't be satisfied. """
+        while self._queue:
+            propagator = self._queue.pop()
+            self._queued.discard(id(propagator))
+            if not propagator.propagate(self):
+                return False
+        return True
+
+    def bindings(self):
+        """Return the bindings holding the updated variables and attributes"""
+        base = self.base
+        return Bindings(
+            self.values.persistent(),
+            base.top,
+            base.occurs_check,
+            base.context,
+            self.attributes.persistent(),
+        )
+
+
+def wake(bindings, values, woken_slots):
+    """Finish a unification which bound or aliased attributed variables, given
+    the bindings it started from and the transient holding its updates. Returns
+    the new bindings, or None if the constraints reject the unification. """
+    store = Store(bindings, values)
+
+    for slot in woken_slots:
+        attribute = store.attributes.get(slot)
+        if attribute is None:
+            continue
+
+        root, value = _find(store.values, slot)
+        if value.__class__ is tuple:
+            # The variable was bound, which has to be to one of its values
+            _, number = store.value(*value)
+            if number is None or number not in attribute.domain:
+                return None
+        elif root != slot:
+            # The variable was aliased to another one, which takes over the
+            # domain and the constraints of both.
+            for propagator in attribute.propagators:
+                store.attach(root, propagator)
+            if not store.restrict(
+                root, store.domain(root).intersect_domain(attribute.domain)
+            ):
+                return None
+
+        store.schedule(attribute.propagators)
+
+    if not store.propagate():
+        return None
+    return store.bindings()
+
+
+class Linear(object):
+    """A constraint on the linear expression: the sum of coefficient * variable
+    for every (coefficient, slot) in terms, plus the constant. """
+
+    def __init__(self, terms, constant):
+        self.terms = terms
+        self.constant = constant
+
+    def _current(self, store):
+        """Return the coefficients of the unbound variables by slot along with
+        the constant, with the values of the bound variables folded in. Returns
+        None if a variable was bound to something other than an integer. """
+        coefficients = {}
+        constant = self.constant
+        for coefficient, slot in self.terms:
+            slot, number = store.slot_value(slot)
+            if slot is not None:
+                coefficients[slot] = coefficients.get(slot, 0) + coefficient
+            elif number is None:
+                return None
+            else:
+                constant += coefficient * number
+        return (
+            {
+                slot: coefficient
+                for slot, coefficient in coefficients.items()
+                if coefficient
+            },
+            constant,
+        )
+
+
+class LinearEqual(Linear):
+    """The expression equals 0. Every variable is narrowed to the values which
+    the bounds of the other variables allow (bounds consistency). """
+
+    def propagate(self, store):
+        current = self._current(store)
+        if current is None:
+            return False
+        coefficients, constant = current
+
+        if not coefficients:
+            return constant == 0
+
+        # The bounds of coefficient * variable for every variable. A None bound
+        # is unbounded, and the bounds of the sum only count the finite ones.
+        ranges = []
+        low_sum = high_sum = 0
+        unbounded_lows = unbounded_highs = 0
+        for slot, coefficient in coefficients.items():
+            domain = store.domain(slot)
+            low, high = domain.low, domain.high
+            if coefficient < 0:
+                low, high = high, low
+            low = None if low is None else coefficient * low
+            high = None if high is None else coefficient * high
+
+            ranges.append((slot, coefficient, low, high))
+            if low is None:
+                unbounded_lows += 1
+            else:
+                low_sum += low
+            if high is None:
+                unbounded_highs += 1
+            else:
+                high_sum += high
+
+        for slot, coefficient, low, high in ranges:
+            # The other terms sum to between others_low and others_high, so
+            # this term lies between -constant - others_high and
+            # -constant - others_low.
+            if unbounded_highs - (high is None):
+                term_low = None
+            else:
+                term_low = -constant - (high_sum - (high or 0))
+            if unbounded_lows - (low is None):
+                term_high = None
+            else:
+                term_high = -constant - (low_sum - (low or 0))
+
+            if coefficient < 0:
+                term_low, term_high = term_high, term_low
+            new_low = (
+                None if term_low is None else _ceil_div(term_low, coefficient)
+            )
+            new_high = None if term_high is None else term_high // coefficient
+
+            if not store.narrow(slot, new_low, new_high):
+                return False
+
+        return True
+
+
+class LinearNotEqual(Linear):
+    """The expression doesn't equal 0. Once a single variable is left unbound,
+    the value which would make the expression 0 is removed from its domain. """
+
+    def propagate(self, store):
+        current = self._current(store)
+        if current is None:
+            return False
+        coefficients, constant = current
+
+        if not coefficients:
+            return constant != 0
+
+        if len(coefficients) == 1:
+            ((slot, coefficient),) = coefficients.items()
+            if constant % coefficient == 0:
+                return store.exclude(slot, -constant // coefficient)
+
+        return True
+
+
+class AllDifferent(object):
+    """The variables in the slots and the constant values are all different.
+
+    The value of every bound variable is removed from the domains of the others,
+    and the constraint fails once the unbound variables have fewer values left
+    between them than there are variables. """
+
+    def __init__(self, slots, constants):
+        self.slots = slots
+        self.constants = constants
+
+    def propagate(self, store):
+        values = set(self.constants)
+        unbound_slots = []
+
+        for slot in self.slots:
+            slot, number = store.slot_value(slot)
+            if slot is not None:
+                unbound_slots.append(slot)
+            elif number is None or number in values:
+                return False
+            else:
+                values.add(number)
+
+        # Two aliased variables are the same variable, so never different
+        if len(set(unbound_slots)) < len(unbound_slots):
+            return False
+
+        for slot in unbound_slots:
+            for value in values:
+                if not store.exclude(slot, value):
+                    return False
+
+        # Excluding values can bind variables, which schedules us again, so the
+        # counting check below only looks at the variables still unbound.
+        remaining_values = set()
+        for slot in unbound_slots:
+            domain = store.domain(slot)
+            size = domain.size
+            if size is None or size > len(unbound_slots):
+                return True
+            remaining_values.update(domain.values())
+
+        return len(remaining_values) >= len(unbound_slots)
+
+
+def _linear(store, term, frame):
+    """Return the integer expression as a dict of coefficients by the slot of
+    each unbound variable, along with the constant part. """
+    coefficients = {}
+    constant = 0
+    terms = [(term, frame, 1)]
+
+    while terms:
+        term, frame, factor = terms.pop()
+        term, frame = store.dereference(term, frame)
+
+        if term is None:
+            coefficients[frame] = coefficients.get(frame, 0) + factor
+
+        elif not term.arguments and isinstance(term.functor, int):
+            constant += factor * term.functor
+
+        elif term.functor in ("+", "-") and len(term.arguments) == 2:
+            left, right = term.arguments
+            terms.append((left, frame, factor))
+            terms.append(
+                (right, frame, factor if term.functor == "+" else -factor)
+            )
+
+        elif term.functor == "-" and len(term.arguments) == 1:
+            terms.append((term.arguments[0], frame, -factor))
+
+        elif term.functor == "*" and len(term.arguments) == 2:
+            left, right = [
+                _linear(store, argument, frame) for argument in term.arguments
+            ]
+            if left[0] and right[0]:
+                raise Exception(
+                    "Only linear constraints are supported: "
+                    + str(store.base.resolve(term, frame))
+                )
+            if left[0]:
+                left, right = right, left
+            # The left side is now a constant
+            multiplier = factor * left[1]
+            for slot, coefficient in right[0].items():
+                coefficients[slot] = (
+                    coefficients.get(slot, 0) + multiplier * coefficient
+                )
+            constant += multiplier * right[1]
+
+        else:
+            raise Exception(
+                "Expected an integer expression but got "
+                + str(store.base.resolve(term, frame))
+            )
+
+    return coefficients, constant
+
+
+def _range(store, term, frame):
+    """Return the bounds of a Low..High domain term"""
+    term, frame = store.dereference(term, frame)
+    if term is not None and term.functor == ".." and len(term.arguments) == 2:
+        bounds = [store.value(argument, frame) for argument in term.arguments]
+        if all(number is not None for _, number in bounds):
+            return bounds[0][1], bounds[1][1]
+    raise Exception(
+        "Expected a domain Low..High but got "
+        + str(store.base.resolve(term, frame) if term is not None else "_")
+    )
+
+
+def _list_items(store, term, frame):
+    """Return the (term, frame) pairs of the elements of a list"""
+    items = []
+    while True:
+        term, frame = store.dereference(term, frame)
+
+        if term is None:
+            raise Exception("Arguments are not sufficiently instantiated")
+
+        if term.__class__ is ListTerm:
+            items.extend(
+                (item, frame) for item in islice(term.items, term.start, None)
+            )
+            term = term.tail
+        elif term.functor == "." and len(term.arguments) == 2:
+            items.append((term.arguments[0], frame))
+            term = term.arguments[1]
+        elif term.functor == "[]" and not term.arguments:
+            return items
+        else:
+            raise Exception(
+                "Expected a list but got "
+                + str(store.base.resolve(term, frame))
+            )
+
+
+def _post_domain(store, term, frame, low, high):
+    slot, number = store.value(term, frame)
+    if slot is not None:
+        return store.narrow(slot, low, high)
+    if number is None:
+        raise Exception(
+            "Expected an integer or a variable but got "
+            + str(store.base.resolve(term, frame))
+        )
+    return low <= number <= high
+
+
+def fd_in(database, goal, frame, bindings):
+    """X in Low..High"""
+    store = Store(bindings)
+    term, domain = goal.arguments
+    low, high = _range(store, domain, frame)
+
+    if _post_domain(store, term, frame, low, high) and store.propagate():
+        yield store.bindings()
+
+
+def fd_ins(database, goal, frame, bindings):
+    """Vars ins Low..High"""
+    store = Store(bindings)
+    terms, domain = goal.arguments
+    low, high = _range(store, domain, frame)
+
+    for term, term_frame in _list_items(store, terms, frame):
+        if not _post_domain(store, term, term_frame, low, high):
+            return
+
+    if store.propagate():
+        yield store.bindings()
+
+
+def _post_linear(database, goal, frame, bindings, constraint_class):
+    store = Store(bindings)
+    left, right = goal.arguments
+
+    left_coefficients, left_constant = _linear(store, left, frame)
+    right_coefficients, right_constant = _linear(store, right, frame)
+
+    coefficients = dict(left_coefficients)
+    for slot, coefficient in right_coefficients.items():
+        coefficients[slot] = coefficients.get(slot, 0) - coefficient
+
+    constraint = constraint_class(
+        tuple(
+            (coefficient, slot)
+            for slot, coefficient in coefficients.items()
+            if coefficient
+        ),
+        left_constant - right_constant,
+    )
+    for _, slot in constraint.terms:
+        store.attach(slot, constraint)
+
+    store.schedule([constraint])
+    if store.propagate():
+        yield store.bindings()
+
+
+def fd_equal(database, goal, frame, bindings):
+    """Left #= Right, for linear integer expressions"""
+    yield from _post_linear(database, goal, frame, bindings, LinearEqual)
+
+
+def fd_not_equal(database, goal, frame, bindings):
+    """Left #\\= Right, for linear integer expressions"""
+    yield from _post_linear(database, goal, frame, bindings, LinearNotEqual)
+
+
+def all_different(database, goal, frame, bindings):
+    """all_different(List)"""
+    store = Store(bindings)
+    slots = []
+    constants = []
+
+    for term, term_frame in _list_items(store, goal.arguments[0], frame):
+        slot, number = store.value(term, term_frame)
+        if slot is not None:
+            slots.append(slot)
+        elif number is not None:
+            constants.append(number)
+        else:
+            raise Exception(
+                "Expected an integer or a variable but got "
+                + str(store.base.resolve(term, term_frame))
+            )
+
+    if len(set(constants)) < len(constants):
+        return
+
+    constraint = AllDifferent(tuple(slots), tuple(constants))
+    for slot in set(slots):
+        store.attach(slot, constraint)
+
+    store.schedule([constraint])
+    if store.propagate():
+        yield store.bindings()
+
+
+def label(database, goal, frame, bindings):
+    """label(List): bind the variables of the list to the values of their
+    domains, from left to right and from the smallest value up. """
+    items = _list_items(Store(bindings), goal.arguments[0], frame)
+    yield from _label(bindings, items, 0)
+
+
+def _label(bindings, items, position):
+    while position < len(items):
+        term, frame = items[position]
+        store = Store(bindings)
+        slot, number = store.value(term, frame)
+
+        if slot is None:
+            if number is None:
+                raise Exception(
+                    "Expected an integer or a variable but got "
+                    + str(bindings.resolve(term, frame))
+                )
+            position += 1
+            continue
+
+        # Binding the variable wakes its constraints through unification, which
+        # prunes the domains of the variables labelled after it.
+        for value in store.domain(slot).values():
+            value_bindings = bindings.unify(term, frame, Term(value), 0)
+            if value_bindings is not None:
+                yield from _label(value_bindings, items, position + 1)
+        return
+
+    yield bindings
+
+
+CLPFD_BUILTINS = {
+    ("in", 2): fd_in,
+    ("ins", 2): fd_ins,
+    ("#=", 2): fd_equal,
+    ("#\\=", 2): fd_not_equal,
+    ("all_different", 1): all_different,
+    ("label", 1): label,
+}
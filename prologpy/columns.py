@@ -0,0 +1,132 @@
+"""Column-oriented query results.
+
+A ResultTable stores one column of integer codes per query variable. The codes
+index into a symbol list shared by all of the columns, so each distinct value is
+stored once however many answers contain it, and a million answers take a few
+compact arrays instead of a million Python objects. The columns can be exported
+to NumPy or Arrow, which are only imported when they're used.
+"""
+
+from array import array
+
+from prologpy.interpreter import Variable
+
+# The code stored for a variable which the answer leaves unbound
+NULL_CODE = -1
+
+
+class ResultTable(object):
+    """Query answers stored as dictionary encoded columns.
+
+    Atoms are interned by their name (or value, for numbers) and compound terms
+    by their text, so reading a column back returns strings and ints rather than
+    terms. Answers are appended in batches, which keeps the per answer work down
+    to one symbol lookup per variable. """
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.symbols = []
+        self.codes = {name: array("q") for name in self.names}
+        self._symbol_codes = {}
+        self._length = 0
+
+    def _code(self, value):
+        if value is None or isinstance(value, Variable):
+            return NULL_CODE
+
+        symbol = value.functor if not value.arguments else str(value)
+
+        code = self._symbol_codes.get(symbol)
+        if code is None:
+            code = self._symbol_codes[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return code
+
+    def append_batch(self, rows):
+        """Append the rows, each a sequence holding one value per column"""
+        code = self._code
+        for position, name in enumerate(self.names):
+            self.codes[name].extend(code(row[position]) for row in rows)
+        self._length += len(rows)
+
+    def column(self, name):
+        """Return the decoded values of the column, with None for unbound
+        values. """
+        symbols = self.symbols
+        return [
+            None if code == NULL_CODE else symbols[code]
+            for code in self.codes[name]
+        ]
+
+    def _numpy_columns(self):
+        """Return a generator over (name, codes, integer values) for every
+        column, where integer values is None unless the column only holds
+        integers. The null code -1 indexes the entry after the last symbol. """
+        import numpy
+
+        is_int = numpy.array(
+            [isinstance(symbol, int) for symbol in self.symbols] + [False]
+        )
+        int_values = numpy.array(
+            [
+                symbol if isinstance(symbol, int) else 0
+                for symbol in self.symbols
+            ]
+            + [0],
+            dtype=numpy.int64,
+        )
+
+        for name in self.names:
+            codes = numpy.frombuffer(self.codes[name], dtype=numpy.int64)
+            if is_int[codes].all():
+                yield name, codes, int_values[codes]
+            else:
+                yield name, codes, None
+
+    def to_numpy(self):
+        """Return the answers as a NumPy structured array with one field per
+        variable. Columns which only hold integers become int64 fields, all other
+        columns become string fields with an empty string for unbound values. """
+        import numpy
+
+        strings = numpy.array(
+            [str(symbol) for symbol in self.symbols] + [""], dtype=str
+        )
+
+        fields = [
+            (name, strings[codes] if int_values is None else int_values)
+            for name, codes, int_values in self._numpy_columns()
+        ]
+
+        result = numpy.empty(
+            self._length,
+            dtype=[(name, values.dtype) for name, values in fields],
+        )
+        for name, values in fields:
+            result[name] = values
+        return result
+
+    def to_arrow(self):
+        """Return the answers as a pyarrow Table. Integer columns are plain int64
+        arrays, other columns are dictionary arrays over the string symbols with
+        nulls for unbound values. """
+        import pyarrow
+
+        dictionary = pyarrow.array([str(symbol) for symbol in self.symbols])
+
+        arrays = []
+        for name, codes, int_values in self._numpy_columns():
+            if int_values is not None:
+                arrays.append(pyarrow.array(int_values))
+            else:
+                arrays.append(
+                    pyarrow.DictionaryArray.from_arrays(
+                        pyarrow.array(codes, mask=codes == NULL_CODE),
+                        dictionary,
+                    )
+                )
+
+        return pyarrow.Table.from_arrays(arrays, names=self.names)
+
+    def __len__(self):
+        return self._length
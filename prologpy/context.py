@@ -0,0 +1,66 @@
+"""Per-query limits and counters.
+
+A QueryContext travels with the bindings of one query, and the engine calls its
+step() method once for every goal it tries to prove. The context counts these
+inferences and stops the search when the query is cancelled from another thread
+or runs past its deadline.
+"""
+
+import time
+
+
+class QueryCancelled(Exception):
+    """Raised inside a query which was cancelled while it was running"""
+
+
+class QueryTimeout(Exception):
+    """Raised inside a query which ran longer than its timeout"""
+
+
+class QueryContext(object):
+    """The limits and counters for one query.
+
+    The clock is only read every check_interval inferences, so a deadline costs
+    next to nothing on the hot path. Cancelling a context only sets a flag, which
+    makes it safe to do from any thread. A QueryTrace (see prologpy.trace) can
+    be given to record the box model events of the search, and a QueryMemory
+    (see prologpy.memory) to account for the memory it holds. """
+
+    def __init__(
+        self, timeout=None, check_interval=256, trace=None, memory=None
+    ):
+        self.inferences = 0
+        self.trace = trace
+        self.memory = memory
+        self.started = time.monotonic()
+        self.deadline = None if timeout is None else self.started + timeout
+        self.check_interval = check_interval
+        self.cancelled = False
+
+    def cancel(self):
+        """Stop the query the next time it tries to prove a goal"""
+        self.cancelled = True
+
+    def step(self):
+        """Count an inference and raise if the query has to stop"""
+        self.inferences += 1
+
+        if self.cancelled:
+            raise QueryCancelled("Query cancelled")
+
+        if (
+            self.deadline is not None
+            and self.inferences % self.check_interval == 0
+            and time.monotonic() > self.deadline
+        ):
+            raise QueryTimeout("Query timed out")
+
+    @property
+    def elapsed(self):
+        """Return the number of seconds since the query was started"""
+        return time.monotonic() - self.started
+
+    @property
+    def inferences_per_second(self):
+        elapsed = self.elapsed
+        return self.inferences / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,371 @@
+from prologpy.builtins import BUILTINS
+from prologpy.interpreter import (
+    Conjunction,
+    Term,
+    TRUE,
+    Variable,
+    query_variables,
+)
+
+
+def _is_constant(term):
+    """Return True if the term is an atom (a term without any arguments)"""
+    return (
+        isinstance(term, Term)
+        and not isinstance(term, (Conjunction, TRUE))
+        and len(term.arguments) == 0
+    )
+
+
+def _is_datalog_atom(term):
+    """Return True if the term is a predicate whose arguments are all atoms or
+    variables, i.e. the term contains no function symbols. """
+    if not isinstance(term, Term) or isinstance(term, (Conjunction, TRUE)):
+        return False
+    if (term.functor, len(term.arguments)) in BUILTINS:
+        return False
+    return all(
+        isinstance(argument, Variable) or _is_constant(argument)
+        for argument in term.arguments
+    )
+
+
+def _body_goals(tail):
+    """Return the list of goals which make up the tail of a rule"""
+    if isinstance(tail, TRUE):
+        return []
+    if isinstance(tail, Conjunction):
+        return list(tail.arguments)
+    return [tail]
+
+
+def _term_variables(term):
+    return [
+        argument
+        for argument in term.arguments
+        if isinstance(argument, Variable)
+    ]
+
+
+def is_datalog_rule(rule):
+    """Return True if the rule is a safe Datalog clause: the head and body goals
+    are function-free, facts are ground and every head variable also appears in
+    the body of the rule. """
+    if not _is_datalog_atom(rule.head):
+        return False
+
+    body = _body_goals(rule.tail)
+    if not all(_is_datalog_atom(goal) for goal in body):
+        return False
+
+    body_variables = set(
+        id(variable) for goal in body for variable in _term_variables(goal)
+    )
+    return all(
+        id(variable) in body_variables
+        for variable in _term_variables(rule.head)
+    )
+
+
+def is_datalog_program(rules):
+    """Return True if every rule in the program can be evaluated bottom-up"""
+    return all(is_datalog_rule(rule) for rule in rules)
+
+
+def _predicate_key(term):
+    return term.functor, len(term.arguments)
+
+
+class Relation(object):
+    """A set of ground tuples for one predicate. Hash indexes on any combination
+    of argument positions are built the first time a join asks for them and are
+    kept up to date as new tuples are added. """
+
+    def __init__(self):
+        self.tuples = set()
+        self._indexes = {}
+
+    def add(self, row):
+        """Add the row to the relation and return True if it was not present"""
+        if row in self.tuples:
+            return False
+
+        self.tuples.add(row)
+        for positions, index in self._indexes.items():
+            key = tuple(row[position] for position in positions)
+            index.setdefault(key, []).append(row)
+        return True
+
+    def lookup(self, positions, key):
+        """Return the rows whose values at the given positions equal the key"""
+        if not positions:
+            return self.tuples
+
+        index = self._indexes.get(positions)
+        if index is None:
+            index = {}
+            for row in self.tuples:
+                index.setdefault(
+                    tuple(row[position] for position in positions), []
+                ).append(row)
+            self._indexes[positions] = index
+
+        return index.get(key, ())
+
+    def __len__(self):
+        return len(self.tuples)
+
+
+class _CompiledGoal(object):
+    """A body goal compiled against the variable slots of its rule.
+
+    Every argument position is classified once, at compile time, so the join
+    loop only has to look values up: positions holding constants or variables
+    bound by an earlier goal of the join form the hash index key, the first
+    occurrence of a new variable assigns its slot, and any repeated occurrence
+    of that variable within the same goal becomes an equality check. The index
+    is the position of the goal within the rule body. """
+
+    def __init__(self, goal, index, slots, bound_slots):
+        self.key = _predicate_key(goal)
+        self.index = index
+
+        lookup_positions = []
+        self.key_parts = []
+        self.assignments = []
+        self.checks = []
+
+        assigned_here = set()
+
+        for position, argument in enumerate(goal.arguments):
+            if isinstance(argument, Variable):
+                slot = slots.setdefault(id(argument), len(slots))
+                if slot in bound_slots:
+                    lookup_positions.append(position)
+                    self.key_parts.append((False, slot))
+                elif slot in assigned_here:
+                    self.checks.append((position, slot))
+                else:
+                    assigned_here.add(slot)
+                    self.assignments.append((position, slot))
+            else:
+                lookup_positions.append(position)
+                self.key_parts.append((True, argument.functor))
+
+        self.lookup_positions = tuple(lookup_positions)
+        bound_slots.update(assigned_here)
+
+
+class _JoinPlan(object):
+    """The body goals of a rule compiled into a hash join in a fixed order"""
+
+    def __init__(self, head, body, order):
+        slots = {}
+        bound_slots = set()
+
+        self.goals = []
+        for goal_index in order:
+            self.goals.append(
+                _CompiledGoal(body[goal_index], goal_index, slots, bound_slots)
+            )
+
+        self.head_parts = [
+            (
+                (True, argument.functor)
+                if _is_constant(argument)
+                else (False, slots[id(argument)])
+            )
+            for argument in head.arguments
+        ]
+        self.slot_count = len(slots)
+
+
+class _CompiledRule(object):
+    """A Datalog rule compiled into hash join plans.
+
+    Queries and full evaluations join the body goals left to right. For every
+    body goal, there's also a plan which starts with that goal, used when it
+    draws from the delta of a semi-naive iteration: the few new rows then bind
+    the variables the other goals are looked up by, instead of every iteration
+    scanning the full relation of the first goal to probe the delta with. """
+
+    def __init__(self, head, body):
+        self.head_key = _predicate_key(head)
+        self.plan = _JoinPlan(head, body, range(len(body)))
+        self.delta_plans = [
+            _JoinPlan(
+                head,
+                body,
+                [delta_index]
+                + [
+                    goal_index
+                    for goal_index in range(len(body))
+                    if goal_index != delta_index
+                ],
+            )
+            for delta_index in range(len(body))
+        ]
+
+    def evaluate(self, relations, delta_index=None, delta=None):
+        """Return a generator over the head rows derived by joining the body goals.
+
+        When a delta index is given, the goal at that position only draws from
+        the delta rows, the goals before it in the rule body only from rows which
+        are not part of the delta, and the goals after it from the full
+        relations. This is the semi-naive rule which guarantees each new
+        derivation is found once per iteration. The delta goal is joined first,
+        which doesn't change which rows each goal draws from. """
+        plan = (
+            self.plan if delta_index is None else self.delta_plans[delta_index]
+        )
+        values = [None] * plan.slot_count
+        goals = plan.goals
+        head_parts = plan.head_parts
+        empty = Relation()
+
+        def join(step):
+            if step == len(goals):
+                yield tuple(
+                    value if is_constant else values[value]
+                    for is_constant, value in head_parts
+                )
+                return
+
+            goal = goals[step]
+            key = tuple(
+                value if is_constant else values[value]
+                for is_constant, value in goal.key_parts
+            )
+
+            if goal.index == delta_index:
+                source = delta.get(goal.key, empty)
+            else:
+                source = relations.get(goal.key, empty)
+
+            excluded = None
+            if delta_index is not None and goal.index < delta_index:
+                excluded = delta.get(goal.key)
+
+            for row in source.lookup(goal.lookup_positions, key):
+                if excluded is not None and row in excluded.tuples:
+                    continue
+                # The checks compare against slots assigned from this same row,
+                # so the assignments have to be made first.
+                for position, slot in goal.assignments:
+                    values[slot] = row[position]
+                if any(
+                    row[position] != values[slot]
+                    for position, slot in goal.checks
+                ):
+                    continue
+                yield from join(step + 1)
+
+        yield from join(0)
+
+
+class DatalogEngine(object):
+    """Evaluate a function-free program bottom-up using semi-naive iteration.
+
+    Every predicate is materialized into a Relation of ground tuples. Queries are
+    answered by a hash join over the materialized relations, and adding new facts
+    only propagates the consequences of those facts instead of recomputing the
+    whole fixpoint. """
+
+    def __init__(self, rules):
+        self.relations = {}
+        self._rules = []
+        self._atoms = {}
+
+        facts = []
+        for rule in rules:
+            if not is_datalog_rule(rule):
+                raise Exception("Not a Datalog rule: " + str(rule))
+            if isinstance(rule.tail, TRUE):
+                facts.append(rule.head)
+            else:
+                self._rules.append(
+                    _CompiledRule(rule.head, _body_goals(rule.tail))
+                )
+
+        self.add_facts(facts)
+
+    def add_facts(self, facts):
+        """Add the ground facts and update the materialized relations by
+        propagating only what can be derived from the new facts. """
+        delta = {}
+        for fact in facts:
+            if not _is_datalog_atom(fact) or _term_variables(fact):
+                raise Exception("Not a ground Datalog fact: " + str(fact))
+            key = _predicate_key(fact)
+            row = tuple(argument.functor for argument in fact.arguments)
+            if self._relation(key).add(row):
+                delta.setdefault(key, Relation()).add(row)
+
+        self._propagate(delta)
+
+    def _relation(self, key):
+        relation = self.relations.get(key)
+        if relation is None:
+            relation = self.relations[key] = Relation()
+        return relation
+
+    def _propagate(self, delta):
+        """Run semi-naive iterations until no new tuples are derived"""
+        while delta:
+            derived = []
+
+            for rule in self._rules:
+                for goal_index, goal in enumerate(rule.plan.goals):
+                    if goal.key not in delta:
+                        continue
+                    for row in rule.evaluate(
+                        self.relations, goal_index, delta
+                    ):
+                        derived.append((rule.head_key, row))
+
+            # New tuples are only added after the iteration has finished so the
+            # joins above never observe a relation changing underneath them.
+            delta = {}
+            for key, row in derived:
+                if self._relation(key).add(row):
+                    delta.setdefault(key, Relation()).add(row)
+
+    def can_answer(self, query):
+        """Return True if the query can be answered from the relations alone"""
+        return all(_is_datalog_atom(goal) for goal in _body_goals(query)) and (
+            not isinstance(query, Conjunction) or len(query.arguments) > 0
+        )
+
+    def query(self, query):
+        """Return a generator over the query instances found in the relations.
+
+        The generator yields terms in the same shape Database.query does, so the
+        solver can treat both evaluation strategies the same way. """
+        variables = {
+            variable.name: variable for variable in query_variables(query)
+        }
+        for answer in self.answers(query):
+            yield query.substitute_variable_bindings(
+                {variables[name]: value for name, value in answer.items()}
+            )
+
+    def answers(self, query):
+        """Return a generator over the answers found in the relations. Each answer
+        maps the query variable names to their values. """
+        goals = _body_goals(query)
+        variables = query_variables(query)
+
+        # The query variables make up the head of the plan, so every joined row
+        # holds exactly one value per query variable.
+        plan = _CompiledRule(Term("query", variables), goals)
+        names = [variable.name for variable in variables]
+
+        for row in plan.evaluate(self.relations):
+            yield {name: self._atom(value) for name, value in zip(names, row)}
+
+    def _atom(self, value):
+        """Return a shared atom term for the constant value"""
+        atom = self._atoms.get(value)
+        if atom is None:
+            atom = self._atoms[value] = Term(value)
+        return atom
@@ -0,0 +1,62 @@
+"""Filters which drop answers that were already seen.
+
+Answers are identified by a hashable key, i.e. a tuple of term keys. The exact
+filter remembers every key it has seen. The approximate filter is a Bloom filter
+whose memory is fixed up front: it never lets a repeated key through, but it can
+occasionally mistake a new key for one it has seen before.
+"""
+
+import math
+
+
+class DistinctFilter(object):
+    """Remembers the keys seen so far in a hash set"""
+
+    def __init__(self):
+        self._seen = set()
+
+    def add(self, key):
+        """Record the key and return True if it wasn't seen before"""
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        return True
+
+
+class BloomFilter(object):
+    """A fixed size Bloom filter.
+
+    The filter is sized so that after capacity distinct keys have been added, a
+    new key is mistaken for a seen one with roughly the given error rate. The bit
+    positions of a key are derived from two hashes by double hashing. """
+
+    def __init__(self, capacity=100000, error_rate=0.001):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise Exception("Invalid Bloom filter capacity or error rate")
+
+        self.size = max(
+            8,
+            int(
+                math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+            ),
+        )
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def add(self, key):
+        """Record the key and return True if it wasn't seen before (or, rarely,
+        False for a new key whose bits were all set by other keys). """
+        first_hash = hash(key)
+        second_hash = hash((key,)) | 1
+
+        bits = self._bits
+        new = False
+
+        for index in range(self.hash_count):
+            position = (first_hash + index * second_hash) % self.size
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not bits[byte] & bit:
+                bits[byte] |= bit
+                new = True
+
+        return new
@@ -0,0 +1,257 @@
+"""Argument indexes built from the call patterns observed while solving.
+
+Every predicate keeps its clauses in order along with a counter per argument
+position of how often calls had that argument bound. Once a position has been
+bound often enough, a hash index from the principal functor of the argument to
+the clauses which can match it is built for that position, as long as all of the
+indexes together stay within the memory budget of the database. Each call then
+uses whichever of its bound arguments narrows the clauses down the most.
+"""
+
+import threading
+
+from prologpy.interpreter import ListTerm, Variable
+
+
+def _index_key(term):
+    """Return the principal functor of a non-variable term with its arity"""
+    if term.__class__ is ListTerm:
+        return ".", 2
+    return term.functor, len(term.arguments)
+
+
+class ArgumentIndex(object):
+    """Maps the principal functor of one argument to the clauses whose head can
+    match it, in clause order. Clauses whose head has a variable in that position
+    match any key. """
+
+    def __init__(self, position, clauses_by_key, variable_clauses):
+        self.position = position
+        self.clauses_by_key = clauses_by_key
+        self.variable_clauses = variable_clauses
+        self.hits = 0
+        self.entries = len(variable_clauses) + sum(
+            len(clauses) for clauses in clauses_by_key.values()
+        )
+
+    def lookup(self, key):
+        return self.clauses_by_key.get(key, self.variable_clauses)
+
+
+class PredicateClauses(object):
+    """The clauses of one predicate, the call modes seen for it and the argument
+    indexes built from them. """
+
+    def __init__(self, functor, arity, manager):
+        self.functor = functor
+        self.arity = arity
+        self.manager = manager
+        self.clauses = []
+        self.call_count = 0
+        self.bound_counts = [0] * arity
+        self.indexes = {}
+        self._rejected_positions = set()
+
+    def add(self, rule):
+        """Append a clause. The existing indexes no longer cover every clause, so
+        they are dropped and rebuilt when calls need them again. """
+        self.clauses.append(rule)
+        self.drop_indexes()
+
+    def replace(self, rules):
+        """Replace all of the clauses, dropping the existing indexes"""
+        self.clauses = list(rules)
+        self.drop_indexes()
+
+    def drop_indexes(self):
+        for index in self.indexes.values():
+            self.manager.used_entries -= index.entries
+        self.indexes = {}
+        self._rejected_positions = set()
+
+    def candidates(self, goal, frame, bindings):
+        """Return the clauses which can match the goal, in clause order"""
+        clauses = self.clauses
+        manager = self.manager
+
+        # Scanning a few clauses is cheaper than looking at the call mode
+        if len(clauses) < manager.min_clauses:
+            return clauses
+
+        best_clauses = clauses
+        best_index = None
+
+        # Queries may run on several threads at once (see prologpy.server), so
+        # the counters are updated and the indexes built under the lock of the
+        # manager. Otherwise two threads could build the same index twice, or
+        # lose each other's counts.
+        with manager.lock:
+            self.call_count += 1
+
+            for position, argument in enumerate(goal.arguments):
+                term, _ = bindings.dereference(argument, frame)
+                if isinstance(term, Variable):
+                    continue
+
+                self.bound_counts[position] += 1
+
+                index = self.indexes.get(position)
+                if index is None:
+                    if (
+                        self.bound_counts[position] < manager.threshold
+                        or position in self._rejected_positions
+                    ):
+                        continue
+                    index = self._build_index(position)
+                    if index is None:
+                        continue
+
+                matching_clauses = index.lookup(_index_key(term))
+                if len(matching_clauses) < len(best_clauses):
+                    best_clauses = matching_clauses
+                    best_index = index
+
+            if best_index is not None:
+                best_index.hits += 1
+
+        return best_clauses
+
+    def _build_index(self, position):
+        """Build the index for the argument position, or return None if it
+        wouldn't narrow down the clauses or doesn't fit in the budget. """
+        keys = []
+        variable_clauses = []
+        for rule in self.clauses:
+            argument = rule.head.arguments[position]
+            if isinstance(argument, Variable):
+                variable_clauses.append(rule)
+                keys.append(None)
+            else:
+                keys.append(_index_key(argument))
+
+        distinct_keys = set(keys)
+        distinct_keys.discard(None)
+
+        # Every key lists its own clauses plus all of the variable clauses
+        entries = len(variable_clauses) * (len(distinct_keys) + 1) + (
+            len(keys) - len(variable_clauses)
+        )
+
+        if (
+            len(distinct_keys) < 2
+            or self.manager.used_entries + entries > self.manager.budget
+        ):
+            self._rejected_positions.add(position)
+            return None
+
+        clauses_by_key = {key: [] for key in distinct_keys}
+        for rule, key in zip(self.clauses, keys):
+            if key is None:
+                for clauses in clauses_by_key.values():
+                    clauses.append(rule)
+            else:
+                clauses_by_key[key].append(rule)
+
+        index = self.indexes[position] = ArgumentIndex(
+            position, clauses_by_key, variable_clauses
+        )
+        self.manager.used_entries += index.entries
+        return index
+
+
+class IndexManager(object):
+    """Groups the clauses of a database by predicate and keeps track of the
+    memory used by all of the argument indexes.
+
+    An index is built for an argument position once calls have had that argument
+    bound threshold times, for predicates with at least min_clauses clauses. The
+    budget is the total number of clause references all of the indexes may hold.
+
+    Calls from several threads are safe: the call counts and the indexes built
+    from them are guarded by one lock. Adding or replacing clauses isn't, and
+    mustn't happen while queries are running. """
+
+    def __init__(self, threshold=8, min_clauses=8, budget=1000000):
+        self.threshold = threshold
+        self.min_clauses = min_clauses
+        self.budget = budget
+        self.used_entries = 0
+        self.predicates = {}
+        self.lock = threading.Lock()
+
+    def add(self, rule):
+        # A clause with a variable as its head can never be called
+        if isinstance(rule.head, Variable):
+            return
+
+        key = (rule.head.functor, len(rule.head.arguments))
+        predicate = self.predicates.get(key)
+        if predicate is None:
+            predicate = self.predicates[key] = PredicateClauses(
+                key[0], key[1], self
+            )
+        predicate.add(rule)
+
+    def replace(self, rules):
+        """Replace all of the clauses. Predicates whose clauses are the same rule
+        objects in the same order as before keep their indexes and call counts,
+        only the predicates which changed start over. """
+        clauses_by_key = {}
+        for rule in rules:
+            if not isinstance(rule.head, Variable):
+                key = (rule.head.functor, len(rule.head.arguments))
+                clauses_by_key.setdefault(key, []).append(rule)
+
+        for key in list(self.predicates):
+            if key not in clauses_by_key:
+                self.predicates.pop(key).drop_indexes()
+
+        for key, clauses in clauses_by_key.items():
+            predicate = self.predicates.get(key)
+            if predicate is None:
+                predicate = self.predicates[key] = PredicateClauses(
+                    key[0], key[1], self
+                )
+            elif len(predicate.clauses) == len(clauses) and all(
+                old_rule is rule
+                for old_rule, rule in zip(predicate.clauses, clauses)
+            ):
+                continue
+            predicate.replace(clauses)
+
+    def build_all(self):
+        """Build an index for every argument position of every predicate with
+        at least min_clauses clauses, as far as the budget allows, without
+        waiting for calls to ask for them. """
+        with self.lock:
+            for predicate in self.predicates.values():
+                if len(predicate.clauses) < self.min_clauses:
+                    continue
+                for position in range(predicate.arity):
+                    if (
+                        position not in predicate.indexes
+                        and position not in predicate._rejected_positions
+                    ):
+                        predicate._build_index(position)
+
+    def get(self, functor, arity):
+        return self.predicates.get((functor, arity))
+
+    def report(self):
+        """Return a list describing every index built so far: the predicate and
+        argument position it covers, the number of distinct keys and clause
+        references it holds, and how many calls it answered. """
+        return [
+            {
+                "predicate": str(predicate.functor)
+                + "/"
+                + str(predicate.arity),
+                "position": index.position,
+                "keys": len(index.clauses_by_key),
+                "entries": index.entries,
+                "hits": index.hits,
+                "calls": predicate.call_count,
+            }
+            for predicate in self.predicates.values()
+            for index in predicate.indexes.values()
+        ]
@@ -1,4 +1,51 @@
-from functools import reduce
+import gc
+from itertools import islice
+
+from prologpy.persistent import PersistentMap
+
+
+def _walk(variable_bindings, term):
+    """Follow the bindings of a variable until we reach a term or an unbound
+    variable. """
+    while isinstance(term, Variable):
+        value = variable_bindings.get(term)
+        if value is None:
+            break
+        term = value
+    return term
+
+
+def _match_into(variable_bindings, pairs):
+    """Match every (term, term) pair, adding the variable bindings needed to make
+    the terms equal to the variable bindings map. Returns False if any of the
+    pairs can't be matched. """
+    while pairs:
+        left, right = pairs.pop()
+
+        # Variables which are already bound are replaced by their values, so an
+        # existing binding is matched against the new value rather than being
+        # overwritten, and variables never end up bound to themselves.
+        left = _walk(variable_bindings, left)
+        right = _walk(variable_bindings, right)
+
+        if left is right:
+            continue
+
+        if isinstance(left, Variable):
+            variable_bindings[left] = right
+
+        elif isinstance(right, Variable):
+            variable_bindings[right] = left
+
+        elif left.functor != right.functor or len(left.arguments) != len(
+            right.arguments
+        ):
+            return False
+
+        else:
+            pairs.extend(zip(left.arguments, right.arguments))
+
+    return True
 
 
 class Term(object):
@@ -15,6 +62,11 @@ class Term(object):
         self.functor = functor
         self.arguments = arguments
 
+        # Terms are built bottom-up, so we can record whether a term contains any
+        # variables at the cost of one check per argument. Searches through
+        # bound structure (i.e. the occurs check) skip ground terms entirely.
+        self.ground = all(argument.ground for argument in arguments)
+
     def match_variable_bindings(self, other_term):
         """Return a map of matching variable bindings"""
 
@@ -23,38 +75,14 @@ class Term(object):
         if isinstance(other_term, Variable):
             return other_term.match_variable_bindings(self)
 
-        # If we have a term, we check if the terms are identical and if so,
-        # we extract the combined variable bindings.
-        if isinstance(other_term, Term):
-
-            # Verify that the functor and argument lengths match.
-            if self.functor != other_term.functor or len(
-                self.arguments
-            ) != len(other_term.arguments):
-                return None
-
-            # Zip the current term and the other term arguments and combine the
-            # results into one list. Zip creates a new list filled with tuples
-            # containing the matching elements from the 2 argument lists. i.e. zip ([
-            # 1, 2, 3],[4, 5, 6]) returns [(1, 4), (2, 5), (3, 6)]
-            zipped_argument_list = list(
-                zip(self.arguments, other_term.arguments)
-            )
-
-            # Get the matched variable bindings list for the matching arguments in
-            # our 2 terms and merge them.
-            matched_argument_var_bindings = [
-                arguments[0].match_variable_bindings(arguments[1])
-                for arguments in zipped_argument_list
-            ]
-
-            # Merge the combined argument variable bindings and return the result.
-            # The reduce function applies a rolling computation to sequential pairs
-            # of values in a list. i.e. reduce((lambda x, y: x + y), [1, 2, 3,
-            # 4]) returns 10
-            return reduce(
-                Database.merge_bindings, [{}] + matched_argument_var_bindings
-            )
+        # Otherwise, we match the terms argument by argument and collect all of
+        # the variable bindings into a single map as we go. This keeps matching
+        # linear in the size of the terms rather than merging one map per
+        # argument.
+        variable_bindings = {}
+        if _match_into(variable_bindings, [(self, other_term)]):
+            return variable_bindings
+        return None
 
     def substitute_variable_bindings(self, variable_bindings):
         """Take the variable bindings map and return a term with all occurrences of
@@ -73,6 +101,35 @@ class Term(object):
         """Query the database for terms matching this one"""
         yield from database.query(self)
 
+    def _solve(self, database, frame, bindings):
+        """Return a generator over the bindings which prove this goal, where our
+        variables live in the slots numbered from the frame offset onwards. """
+        return database._solve_goal(self, frame, bindings)
+
+    def _with_arguments(self, arguments):
+        """Return a term of the same kind as this one with the given arguments"""
+        return Term(self.functor, arguments)
+
+    def _subterms(self):
+        """Return the direct subterms of the term"""
+        return self.arguments
+
+    def _rename_variables(self, variables):
+        """Return a copy of the term in which every variable is replaced by a fresh
+        variable numbered in the order it was first seen. The variables map holds
+        the renamed variables found so far. Terms without variables are shared
+        rather than copied. """
+        arguments = [
+            argument._rename_variables(variables)
+            for argument in self.arguments
+        ]
+        if all(
+            renamed is argument
+            for renamed, argument in zip(arguments, self.arguments)
+        ):
+            return self
+        return self._with_arguments(arguments)
+
     def __str__(self):
         return (
             str(self.functor)
@@ -87,6 +144,119 @@ class Term(object):
         return str(self)
 
 
+def query_variables(term):
+    """Return the distinct named variables of the term, in the order they first
+    appear. Anonymous '_' variables are left out. """
+    variables = []
+    seen_variables = set()
+    terms = [term]
+
+    while terms:
+        current_term = terms.pop()
+        if isinstance(current_term, Variable):
+            if current_term.name != "_" and current_term not in seen_variables:
+                seen_variables.add(current_term)
+                variables.append(current_term)
+        elif not current_term.ground:
+            terms.extend(reversed(current_term._subterms()))
+
+    return variables
+
+
+# The empty list is an atom. Every list ends with it unless it has an open tail.
+EMPTY_LIST = Term("[]")
+
+
+def make_list(items, tail=EMPTY_LIST):
+    """Return the list of the items followed by the tail. A tail which is itself a
+    list is merged into the result so the elements end up in one Python list. """
+    if isinstance(tail, ListTerm):
+        items = list(items)
+        items.extend(islice(tail.items, tail.start, None))
+        tail = tail.tail
+
+    if not items:
+        return tail
+
+    return ListTerm(items, tail)
+
+
+class ListTerm(Term):
+    """A list such as [a, b, c] or [Head | Tail].
+
+    Lists behave like the standard chain of '.'(Head, Tail) cells, but the
+    elements are stored in a single Python list followed by the tail term. The
+    tail of a list is a view sharing the same elements from the next position,
+    so walking down a list never copies it, and two lists are unified element by
+    element without building the intermediate cells. """
+
+    def __init__(self, items, tail=EMPTY_LIST, start=0, ground=None):
+        self.functor = "."
+        self.items = items
+        self.start = start
+        self.tail = tail
+
+        # Views over the elements of a ground list are ground too. For any other
+        # list we don't rescan the remaining elements, as the flag is only used
+        # to skip work and False is always a safe answer.
+        if ground is None:
+            ground = tail.ground and all(
+                item.ground for item in islice(items, start, None)
+            )
+        self.ground = ground
+
+    @property
+    def arguments(self):
+        return [self.items[self.start], self._rest(1)]
+
+    def _rest(self, count):
+        """Return the list without its first count elements"""
+        start = self.start + count
+        if start == len(self.items):
+            return self.tail
+        return ListTerm(self.items, self.tail, start, self.ground)
+
+    def _subterms(self):
+        subterms = self.items[self.start :]
+        subterms.append(self.tail)
+        return subterms
+
+    def substitute_variable_bindings(self, variable_bindings):
+        return make_list(
+            [
+                item.substitute_variable_bindings(variable_bindings)
+                for item in islice(self.items, self.start, None)
+            ],
+            self.tail.substitute_variable_bindings(variable_bindings),
+        )
+
+    def _with_arguments(self, arguments):
+        head, tail = arguments
+        return ListTerm([head], tail)
+
+    def _rename_variables(self, variables):
+        if self.ground:
+            return self
+
+        items = [
+            item._rename_variables(variables)
+            for item in islice(self.items, self.start, None)
+        ]
+        return ListTerm(items, self.tail._rename_variables(variables))
+
+    def __str__(self):
+        elements = ", ".join(
+            str(item) for item in islice(self.items, self.start, None)
+        )
+        if self.tail is EMPTY_LIST or (
+            not isinstance(self.tail, Variable)
+            and self.tail.functor == "[]"
+            and not self.tail.arguments
+        ):
+            return "[" + elements + "]"
+        return "[" + elements + " | " + str(self.tail) + "]"
+
+
 class TRUE(Term):
     """A predefined term used to represent facts as rules. i.e. functor(argument1,
     argument2) for example gets translated to functor(argument1, argument2) :- TRUE """
@@ -104,14 +274,30 @@ class TRUE(Term):
     def query(self, database):
         yield self
 
+    def _solve(self, database, frame, bindings):
+        yield bindings
+
+    def _with_arguments(self, arguments):
+        return self
+
+    def _rename_variables(self, variables):
+        return self
+
 
 class Variable(object):
     """A variable is a type of term. Variables start with an uppercase letter and
     represent placeholders for actual terms. """
 
+    ground = False
+
     def __init__(self, name):
         self.name = name
 
+        # The slot number of the variable within its clause. Each activation of
+        # the clause gets its own block of slots, so the same variable object
+        # can stand for a fresh variable in every activation.
+        self.index = None
+
     def match_variable_bindings(self, other_term):
         """ If the passed in term doesn't represent the same variable, we bind our
         current variable to the outer term and return the mapped binding. """
@@ -135,6 +321,24 @@ class Variable(object):
 
         return self
 
+    def _rename_variables(self, variables):
+        renamed_variable = variables.get(self)
+
+        if renamed_variable is None:
+            renamed_variable = variables[self] = Variable(self.name)
+            renamed_variable.index = len(variables) - 1
+
+        return renamed_variable
+
+    def _solve(self, database, frame, bindings):
+        """Prove the term our variable is bound to, i.e. call(Goal)"""
+        goal, goal_frame = bindings.dereference(self, frame)
+
+        if isinstance(goal, Variable):
+            raise Exception("Unbound variable used as a goal: " + str(self))
+
+        yield from goal._solve(database, goal_frame, bindings)
+
     def __str__(self):
         return str(self.name)
 
@@ -149,8 +353,13 @@ class Rule(object):
     human(X) """
 
     def __init__(self, head, tail):
-        self.head = head
-        self.tail = tail
+        # We number the rule variables once, when the rule is created. Using the
+        # rule then never requires copying its terms: every activation gets a
+        # fresh block of variable slots starting at a new frame offset.
+        variables = {}
+        self.head = head._rename_variables(variables)
+        self.tail = tail._rename_variables(variables)
+        self.variable_count = len(variables)
 
     def __str__(self):
         return str(self.head) + " :- " + str(self.tail)
@@ -176,43 +385,84 @@ class Conjunction(Term):
     def query(self, database):
         """Return a generator that iterates over all of the conjunction terms which
         match the database rules. """
+        yield from database.query(self)
+
+    def _solve(self, database, frame, bindings):
+        """Return a generator over the bindings which prove every conjunction term
+        in order. """
 
         def find_solutions(argument_index, variable_bindings):
             """Return a generator which iterates over all of the database solutions
             matching our rules """
 
-            # If there are no more arguments to match, we return the substituted
-            # variable bindings for our entire conjunction
+            # If there are no more arguments to match, the bindings prove our
+            # entire conjunction
             if argument_index >= len(self.arguments):
-                yield self.substitute_variable_bindings(variable_bindings)
-            else:
-                # There are more arguments to process, so we process the argument at
-                # our current index
-                current_term = self.arguments[argument_index]
-
-                # Find all of the database items matching our current variable
-                # bindings, and if we have matching items, keep searching the
-                # database by iterating over our next conjunction arguments
-                for item in database.query(
-                    current_term.substitute_variable_bindings(
-                        variable_bindings
-                    )
-                ):
-
-                    combined_variable_bindings = Database.merge_bindings(
-                        current_term.match_variable_bindings(item),
-                        variable_bindings,
-                    )
+                yield variable_bindings
+                return
+
+            # There are more arguments to process, so we process the argument at
+            # our current index
+            current_term = self.arguments[argument_index]
+
+            # If this goal and the next one are both answered by fact tables, we
+            # join the two tables in bulk rather than querying the second table
+            # once per row of the first one. The tables are looked up by the
+            # predicates of the goals first, so conjunctions of rules never pay
+            # for resolving their goals.
+            if (
+                database.fact_tables
+                and argument_index + 1 < len(self.arguments)
+                and database._fact_table(current_term) is not None
+                and database._fact_table(self.arguments[argument_index + 1])
+                is not None
+            ):
+                next_term = self.arguments[argument_index + 1]
+
+                # Both goals are instantiated with a shared variable map so the
+                # tables can tell which variables the goals have in common.
+                goal_variables = {}
+                joined_items = database.join(
+                    variable_bindings.resolve(
+                        current_term, frame, goal_variables
+                    ),
+                    variable_bindings.resolve(
+                        next_term, frame, goal_variables
+                    ),
+                )
 
-                    if combined_variable_bindings is not None:
-                        yield from find_solutions(
-                            argument_index + 1, combined_variable_bindings
+                if joined_items is not None:
+                    for item, next_item in joined_items:
+                        combined_variable_bindings = variable_bindings.unify(
+                            current_term, frame, item, 0
                         )
+                        if combined_variable_bindings is not None:
+                            combined_variable_bindings = combined_variable_bindings.unify(
+                                next_term, frame, next_item, 0
+                            )
+
+                        if combined_variable_bindings is not None:
+                            yield from find_solutions(
+                                argument_index + 2, combined_variable_bindings
+                            )
+                    return
+
+            # Find all of the bindings proving our current term, and keep searching
+            # the database by iterating over our next conjunction arguments
+            for combined_variable_bindings in current_term._solve(
+                database, frame, variable_bindings
+            ):
+                yield from find_solutions(
+                    argument_index + 1, combined_variable_bindings
+                )
 
         # Find all of the conjunction solutions matching our database rules. As a
         # note, the yield from expression is a form of generator delegation used to
         # recursively process all of the items matching our rules.
-        yield from find_solutions(0, {})
+        yield from find_solutions(0, bindings)
+
+    def _with_arguments(self, arguments):
+        return Conjunction(arguments)
 
     def substitute_variable_bindings(self, variable_bindings):
         """ Take the variable bindings map and return a conjunction with all
@@ -235,6 +485,488 @@ class Conjunction(Term):
         return str(self)
 
 
+def term_key(term):
+    """Return a key for the term which is equal for equal terms and can be hashed.
+    Sorting by the keys sorts terms in the standard order: variables before
+    numbers before atoms before compound terms, and compound terms by arity,
+    then name, then arguments. """
+    if isinstance(term, Variable):
+        return 0, term.name
+
+    if isinstance(term, ListTerm):
+        # The key of a list has the shape of the equivalent chain of '.' cells,
+        # built from the end so long lists don't recurse once per element.
+        items = []
+        while isinstance(term, ListTerm):
+            items.extend(islice(term.items, term.start, None))
+            term = term.tail
+
+        key = term_key(term)
+        for item in reversed(items):
+            key = 4, 2, ".", (term_key(item), key)
+        return key
+
+    if not term.arguments:
+        if isinstance(term.functor, (int, float)):
+            return 1, term.functor
+        return 3, str(term.functor)
+
+    return (
+        4,
+        len(term.arguments),
+        str(term.functor),
+        tuple(term_key(argument) for argument in term.arguments),
+    )
+
+
+OCCURS_CHECK_POLICIES = ("off", "on", "error")
+
+
+def _find(values, slot, compress=False):
+    """Return the representative slot of the variable in the given slot, along
+    with the value stored for the representative.
+
+    Aliased variables form a union-find forest: an alias is stored as the slot
+    number of its parent, and the representative of a set holds either the
+    (term, frame) pair the whole set is bound to, a negative number encoding the
+    rank of an unbound set, or nothing at all for an unbound set of rank 0.
+    When compressing, every slot visited on the way up is pointed straight at
+    the representative (path compression), which keeps later lookups close to
+    constant time. """
+    root = slot
+    value = values.get(root)
+
+    while value.__class__ is int and value >= 0:
+        root = value
+        value = values.get(root)
+
+    if compress:
+        while slot != root:
+            parent = values.get(slot)
+            if parent != root:
+                values[slot] = root
+            slot = parent
+
+    return root, value
+
+
+class Bindings(object):
+    """The variable bindings for one branch of the search.
+
+    Variables are identified by slot numbers: a clause variable with index i,
+    used in the activation whose frame starts at offset f, lives in slot f + i.
+    A slot is either bound to a (term, frame) pair, i.e. a term from a clause
+    together with the frame its own variables live in, or aliased to other slots
+    through a union-find forest (see _find). Terms are shared between every
+    activation of a clause and never copied while searching; they are only
+    instantiated when an answer is resolved.
+
+    The slots are stored in a persistent map, so bindings never change once
+    created. Binding more variables returns new bindings which share all of
+    their unchanged structure with the old ones: extending the bindings costs
+    O(log n), and forking the search into several branches costs nothing, as
+    every branch simply keeps its own version of the map.
+
+    Unbound variables can carry attributes, kept in a second persistent map
+    from the slot of their representative to the attribute. Constraint solvers
+    (see prologpy.clpfd) use them to store the domain of a variable and the
+    constraints on it. Unifying a variable which has an attribute wakes up its
+    constraints, which may make the unification fail. Without attributed
+    variables, the map is None and unification doesn't look at it.
+
+    """
+
+    __slots__ = ("values", "top", "occurs_check", "context", "attributes")
+
+    def __init__(
+        self,
+        values=None,
+        top=0,
+        occurs_check="off",
+        context=None,
+        attributes=None,
+    ):
+        self.values = values if values is not None else PersistentMap()
+        self.top = top
+        self.occurs_check = occurs_check
+
+        # The query context (see prologpy.context) is passed on unchanged to
+        # every bindings derived from these, so the whole search shares it.
+        self.context = context
+        self.attributes = attributes
+
+    def allocate(self, count):
+        """Reserve a frame of count fresh variable slots. Returns the frame offset
+        and the bindings to use with it. """
+        return (
+            self.top,
+            Bindings(
+                self.values,
+                self.top + count,
+                self.occurs_check,
+                self.context,
+                self.attributes,
+            ),
+        )
+
+    def dereference(self, term, frame):
+        """Follow the bindings of a variable until we reach a term or an unbound
+        variable, and return it along with its frame. """
+        if isinstance(term, Variable):
+            value = _find(self.values, frame + term.index)[1]
+            if value.__class__ is tuple:
+                return value
+        return term, frame
+
+    def unify(self, left, left_frame, right, right_frame):
+        """Return the bindings extended so that both terms are equal, or None if
+        the terms can't be unified. """
+        # All of the updates made by this unification are batched in a
+        # transient, which copies each changed trie node only once.
+        values = self.values.transient()
+        get = values.get
+        pairs = [(left, left_frame, right, right_frame)]
+
+        # The attributed variables bound or aliased by this unification
+        attributes = self.attributes
+        woken_slots = None
+
+        while pairs:
+            left, left_frame, right, right_frame = pairs.pop()
+
+            # Find the representatives of both sides. A variable which is bound
+            # is replaced by its value; an unbound one is kept as a slot. Only
+            # aliased variables need the full union-find lookup.
+            left_slot = right_slot = None
+
+            left_bound_slot = right_bound_slot = None
+
+            if isinstance(left, Variable):
+                left_slot = left_frame + left.index
+                value = get(left_slot)
+                if value.__class__ is int and value >= 0:
+                    left_slot, value = _find(values, left_slot, True)
+                if value.__class__ is tuple:
+                    left, left_frame = value
+                    left_bound_slot, left_slot = left_slot, None
+
+            if isinstance(right, Variable):
+                right_slot = right_frame + right.index
+                value = get(right_slot)
+                if value.__class__ is int and value >= 0:
+                    right_slot, value = _find(values, right_slot, True)
+                if value.__class__ is tuple:
+                    right, right_frame = value
+                    right_bound_slot, right_slot = right_slot, None
+
+            # When both sides are bound variables, we alias them before their
+            # values are compared. If we ever meet the same pair again, i.e.
+            # while unifying cyclic terms, the two sides then already share a
+            # representative and we stop instead of looping forever.
+            if left_bound_slot is not None and right_bound_slot is not None:
+                if left_bound_slot == right_bound_slot:
+                    continue
+                values[left_bound_slot] = right_bound_slot
+
+            if left_slot is not None:
+                if right_slot is None:
+                    if not self._check_occurs(
+                        values, left_slot, right, right_frame
+                    ):
+                        return None
+                    values[left_slot] = (right, right_frame)
+                    if attributes is not None and left_slot in attributes:
+                        woken_slots = (woken_slots or []) + [left_slot]
+                elif left_slot != right_slot:
+                    _union(values, left_slot, right_slot)
+                    if attributes is not None and (
+                        left_slot in attributes or right_slot in attributes
+                    ):
+                        woken_slots = (woken_slots or []) + [
+                            left_slot,
+                            right_slot,
+                        ]
+
+            elif right_slot is not None:
+                if not self._check_occurs(
+                    values, right_slot, left, left_frame
+                ):
+                    return None
+                values[right_slot] = (left, left_frame)
+                if attributes is not None and right_slot in attributes:
+                    woken_slots = (woken_slots or []) + [right_slot]
+
+            elif left is right and left_frame == right_frame:
+                continue
+
+            elif left.__class__ is ListTerm and right.__class__ is ListTerm:
+                # Unify the elements both lists have in common directly, then
+                # the remainder of the longer list with the tail of the other.
+                left_items, right_items = left.items, right.items
+                left_start, right_start = left.start, right.start
+                if (
+                    left_items is right_items
+                    and left_start == right_start
+                    and left.tail is right.tail
+                    and left_frame == right_frame
+                ):
+                    continue
+
+                count = min(
+                    len(left_items) - left_start,
+                    len(right_items) - right_start,
+                )
+                pairs.append(
+                    (
+                        left._rest(count),
+                        left_frame,
+                        right._rest(count),
+                        right_frame,
+                    )
+                )
+                for offset in reversed(range(count)):
+                    pairs.append(
+                        (
+                            left_items[left_start + offset],
+                            left_frame,
+                            right_items[right_start + offset],
+                            right_frame,
+                        )
+                    )
+
+            elif left.functor != right.functor or len(left.arguments) != len(
+                right.arguments
+            ):
+                return None
+
+            else:
+                for left_argument, right_argument in zip(
+                    left.arguments, right.arguments
+                ):
+                    pairs.append(
+                        (
+                            left_argument,
+                            left_frame,
+                            right_argument,
+                            right_frame,
+                        )
+                    )
+
+        if woken_slots is not None:
+            # Only unifications involving attributed variables get here, and
+            # those can only be created by the constraint solver.
+            from prologpy.clpfd import wake
+
+            return wake(self, values, woken_slots)
+
+        return Bindings(
+            values.persistent(),
+            self.top,
+            self.occurs_check,
+            self.context,
+            attributes,
+        )
+
+    def resolve(self, term, frame, variables=None):
+        """Return the term with all of its bound variables replaced by their
+        values. Unbound variables are replaced by the variable stored for the slot
+        of their representative in the variables map, or by a new variable if
+        there is none.
+
+        Every bound variable is only instantiated once, so resolving takes time
+        linear in the size of the bindings even when values are shared. Cyclic
+        bindings, which can only be created with the occurs check turned off,
+        raise an exception instead of recursing forever. """
+        if variables is None:
+            variables = {}
+        return self._resolve(term, frame, variables, {})
+
+    def _resolve(self, term, frame, variables, resolved_slots):
+        if isinstance(term, Variable):
+            slot, value = _find(self.values, frame + term.index)
+
+            if value.__class__ is not tuple:
+                variable = variables.get(slot)
+                if variable is None:
+                    variable = variables[slot] = Variable("_G" + str(slot))
+                return variable
+
+            # The slot maps to None while its value is being instantiated, so
+            # finding it again on the way means the term contains itself.
+            if slot in resolved_slots:
+                resolved_term = resolved_slots[slot]
+                if resolved_term is None:
+                    raise Exception(
+                        "Cannot instantiate cyclic term bound to " + str(term)
+                    )
+                return resolved_term
+
+            resolved_slots[slot] = None
+            resolved_term = self._resolve(
+                value[0], value[1], variables, resolved_slots
+            )
+            resolved_slots[slot] = resolved_term
+            return resolved_term
+
+        if term.ground:
+            return term
+
+        if term.__class__ is ListTerm:
+            return self._resolve_list(term, frame, variables, resolved_slots)
+
+        arguments = [
+            self._resolve(argument, frame, variables, resolved_slots)
+            for argument in term.arguments
+        ]
+        return term._with_arguments(arguments)
+
+    def _resolve_list(self, term, frame, variables, resolved_slots):
+        """Resolve a list whose tail may be bound to further lists, i.e. one built
+        up by append/3. The tails are followed in a loop rather than recursively,
+        and all of the elements are collected into one Python list. """
+        items = []
+        tail_slots = []
+
+        while True:
+            items.extend(
+                self._resolve(item, frame, variables, resolved_slots)
+                for item in islice(term.items, term.start, None)
+            )
+
+            tail = term.tail
+            if not isinstance(tail, Variable):
+                break
+
+            slot, value = _find(self.values, frame + tail.index)
+            if (
+                value.__class__ is not tuple
+                or value[0].__class__ is not ListTerm
+                or slot in resolved_slots
+            ):
+                break
+
+            # The tail slot is resolved to a view of the result list once the
+            # list is complete. Until then it is marked as in progress, which
+            # detects lists that contain themselves.
+            resolved_slots[slot] = None
+            tail_slots.append((slot, len(items)))
+            term, frame = value
+
+        resolved_list = make_list(
+            items, self._resolve(tail, frame, variables, resolved_slots)
+        )
+
+        for slot, count in tail_slots:
+            resolved_slots[slot] = resolved_list._rest(count)
+
+        return resolved_list
+
+    def _check_occurs(self, values, slot, term, frame):
+        """Apply the occurs check policy to binding the variable in the slot to
+        the term. Returns False if the binding must fail. """
+        if self.occurs_check == "off" or term.ground:
+            return True
+
+        if not _occurs(values, slot, term, frame):
+            return True
+
+        if self.occurs_check == "error":
+            raise Exception(
+                "Occurs check failed: variable would be bound to a term "
+                "containing itself, " + str(self.resolve(term, frame))
+            )
+
+        return False
+
+    def __len__(self):
+        return len(self.values)
+
+
+def _occurs(values, slot, term, frame):
+    """Return True if the unbound variable in the slot occurs within the term.
+
+    Only the structure reachable from the term is walked, ground subterms are
+    skipped as they can't contain any variable, and every bound variable and
+    compound term is visited at most once. """
+    visited = set()
+    terms = [(term, frame)]
+
+    while terms:
+        term, frame = terms.pop()
+
+        if isinstance(term, Variable):
+            root, value = _find(values, frame + term.index)
+            if root == slot:
+                return True
+            if value.__class__ is tuple and root not in visited:
+                visited.add(root)
+                terms.append(value)
+
+        elif not term.ground:
+            key = (id(term), frame)
+            if key not in visited:
+                visited.add(key)
+                terms.extend((subterm, frame) for subterm in term._subterms())
+
+    return False
+
+
+def _union(values, left_slot, right_slot):
+    """Alias two unbound representative slots, attaching the set with the lower
+    rank below the other one (union by rank). """
+    left_rank = -values.get(left_slot, 0)
+    right_rank = -values.get(right_slot, 0)
+
+    if left_rank < right_rank:
+        values[left_slot] = right_slot
+    elif left_rank > right_rank:
+        values[right_slot] = left_slot
+    else:
+        values[right_slot] = left_slot
+        values[left_slot] = -(left_rank + 1)
+
+
+class Answer(object):
+    """An answer to a query: a lightweight view over the bindings which prove the
+    query goal. The values of the query variables are only instantiated when
+    they're read, i.e. answer["X"] builds the term bound to X. """
+
+    __slots__ = ("bindings", "goal", "_variables", "_answer_variables")
+
+    def __init__(self, bindings, goal, variables, answer_variables):
+        self.bindings = bindings
+        self.goal = goal
+        self._variables = variables
+        self._answer_variables = answer_variables
+
+    def __getitem__(self, name):
+        """Return the value of the named query variable"""
+        return self.bindings.resolve(
+            self._variables[name], 0, dict(self._answer_variables)
+        )
+
+    def get(self, name, default=None):
+        if name not in self._variables:
+            return default
+        return self[name]
+
+    def keys(self):
+        return self._variables.keys()
+
+    @property
+    def term(self):
+        """Return the query goal instantiated with the answer bindings"""
+        return self.bindings.resolve(
+            self.goal, 0, dict(self._answer_variables)
+        )
+
+    def __str__(self):
+        return str(self.term)
+
+    def __repr__(self):
+        return str(self)
+
+
 class Database(object):
     """The database object is an object which contains a list of our declared rules.
 
@@ -243,48 +975,291 @@ class Database(object):
 
     """
 
-    def __init__(self, rules):
-        self.rules = rules
+    def __init__(
+        self,
+        rules,
+        fact_tables=False,
+        occurs_check="off",
+        index_threshold=8,
+        index_budget=1000000,
+    ):
+        """When fact tables are enabled, predicates made up entirely of ground facts
+        over atoms are stored column-wise in NumPy-backed fact tables instead of
+        as individual rules.
+
+        The occurs check policy decides what happens when unification would bind
+        a variable to a term containing it: "off" allows the cyclic binding (the
+        standard Prolog behaviour), "on" makes the unification fail and "error"
+        raises an exception.
+
+        Rules are grouped by predicate, and argument indexes are built for the
+        argument positions which calls bind at least index_threshold times. The
+        index budget caps the number of clause references held by all of the
+        indexes together. """
+        if occurs_check not in OCCURS_CHECK_POLICIES:
+            raise Exception(
+                "Unknown occurs check policy: " + str(occurs_check)
+            )
+
+        # The builtins import the interpreter themselves, so they're loaded once
+        # the interpreter module is complete.
+        from prologpy.builtins import BUILTINS
+        from prologpy.indexing import IndexManager
+
+        self.occurs_check = occurs_check
+        self.builtins = BUILTINS
+        self.table_facts = fact_tables
+        self.fact_tables = {}
+        self.clause_index = IndexManager(
+            threshold=index_threshold, budget=index_budget
+        )
+
+        if fact_tables:
+            # Fact tables are optional and need NumPy, so we only import them
+            # when they're requested.
+            from prologpy.tables import build_fact_tables
+
+            self.fact_tables, rules = build_fact_tables(rules)
+
+        self.rules = []
+        for rule in rules:
+            self._add_rule(rule)
+
+    def _add_rule(self, rule):
+        self.rules.append(rule)
+        self.clause_index.add(rule)
+
+    def add_rules(self, rules):
+        """Add the rules to the database. Ground facts for predicates which are
+        stored in fact tables are appended to their tables. """
+        for rule in rules:
+            table = self._fact_table(rule.head)
+
+            if table is not None:
+                from prologpy.tables import FactTable, is_ground_fact
+
+                if is_ground_fact(rule):
+                    table.append(rule.head)
+                    continue
+
+                # An external table would have to be copied into memory
+                # whole, so its predicate can't be extended with rules.
+                if not isinstance(table, FactTable):
+                    raise Exception(
+                        "Cannot add a rule to the external fact table of "
+                        + str(table.functor)
+                        + "/"
+                        + str(table.arity)
+                    )
+
+                # The predicate no longer consists of ground facts only, so we
+                # move its table contents back into regular rules.
+                del self.fact_tables[(table.functor, table.arity)]
+                for fact in table.query(
+                    Term(
+                        table.functor,
+                        [Variable("_") for _ in range(table.arity)],
+                    )
+                ):
+                    self._add_rule(Rule(fact, TRUE()))
+
+            self._add_rule(rule)
+
+    def replace_rules(self, rules):
+        """Replace the rules of the database in place. The clause groups and
+        argument indexes of the predicates whose clauses didn't change are kept,
+        so rules which are reused from the previous version cost nothing.
+
+        Fact tables built from the rules are built again from the new rules, while
+        external fact tables stay attached. """
+        if self.table_facts:
+            from prologpy.tables import FactTable, build_fact_tables
+
+            external_tables = {
+                key: table
+                for key, table in self.fact_tables.items()
+                if not isinstance(table, FactTable)
+            }
+            self.fact_tables, rules = build_fact_tables(rules)
+            self.fact_tables.update(external_tables)
+
+        self.rules = list(rules)
+        self.clause_index.replace(self.rules)
+
+    def add_fact_table(self, table):
+        """Register an external fact table, i.e. one backed by SQLite, as the
+        source of all of the facts for its predicate. """
+        key = (table.functor, table.arity)
+
+        if key in self.fact_tables or key in self.clause_index.predicates:
+            raise Exception(
+                "Predicate already defined: "
+                + str(table.functor)
+                + "/"
+                + str(table.arity)
+            )
+
+        self.fact_tables[key] = table
+
+    def freeze(self):
+        """Prepare the database to be shared with worker processes forked after
+        this call.
+
+        Forked workers share the memory pages of the parent until either side
+        writes to them, and reading a Python object writes to its reference
+        count. Scanning all of the clauses of a predicate therefore copies its
+        pages into the worker, and so does every garbage collection, which
+        writes to the header of each object it looks at.
+
+        The argument indexes are built up front, within the index budget, so
+        workers look at the matching clauses only and share the indexes instead
+        of each building their own. Fact tables sort their columns up front as
+        well, and keep their facts in a few NumPy arrays which stay shared as a
+        whole. Everything allocated so far is then frozen, i.e. moved out of
+        reach of the garbage collector. """
+        self.clause_index.build_all()
+        for table in self.fact_tables.values():
+            table.prepare()
+        gc.collect()
+        gc.freeze()
+
+    def unfreeze(self):
+        """Hand the frozen objects back to the garbage collector once no more
+        workers are going to be forked. """
+        gc.unfreeze()
+
+    def index_report(self):
+        """Return a list describing the argument indexes built so far from the
+        observed call patterns, and how many calls each of them answered. """
+        return self.clause_index.report()
+
+    def memory_stats(self):
+        """Return the memory used by the clauses, indexes and fact tables of
+        every predicate, largest first (see prologpy.memory). """
+        from prologpy.memory import database_memory_stats
+
+        return database_memory_stats(self)
+
+    def _fact_table(self, goal):
+        """Return the fact table storing the goal predicate, if there is one"""
+        if not self.fact_tables or not isinstance(goal, Term):
+            return None
+        return self.fact_tables.get((goal.functor, len(goal.arguments)))
+
+    def join(self, goal, other_goal):
+        """Return a generator over pairs of facts matching both goals if they can
+        be joined in bulk by their fact tables. Otherwise, return None. """
+        table = self._fact_table(goal)
+        other_table = self._fact_table(other_goal)
+
+        if table is None or other_table is None:
+            return None
+
+        return table.join(goal, other_table, other_goal)
 
     def query(self, goal):
         """Return a generator that iterates over all of the terms matching the given
         goal.
 
         """
+        for answer in self.answers(goal):
+            yield answer.term
+
+    def answers(self, goal, context=None):
+        """Return a generator over the answers to the goal. Each answer is a view
+        over the bindings found for the goal, and only builds terms for the goal
+        variables which are actually read from it.
+
+        A QueryContext can be given to count the inferences of the search and to
+        stop it on a timeout or when it's cancelled. """
+
+        # The goal is treated like a clause of its own: its variables are numbered
+        # into the first frame, and the answers are the bindings of that frame.
+        variables = {}
+        renamed_goal = goal._rename_variables(variables)
+
+        # Unbound goal variables show up as the caller's own variable objects
+        answer_variables = {
+            renamed_variable.index: variable
+            for variable, renamed_variable in variables.items()
+        }
+        named_variables = {
+            variable.name: renamed_variable
+            for variable, renamed_variable in variables.items()
+            if variable.name != "_"
+        }
+
+        for bindings in renamed_goal._solve(
+            self,
+            0,
+            Bindings(
+                top=len(variables),
+                occurs_check=self.occurs_check,
+                context=context,
+            ),
+        ):
+            yield Answer(
+                bindings, renamed_goal, named_variables, answer_variables
+            )
 
-        for index, rule in enumerate(self.rules):
-
-            # We obtain the map containing our shared rule head and goal variable
-            # bindings, and process the matching results if there are any to process.
-            matching_head_var_bindings = rule.head.match_variable_bindings(
-                goal
+    def _solve_goal(self, goal, frame, bindings):
+        """Return a generator over the bindings which prove the goal, counting the
+        inference, tracing the goal and accounting for its memory for the query
+        context if there is one. """
+        context = bindings.context
+        if context is not None:
+            context.step()
+            proofs = self._prove_goal(goal, frame, bindings)
+            if context.trace is not None:
+                proofs = context.trace.trace_goal(goal, proofs)
+            if context.memory is not None:
+                proofs = context.memory.track_goal(bindings, proofs)
+            return proofs
+        return self._prove_goal(goal, frame, bindings)
+
+    def _prove_goal(self, goal, frame, bindings):
+        """Return a generator over the bindings which prove the goal using our
+        builtins, fact tables and rules. """
+
+        # Builtin predicates are implemented in Python and take precedence over
+        # any rules with the same name and arity.
+        builtin = self.builtins.get((goal.functor, len(goal.arguments)))
+        if builtin is not None:
+            yield from builtin(self, goal, frame, bindings)
+            return
+
+        # Goals on fact table predicates are answered by the table directly
+        table = self._fact_table(goal)
+        if table is not None:
+            for fact in table.query(bindings.resolve(goal, frame)):
+                matching_bindings = bindings.unify(goal, frame, fact, 0)
+                if matching_bindings is not None:
+                    yield matching_bindings
+            return
+
+        predicate = self.clause_index.get(goal.functor, len(goal.arguments))
+        if predicate is None:
+            return
+
+        # Only the clauses of the goal predicate which the argument indexes can't
+        # rule out are tried, without touching the bindings for the others.
+        for rule in predicate.candidates(goal, frame, bindings):
+            head = rule.head
+
+            # Every use of the rule gets a fresh frame of variable slots placed
+            # after all of the slots in use, so its variables can never clash
+            # with the goal variables, even when the rule calls itself.
+            rule_frame, rule_bindings = bindings.allocate(rule.variable_count)
+
+            matching_head_var_bindings = rule_bindings.unify(
+                head, rule_frame, goal, frame
             )
 
             if matching_head_var_bindings is not None:
-
-                matched_head_item = rule.head.substitute_variable_bindings(
-                    matching_head_var_bindings
-                )
-                matched_tail_item = rule.tail.substitute_variable_bindings(
-                    matching_head_var_bindings
+                yield from rule.tail._solve(
+                    self, rule_frame, matching_head_var_bindings
                 )
 
-                # Query the database for the substituted tail items matching our rules
-                for matching_item in matched_tail_item.query(self):
-
-                    # Fetch the map containing our variable bindings matching the
-                    # tail of our rule.
-                    matcng_tail_var_bndngs = matched_tail_item.match_variable_bindings(
-                        matching_item
-                    )
-
-                    # We return a generator yielding head terms with the substituted
-                    # variable bindings replaced with the bindings found by querying
-                    # our tail.
-                    yield matched_head_item.substitute_variable_bindings(
-                        matcng_tail_var_bndngs
-                    )
-
     @staticmethod
     def merge_bindings(first_bindings_map, second_bindings_map):
         """Takes two variable binding maps and returns a combined bindings map if
@@ -295,40 +1270,20 @@ class Database(object):
         if first_bindings_map is None or second_bindings_map is None:
             return None
 
-        merged_bindings = {}
-
-        # Process our first bindings map and add the variable bindings to our merged map
-        for variable, value in first_bindings_map.items():
-            merged_bindings[variable] = value
+        # Copy our first bindings map, and match every binding from the second map
+        # against it. Any variable bound in both maps has its two values matched
+        # against each other, which may in turn bind more variables.
+        merged_bindings = dict(first_bindings_map)
 
-        # Process our second bindings map and verify that the bindings contain in
-        # this map align with the bindings from our first binding map. If any
-        # variable bindings do not align, we return None. Otherwise, we process any
-        # matching items and continue iterating through our binding map adding each
-        # binding to our merged map.
-        for variable, value in second_bindings_map.items():
-
-            if variable in merged_bindings:
-
-                existing_variable_binding = merged_bindings[variable]
-                shared_bindings = existing_variable_binding.match_variable_bindings(
-                    value
-                )
-
-                # If we have shared bindings, we add them to our existing map
-                if shared_bindings is not None:
-                    for variable_, value_ in shared_bindings.items():
-                        merged_bindings[variable_] = value_
-
-                # If the shared bindings don't match, we have a conflict and we
-                # return None
-                else:
-                    return None
-
-            else:
-                merged_bindings[variable] = value
-
-        return merged_bindings
+        if _match_into(
+            merged_bindings,
+            [
+                (variable, value)
+                for variable, value in second_bindings_map.items()
+            ],
+        ):
+            return merged_bindings
+        return None
 
     def __str__(self):
         return ".\n".join(str(rule) for rule in self.rules)
@@ -0,0 +1,297 @@
+"""Memory accounting for databases and queries.
+
+Database.memory_stats() reports how much memory the clauses of every predicate
+take: the number of term nodes they're made of and the bytes of those objects,
+as measured by sys.getsizeof. Subterms shared between clauses are counted once,
+for the first predicate they're found in.
+
+A QueryMemory records how much memory a running query holds on to. Given to a
+QueryContext, it's told about every goal the engine tries to prove and keeps the
+peak number of open goals, i.e. the goals being proved along with the choice
+points left to backtrack into, along with the peak size of the bindings. It
+can also trace the Python allocations of the query with tracemalloc, taking a
+snapshot whenever the traced memory has grown by a good part since the last
+one, so the report shows where the memory went near the peak of the query.
+"""
+
+import os
+import sys
+import tracemalloc
+
+from prologpy.interpreter import ListTerm, Variable
+
+# Only the allocations made by the engine itself are listed in the report
+_PACKAGE_FILES = os.path.join(os.path.dirname(__file__), "*")
+
+
+def _object_bytes(value):
+    """Return the size of an object along with its attribute dictionary"""
+    size = sys.getsizeof(value)
+    attributes = getattr(value, "__dict__", None)
+    if attributes is not None:
+        size += sys.getsizeof(attributes)
+    return size
+
+
+def term_footprint(term, seen):
+    """Return the number of term nodes in the term and the bytes they take.
+
+    Objects whose id is in seen are skipped, and every object counted is added
+    to it, so terms shared between several clauses are only counted once. """
+    nodes = 0
+    size = 0
+    terms = [term]
+
+    while terms:
+        current = terms.pop()
+        if id(current) in seen:
+            continue
+        seen.add(id(current))
+
+        nodes += 1
+        size += _object_bytes(current)
+        if isinstance(current, Variable):
+            continue
+
+        if id(current.functor) not in seen:
+            seen.add(id(current.functor))
+            size += sys.getsizeof(current.functor)
+
+        # The elements of a list and of all of its tails share one Python list
+        arguments = (
+            current.items
+            if current.__class__ is ListTerm
+            else current.arguments
+        )
+        if id(arguments) not in seen:
+            seen.add(id(arguments))
+            size += sys.getsizeof(arguments)
+
+        terms.extend(current._subterms())
+
+    return nodes, size
+
+
+def _index_bytes(index):
+    size = _object_bytes(index) + sys.getsizeof(index.clauses_by_key)
+    size += sys.getsizeof(index.variable_clauses)
+    for clauses in index.clauses_by_key.values():
+        size += sys.getsizeof(clauses)
+    return size
+
+
+def database_memory_stats(database):
+    """Return the memory used by every predicate of the database, largest first.
+
+    Rules report their clauses, term nodes and bytes, along with the bytes of
+    their argument indexes. Fact tables report their rows as clauses and the
+    bytes of their columns, while SQLite tables keep their rows in the database
+    file and report no clause count. """
+    seen = set()
+    stats = []
+
+    for predicate in database.clause_index.predicates.values():
+        nodes = 0
+        size = sys.getsizeof(predicate.clauses)
+
+        for rule in predicate.clauses:
+            size += _object_bytes(rule)
+            for term in (rule.head, rule.tail):
+                term_nodes, term_size = term_footprint(term, seen)
+                nodes += term_nodes
+                size += term_size
+
+        stats.append(
+            {
+                "predicate": str(predicate.functor)
+                + "/"
+                + str(predicate.arity),
+                "storage": "rules",
+                "clauses": len(predicate.clauses),
+                "terms": nodes,
+                "bytes": size,
+                "index_bytes": sum(
+                    _index_bytes(index) for index in predicate.indexes.values()
+                ),
+            }
+        )
+
+    for (functor, arity), table in database.fact_tables.items():
+        rows, size = table.memory_usage()
+        stats.append(
+            {
+                "predicate": str(functor) + "/" + str(arity),
+                "storage": "table",
+                "clauses": rows,
+                "terms": 0,
+                "bytes": size,
+                "index_bytes": 0,
+            }
+        )
+
+    stats.sort(key=lambda entry: -entry["bytes"])
+    return stats
+
+
+class QueryMemory(object):
+    """The memory held by one query.
+
+    The bindings are sampled every sample_every goals for the number of entries
+    in their persistent map and the number of variable slots allocated. The
+    entries are the slots bound to a value, along with the union-find entries
+    of aliased variables: the alias of every slot which isn't the
+    representative of its set, and the rank of larger unbound sets. Since
+    counting the value bindings alone would mean walking the whole map, the
+    entries are reported as they are, which is also what the bindings take up
+    in memory.
+
+    With allocations set, tracemalloc traces the allocations of the query from
+    its first goal until stop() or report() is called. Every snapshot_every
+    goals, a snapshot of the traced allocations is taken if the traced memory
+    has grown by a tenth since the last one, and the top allocation sites of the
+    last snapshot are reported. If tracemalloc was already tracing, it's left
+    running and only its peak is reset. On Python 3.8, which can't reset the
+    peak, a query which stays below the earlier peak reports the largest size
+    sampled instead.
+
+    Without allocations, the accounting costs one counter update per goal and
+    a generator wrapping its proofs. """
+
+    def __init__(
+        self, sample_every=1, allocations=False, snapshot_every=1000, top=10
+    ):
+        self.sample_every = sample_every
+        self.allocations = allocations
+        self.snapshot_every = snapshot_every
+        self.top = top
+
+        self.goals = 0
+        self.open_goals = 0
+        self.peak_open_goals = 0
+        self.peak_binding_entries = 0
+        self.peak_slots = 0
+
+        self.peak_bytes = None
+        self.retained_bytes = None
+        self._tracing = False
+        self._started_tracing = False
+        self._base_bytes = 0
+        self._base_peak_bytes = 0
+        self._sampled_bytes = 0
+        self._snapshot = None
+        self._snapshot_bytes = 0
+
+    def track_goal(self, bindings, proofs):
+        """Return a generator over the proofs of the goal which keeps the count
+        of open goals up to date, sampling the bindings the goal starts from. """
+        self.goals += 1
+
+        if self.goals % self.sample_every == 0:
+            binding_entries = len(bindings.values)
+            if binding_entries > self.peak_binding_entries:
+                self.peak_binding_entries = binding_entries
+            if bindings.top > self.peak_slots:
+                self.peak_slots = bindings.top
+
+        if self.allocations:
+            if not self._tracing:
+                self._start_tracing()
+            elif self.goals % self.snapshot_every == 0:
+                self._sample_allocations()
+
+        return self._tracked_proofs(proofs)
+
+    def _tracked_proofs(self, proofs):
+        self.open_goals += 1
+        if self.open_goals > self.peak_open_goals:
+            self.peak_open_goals = self.open_goals
+        try:
+            yield from proofs
+        finally:
+            self.open_goals -= 1
+
+    def _start_tracing(self):
+        self._tracing = True
+        if tracemalloc.is_tracing():
+            # reset_peak() is new in Python 3.9. Before that, the peak of
+            # tracemalloc only tells us about the query once it goes past the
+            # earlier peak, so the base peak is kept to recognize that.
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            (
+                self._base_bytes,
+                self._base_peak_bytes,
+            ) = tracemalloc.get_traced_memory()
+        else:
+            tracemalloc.start()
+            self._started_tracing = True
+            self._base_bytes = self._base_peak_bytes = 0
+
+    def _sample_allocations(self):
+        current_bytes = tracemalloc.get_traced_memory()[0]
+        if current_bytes > self._sampled_bytes:
+            self._sampled_bytes = current_bytes
+        if current_bytes > self._snapshot_bytes * 1.1:
+            self._snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(True, _PACKAGE_FILES)]
+            )
+            self._snapshot_bytes = current_bytes
+
+    def stop(self):
+        """Stop tracing the allocations of the query, keeping their summary"""
+        if not self._tracing:
+            return
+
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+
+        # A peak which didn't go past the one from before the query isn't
+        # ours, so the largest sampled size stands in for it.
+        if peak_bytes <= self._base_peak_bytes:
+            peak_bytes = max(self._sampled_bytes, current_bytes)
+        self.peak_bytes = peak_bytes - self._base_bytes
+        self.retained_bytes = current_bytes - self._base_bytes
+
+        # A query which never grew far enough to be sampled is summarized by
+        # what it still holds at the end.
+        if self._snapshot is None:
+            self._snapshot_bytes = 0
+            self._sample_allocations()
+
+        if self._started_tracing:
+            tracemalloc.stop()
+        self._tracing = False
+        self._started_tracing = False
+
+    def report(self):
+        """Return the peak memory use of the query. With allocations traced,
+        the report also holds the peak and retained bytes allocated by the query
+        and its top allocation sites within the engine, by source line, with the
+        bytes and number of blocks they held in the last snapshot. """
+        self.stop()
+
+        report = {
+            "goals": self.goals,
+            "peak_open_goals": self.peak_open_goals,
+            "peak_binding_entries": self.peak_binding_entries,
+            "peak_slots": self.peak_slots,
+        }
+
+        if self.allocations and self.peak_bytes is not None:
+            report["peak_bytes"] = self.peak_bytes
+            report["retained_bytes"] = self.retained_bytes
+            report["allocations"] = [
+                {
+                    "location": os.path.basename(
+                        statistic.traceback[0].filename
+                    )
+                    + ":"
+                    + str(statistic.traceback[0].lineno),
+                    "bytes": statistic.size,
+                    "blocks": statistic.count,
+                }
+                for statistic in self._snapshot.statistics("lineno")[
+                    : self.top
+                ]
+            ]
+
+        return report
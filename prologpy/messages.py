@@ -0,0 +1,85 @@
+"""JSON messages describing the answers to a query.
+
+The command line runner and the query server both report a query as one message
+per answer followed by a summary of how the query finished:
+
+    {"query": "parent(X, c)", "answer": {"X": "b"}}
+    {"query": "parent(X, c)", "answers": 1, "inferences": 3, "seconds": 0.0001}
+
+A query which fails to parse, raises an error or times out reports an "error"
+field in its summary instead.
+
+Over a socket, each message is sent as its UTF-8 JSON text prefixed with the
+length of that text in bytes, as a 4 byte big-endian integer.
+"""
+
+import json
+import struct
+
+from prologpy.context import QueryContext
+
+HEADER = struct.Struct(">I")
+
+# Larger messages are rejected, so a corrupt header can't make us wait for
+# gigabytes of data
+MAX_MESSAGE_SIZE = 64 * 1024 * 1024
+
+DEFAULT_PORT = 7474
+
+
+def encode_message(message):
+    """Return the bytes sent over a socket for the message"""
+    body = json.dumps(message).encode("utf-8")
+    return HEADER.pack(len(body)) + body
+
+
+def decode_length(header):
+    """Return the length of the message body announced by the header"""
+    (length,) = HEADER.unpack(header)
+    if length > MAX_MESSAGE_SIZE:
+        raise Exception("Message too large: " + str(length) + " bytes")
+    return length
+
+
+def decode_message(body):
+    return json.loads(body.decode("utf-8"))
+
+
+def json_value(value):
+    """Return the JSON value of an answer term: an int for integers, None for
+    unbound variables and the text of the term for everything else. """
+    if value is None:
+        return None
+    if not value.arguments and isinstance(value.functor, int):
+        return value.functor
+    return str(value)
+
+
+def query_messages(
+    solver, query_text, limit=None, timeout=None, distinct=False, context=None
+):
+    """Return a generator over the messages for one query, one dict per answer
+    as soon as it's found followed by the summary. """
+    if context is None:
+        context = QueryContext(timeout=timeout)
+    answer_count = 0
+    summary = {"query": query_text}
+
+    try:
+        for solution in solver.iter_solutions(
+            query_text, distinct=distinct, limit=limit, context=context
+        ):
+            answer_count += 1
+            yield {
+                "query": query_text,
+                "answer": {
+                    name: json_value(value) for name, value in solution.items()
+                },
+            }
+    except Exception as exception:
+        summary["error"] = str(exception)
+
+    summary["answers"] = answer_count
+    summary["inferences"] = context.inferences
+    summary["seconds"] = round(context.elapsed, 6)
+    yield summary
@@ -1,27 +1,68 @@
 import re
-from prologpy.interpreter import Conjunction, Variable, Term, TRUE, Rule
-
-
-TOKEN_REGEX = r"[A-Za-z0-9_]+|:\-|[()\.,]"
+from prologpy.interpreter import (
+    Conjunction,
+    Variable,
+    Term,
+    TRUE,
+    Rule,
+    EMPTY_LIST,
+    make_list,
+)
+
+
+TOKEN_REGEX = r"[A-Za-z0-9_]+|:\-|\\\+|->|#\\=|#=|\.\.|[-+*]|[()\[\]|\.,;]"
 ATOM_NAME_REGEX = r"^[A-Za-z0-9_]+$"
 VARIABLE_REGEX = r"^[A-Z_][A-Za-z0-9_]*$"
+INTEGER_REGEX = r"^(0|[1-9][0-9]*)$"
 
 # Regex to parse comment strings. The first group captures quoted strings (
 # double and single). The second group captures regular comments ('%' for
 # single-line or '/* */' for multi-line)
 COMMENT_REGEX = r"(\".*?\"|\'.*?\')|(/\*.*?\*/|%[^\r\n]*$)"
 
+# The patterns are compiled once, when the module is imported, rather than being
+# looked up in the re module cache every time a token is classified. The
+# MULTILINE flag tells Python to treat each line in the string separately, while
+# the DOTALL flag indicates that we can match patterns which span multiple lines
+# (so our multi-line comments '/* */' can be processed)
+TOKEN_PATTERN = re.compile(TOKEN_REGEX)
+ATOM_NAME_PATTERN = re.compile(ATOM_NAME_REGEX)
+VARIABLE_PATTERN = re.compile(VARIABLE_REGEX)
+INTEGER_PATTERN = re.compile(INTEGER_REGEX)
+COMMENT_PATTERN = re.compile(COMMENT_REGEX, re.MULTILINE | re.DOTALL)
+
+# A '.' ends a clause unless it's part of the '..' operator
+CLAUSE_END_PATTERN = re.compile(r"(?<!\.)\.(?!\.)")
+
+# The infix operators, with their priority and type as in standard Prolog: an
+# "xfx" operator takes operands of lower priority on both sides, "yfx" allows
+# an operand of the same priority on the left, so 1 - 2 - 3 is (1 - 2) - 3.
+# Terms within the arguments of a compound term or a rule body have a priority
+# of at most 999, so the ',' between them is never read as an operator.
+INFIX_OPERATORS = {
+    "#=": (700, "xfx"),
+    "#\\=": (700, "xfx"),
+    "in": (700, "xfx"),
+    "ins": (700, "xfx"),
+    "..": (450, "xfx"),
+    "+": (500, "yfx"),
+    "-": (500, "yfx"),
+    "*": (400, "yfx"),
+}
+
+# The prefix operators, with the priority of the operand they take
+PREFIX_OPERATORS = {"\\+": 900}
+
+# The control operators of a goal sequence. Since they bind looser than ',', they
+# can only be used directly within a rule body or a parenthesized goal, where
+# (C -> T ; E) is read as ;(->(C, T), E).
+IF_THEN = "->"
+DISJUNCTION = ";"
+
 
 def remove_comments(input_text):
     """Return the input text string with all of the comments removed from it"""
 
-    # Create a regular expression Pattern object we can use to find and strip out
-    # comments. The MULTILINE flag tells Python to treat each line in the string
-    # separately, while the DOTALL flag indicates that we can match patterns
-    # which span multiple lines (so our multi-line comments '/* */' can  be
-    # processed)
-    regex = re.compile(COMMENT_REGEX, re.MULTILINE | re.DOTALL)
-
     def remove_comment(match):
         """If we found a match for our 2nd group, it is a comment, so we remove"""
         if match.group(2) is not None:
@@ -31,13 +72,54 @@ def remove_comments(input_text):
         else:
             return match.group(1)
 
-    return regex.sub(remove_comment, input_text)
+    return COMMENT_PATTERN.sub(remove_comment, input_text)
 
 
 def parse_tokens_from_string(input_text):
     """Convert the input text into a list of tokens we can iterate over / process"""
-    iterator = re.finditer(TOKEN_REGEX, remove_comments(input_text))
-    return [token.group() for token in iterator]
+    return TOKEN_PATTERN.findall(remove_comments(input_text))
+
+
+def split_clauses(input_text):
+    """Return the text of every clause in the input text, with the comments
+    removed and the surrounding whitespace stripped. Clauses end with a '.',
+    unless it's part of a '..' operator. Text after the last '.' is returned as a
+    clause of its own, so it fails to parse just like it would as part of the
+    whole text. """
+    pieces = CLAUSE_END_PATTERN.split(remove_comments(input_text))
+
+    clauses = [piece.strip() + "." for piece in pieces[:-1]]
+    if pieces[-1].strip():
+        clauses.append(pieces[-1].strip())
+
+    return clauses
+
+
+def parse_rules_from_lines(lines):
+    """Return a generator over the rules in an iterable of lines, i.e. an open
+    file. Every rule is parsed and generated as soon as its closing '.' has been
+    read, so the whole text never has to be held in memory. """
+    tokens = []
+    pending_text = ""
+
+    for line in lines:
+        pending_text += line
+
+        # Comments are removed once they're complete. While a '/*' comment is
+        # still open, we keep collecting lines until we reach its end.
+        text = remove_comments(pending_text)
+        if "/*" in text:
+            continue
+        pending_text = ""
+
+        for token in TOKEN_PATTERN.findall(text):
+            tokens.append(token)
+            if token == ".":
+                yield from Parser.from_tokens(tokens).parse_rules()
+                tokens = []
+
+    if tokens or pending_text.strip():
+        raise Exception("Unexpected end of input after: " + " ".join(tokens))
 
 
 class Parser(object):
@@ -47,11 +129,19 @@ class Parser(object):
 
     def __init__(self, input_text):
         self._tokens = parse_tokens_from_string(input_text)
+        self._position = 0
         self._scope = None
 
+    @classmethod
+    def from_tokens(cls, tokens):
+        """Return a parser for a list of already split tokens"""
+        parser = cls("")
+        parser._tokens = tokens
+        return parser
+
     def parse_rules(self):
         rules = []
-        while self._tokens:
+        while self._position < len(self._tokens):
             self._scope = {}
             rules.append(self._parse_rule())
         return rules
@@ -62,32 +152,76 @@ class Parser(object):
 
     @property
     def _current(self):
-        return self._tokens[0]
+        return self._tokens[self._position]
+
+    def _peek(self):
+        """Return the current token, or None at the end of the input"""
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
 
     def _pop_current(self):
-        return self._tokens.pop(0)
+        # Tokens are consumed by moving our position forward, since popping the
+        # front of the list would shift all of the remaining tokens every time.
+        token = self._tokens[self._position]
+        self._position += 1
+        return token
 
     def _parse_atom(self):
         name = self._pop_current()
-        if re.match(ATOM_NAME_REGEX, name) is None:
+        if ATOM_NAME_PATTERN.match(name) is None:
             raise Exception("Invalid Atom Name: " + str(name))
         return name
 
-    def _parse_term(self):
+    def _parse_term(self, max_priority=999):
+        """Parse a term along with any infix operators following it, as long as
+        their priority is at most max_priority. """
+        term = self._parse_primary()
+        term_priority = 0
+
+        while True:
+            operator = self._peek()
+            if operator not in INFIX_OPERATORS:
+                return term
+
+            priority, operator_type = INFIX_OPERATORS[operator]
+            left_priority = (
+                priority if operator_type == "yfx" else priority - 1
+            )
+            if priority > max_priority or term_priority > left_priority:
+                return term
+
+            self._pop_current()
+            right = self._parse_term(priority - 1)
+            term = Term(operator, [term, right])
+            term_priority = priority
+
+    def _parse_primary(self):
         # If we encounter an opening parenthesis, we know we're dealing with a
-        # conjunction, so we process the list of arguments until we hit a closing
-        # parenthesis and return the conjunction object.
+        # conjunction, so we process the goals until we hit a closing parenthesis
+        # and return the conjunction object, or the if-then-else or disjunction
+        # the goals are part of.
         if self._current == "(":
             self._pop_current()
-            arguments = self._parse_arguments()
-            return Conjunction(arguments)
+            if self._current == ")":
+                self._pop_current()
+                return Conjunction([])
+            return self._parse_body(")")
+
+        if self._current in PREFIX_OPERATORS:
+            operator = self._pop_current()
+            operand = self._parse_term(PREFIX_OPERATORS[operator])
+            return Term(operator, [operand])
+
+        if self._current == "[":
+            return self._parse_list()
 
         functor = self._parse_atom()
 
         # If we have a matching variable, we make sure that variables with the same
         # name within a rule always use one variable object (with the exception of
         # the anonymous '_' variable object).
-        if re.match(VARIABLE_REGEX, functor) is not None:
+        if VARIABLE_PATTERN.match(functor) is not None:
 
             if functor == "_":
                 return Variable("_")
@@ -100,14 +234,43 @@ class Parser(object):
 
             return variable
 
+        # Integers are stored as Python ints so they can be summed and compared
+        if INTEGER_PATTERN.match(functor) is not None:
+            return Term(int(functor))
+
         # If there are no arguments to process, return an atom. Atoms are processed
         # as terms without arguments.
-        if self._current != "(":
+        if self._peek() != "(":
             return Term(functor)
         self._pop_current()
         arguments = self._parse_arguments()
         return Term(functor, arguments)
 
+    def _parse_list(self):
+        self._pop_current()
+
+        # Process the list elements until we hit the closing bracket or a '|'
+        # followed by the tail of the list, i.e. [Head | Tail]
+        items = []
+        tail = EMPTY_LIST
+
+        if self._current != "]":
+            items.append(self._parse_term())
+            while self._current == ",":
+                self._pop_current()
+                items.append(self._parse_term())
+            if self._current == "|":
+                self._pop_current()
+                tail = self._parse_term()
+
+        if self._current != "]":
+            raise Exception(
+                "Expected , | or ] in list but got " + str(self._current)
+            )
+        self._pop_current()
+
+        return make_list(items, tail)
+
     def _parse_arguments(self):
         arguments = []
         # Keep adding the arguments to our list until we encounter an ending
@@ -139,23 +302,54 @@ class Parser(object):
 
         self._pop_current()
 
-        # Process the rule arguments
-        arguments = []
+        return Rule(head, self._parse_body("."))
 
-        while self._current != ".":
-            arguments.append(self._parse_term())
+    def _parse_goals(self, end):
+        """Parse a sequence of goals separated by ',' as a conjunction"""
+        goals = [self._parse_term()]
 
-            if self._current not in (",", "."):
-                raise Exception(
-                    "Expected , or . in term but got " + str(self._current)
-                )
+        while self._current == ",":
+            self._pop_current()
+            goals.append(self._parse_term())
 
-            if self._current == ",":
+        if self._current not in (",", IF_THEN, DISJUNCTION, end):
+            raise Exception(
+                "Expected , or "
+                + end
+                + " in term but got "
+                + str(self._current)
+            )
+
+        return Conjunction(goals)
+
+    def _parse_body(self, end):
+        """Parse the goals of a rule body or a parenthesized goal up to and
+        including the end token. Branches separated by ';' are returned as a
+        disjunction, and a branch of the form Condition -> Then as an if-then. """
+        branches = []
+
+        while True:
+            branch = self._parse_goals(end)
+            if self._current == IF_THEN:
                 self._pop_current()
+                branch = Term(IF_THEN, [branch, self._parse_goals(end)])
+            branches.append(branch)
+
+            if self._current != DISJUNCTION:
+                break
+            self._pop_current()
 
+        if self._current != end:
+            raise Exception(
+                "Expected ; or "
+                + end
+                + " in term but got "
+                + str(self._current)
+            )
         self._pop_current()
 
-        # If we have more than one argument, we return a conjunction, otherwise,
-        # we process the item as a regular rule containing a head and a tail
-        tail = arguments[0] if arguments == 1 else Conjunction(arguments)
-        return Rule(head, tail)
+        # ';' is right associative, so (A ; B ; C) is read as (A ; (B ; C))
+        body = branches.pop()
+        while branches:
+            body = Term(DISJUNCTION, [branches.pop(), body])
+        return body
@@ -0,0 +1,192 @@
+"""A persistent map keyed by non-negative integers.
+
+The map is an array mapped trie: every node is a 32 way array covering 5 bits of
+the key, so a lookup is a handful of list indexing operations. Updating the map
+copies the nodes on the path to the key and shares everything else with the
+previous version, so extending a map costs O(log n) time and memory, and every
+older version of the map stays valid and unchanged.
+
+Several updates can be batched through a transient, which copies each node at
+most once and then edits its own copies in place until it is made persistent
+again.
+"""
+
+_BITS = 5
+_WIDTH = 1 << _BITS
+_MASK = _WIDTH - 1
+
+# Every node is a list of _WIDTH entries followed by the owner of the node. Only
+# the transient that owns a node may edit it in place; nodes of persistent maps
+# are owned by nobody.
+_OWNER = _WIDTH
+
+
+def _new_node(owner=None):
+    node = [None] * (_WIDTH + 1)
+    node[_OWNER] = owner
+    return node
+
+
+class PersistentMap(object):
+    """An immutable map from non-negative integers to values. None can't be
+    stored as a value, since it marks absent keys. """
+
+    __slots__ = ("_root", "_shift", "_size")
+
+    def __init__(self, root=None, shift=0, size=0):
+        self._root = root if root is not None else _new_node()
+        self._shift = shift
+        self._size = size
+
+    def get(self, key, default=None):
+        # This is the hottest path of the map, so the trie walk is inlined here
+        # rather than calling _lookup.
+        shift = self._shift
+        if key >> (shift + _BITS):
+            return default
+
+        node = self._root
+        while shift:
+            node = node[(key >> shift) & _MASK]
+            if node is None:
+                return default
+            shift -= _BITS
+
+        value = node[key & _MASK]
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = _lookup(self._root, self._shift, key, None)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return _lookup(self._root, self._shift, key, None) is not None
+
+    def set(self, key, value):
+        """Return a new map with the key set to the value"""
+        transient = self.transient()
+        transient[key] = value
+        return transient.persistent()
+
+    def transient(self):
+        """Return a mutable copy of the map for batching several updates"""
+        return TransientMap(self._root, self._shift, self._size)
+
+    def items(self):
+        return _items(self._root, self._shift, 0)
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def __iter__(self):
+        return self.keys()
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return (
+            "PersistentMap({"
+            + ", ".join(
+                repr(key) + ": " + repr(value) for key, value in self.items()
+            )
+            + "})"
+        )
+
+
+class TransientMap(object):
+    """A mutable view of a persistent map.
+
+    The first update to a node copies it and marks the copy as owned by the
+    transient, and later updates to an owned node change it in place. The
+    original map is never modified. """
+
+    __slots__ = ("_root", "_shift", "_size", "_owner")
+
+    def __init__(self, root, shift, size):
+        self._root = root
+        self._shift = shift
+        self._size = size
+        self._owner = object()
+
+    # Transients share the inlined lookup of persistent maps
+    get = PersistentMap.get
+
+    def __contains__(self, key):
+        return _lookup(self._root, self._shift, key, None) is not None
+
+    def __setitem__(self, key, value):
+        if key < 0 or value is None:
+            raise KeyError(key)
+
+        owner = self._owner
+
+        # Add levels on top of the root until the trie is deep enough to hold
+        # the key. The old root becomes the first child of the new one.
+        while key >> (self._shift + _BITS):
+            root = _new_node(owner)
+            root[0] = self._root
+            self._root = root
+            self._shift += _BITS
+
+        # Walk down to the leaf, copying every node we don't own yet
+        node = self._root
+        if node[_OWNER] is not owner:
+            node = self._root = node[:]
+            node[_OWNER] = owner
+
+        shift = self._shift
+        while shift:
+            index = (key >> shift) & _MASK
+            child = node[index]
+            if child is None:
+                child = node[index] = _new_node(owner)
+            elif child[_OWNER] is not owner:
+                child = node[index] = child[:]
+                child[_OWNER] = owner
+            node = child
+            shift -= _BITS
+
+        index = key & _MASK
+        if node[index] is None:
+            self._size += 1
+        node[index] = value
+
+    def persistent(self):
+        """Return the current contents as a persistent map. The transient gets a
+        new owner, so the returned map is never changed by later updates. """
+        self._owner = object()
+        return PersistentMap(self._root, self._shift, self._size)
+
+    def __len__(self):
+        return self._size
+
+
+def _lookup(node, shift, key, default):
+    if key >> (shift + _BITS):
+        return default
+
+    while shift:
+        node = node[(key >> shift) & _MASK]
+        if node is None:
+            return default
+        shift -= _BITS
+
+    value = node[key & _MASK]
+    return default if value is None else value
+
+
+def _items(node, shift, prefix):
+    for index in range(_WIDTH):
+        entry = node[index]
+        if entry is None:
+            continue
+
+        key = prefix | (index << shift)
+
+        if shift == 0:
+            yield key, entry
+        else:
+            yield from _items(entry, shift - _BITS, key)
@@ -0,0 +1,169 @@
+"""A query server which keeps one loaded database in memory.
+
+    python -m prologpy rules.pl --serve [--host HOST] [--port PORT]
+    python -m prologpy rules.pl --serve --socket PATH
+
+Many clients share the rules loaded by one server process instead of each one
+parsing and holding its own copy. Clients connect over TCP or a Unix socket and
+send length-prefixed JSON requests (see prologpy.messages):
+
+    {"id": 1, "query": "parent(X, c)", "limit": 10, "timeout": 5}
+
+Every message sent back for a request carries its id: one message per answer as
+soon as it's found, followed by the summary of the query. A client doesn't have
+to wait for a query to finish before sending the next request. The queries of
+all connections run concurrently on a pool of threads and their messages are
+interleaved on the connection. A request {"cancel": 1} stops the query with id
+1, and closing the connection stops all of its queries.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from prologpy.context import QueryContext
+from prologpy.messages import (
+    DEFAULT_PORT,
+    HEADER,
+    decode_length,
+    decode_message,
+    encode_message,
+    query_messages,
+)
+
+
+async def read_message(reader):
+    """Return the next message from the stream, or None once it has ended"""
+    try:
+        header = await reader.readexactly(HEADER.size)
+    except asyncio.IncompleteReadError as error:
+        if not error.partial:
+            return None
+        raise
+
+    body = await reader.readexactly(decode_length(header))
+    return decode_message(body)
+
+
+class QueryServer(object):
+    """Answers the queries of any number of connections with one solver.
+
+    Queries run on a pool of max_workers threads, so a long search doesn't hold
+    up the other clients. The timeout applies to requests which don't set their
+    own. """
+
+    def __init__(self, solver, max_workers=None, timeout=None):
+        self.solver = solver
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def start(self, host="127.0.0.1", port=DEFAULT_PORT, path=None):
+        """Start listening on the Unix socket path if one is given, otherwise on
+        the TCP host and port, and return the asyncio server. """
+        if path is not None:
+            return await asyncio.start_unix_server(
+                self.handle_connection, path=path
+            )
+        return await asyncio.start_server(self.handle_connection, host, port)
+
+    def _solve(self, request, context, send):
+        for message in query_messages(
+            self.solver,
+            request["query"],
+            limit=request.get("limit"),
+            distinct=request.get("distinct", False),
+            context=context,
+        ):
+            message["id"] = request.get("id")
+            send(message)
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        write_lock = asyncio.Lock()
+        contexts = {}
+        tasks = set()
+
+        async def write(message):
+            async with write_lock:
+                writer.write(encode_message(message))
+                await writer.drain()
+
+        def send(message):
+            # Called from the query threads, which wait until the message has
+            # been written. A slow reader therefore slows its own queries down
+            # instead of piling up answers in memory.
+            asyncio.run_coroutine_threadsafe(write(message), loop).result()
+
+        try:
+            while True:
+                request = await read_message(reader)
+                if request is None:
+                    break
+
+                if "cancel" in request:
+                    context = contexts.get(request["cancel"])
+                    if context is not None:
+                        context.cancel()
+                    continue
+
+                if not isinstance(request.get("query"), str):
+                    await write(
+                        {
+                            "id": request.get("id"),
+                            "error": "Request without a query",
+                        }
+                    )
+                    continue
+
+                request_id = request.get("id")
+                timeout = request.get("timeout", self.timeout)
+                context = contexts[request_id] = QueryContext(timeout=timeout)
+
+                task = loop.run_in_executor(
+                    self.executor, self._solve, request, context, send
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(
+                    lambda _, request_id=request_id: contexts.pop(
+                        request_id, None
+                    )
+                )
+
+        except Exception:
+            # The client sent something we can't read, which ends the connection
+            # just like the client going away.
+            pass
+
+        finally:
+            # Once the connection is closed, nobody is waiting for the answers
+            # of the queries still running, so they're all stopped.
+            for context in list(contexts.values()):
+                context.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+
+def serve(
+    solver,
+    host="127.0.0.1",
+    port=DEFAULT_PORT,
+    path=None,
+    max_workers=None,
+    timeout=None,
+):
+    """Serve queries with the solver until the process is interrupted"""
+    query_server = QueryServer(
+        solver, max_workers=max_workers, timeout=timeout
+    )
+
+    async def run():
+        server = await query_server.start(host, port, path)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        query_server.executor.shutdown(wait=False)
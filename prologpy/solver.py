@@ -1,64 +1,278 @@
-from prologpy.interpreter import Database, Variable
-from prologpy.parser import Parser
+from prologpy.interpreter import (
+    Database,
+    TRUE,
+    Variable,
+    query_variables,
+    term_key,
+)
+from prologpy.parser import Parser, split_clauses
 from collections import defaultdict
+from itertools import islice
+
+
+SOLVER_MODES = ("prolog", "datalog")
 
 
 class Solver(object):
-    def __init__(self, rules_text):
+    def __init__(
+        self, rules_text, mode="prolog", fact_tables=False, occurs_check="off"
+    ):
         """Parse the rules text and initialize the database we plan to use to query
-        our rules."""
+        our rules.
+
+        In "datalog" mode, function-free programs with ground facts are also
+        evaluated bottom-up into materialized relations, and queries which only
+        involve plain predicates are answered from those relations. Programs
+        which aren't Datalog-safe silently fall back to top-down resolution.
+
+        Passing fact_tables=True stores ground fact predicates as NumPy-backed
+        columns, which speeds up matching and joining large relations.
+
+        The occurs_check policy ("off", "on" or "error") controls unification of
+        a variable with a term containing that variable, see Database. """
+        if mode not in SOLVER_MODES:
+            raise Exception("Unknown solver mode: " + str(mode))
+
+        self.mode = mode
+
+        # The rules of every clause by clause text, kept once update_rules is
+        # used so that later edits only parse the clauses which changed
+        self.clause_rules = None
+
         rules = Parser(rules_text).parse_rules()
-        self.database = Database(rules)
+        self.database = Database(
+            rules, fact_tables=fact_tables, occurs_check=occurs_check
+        )
 
-    def find_solutions(self, query_text):
-        """Parse the query text and use our database rules to search for matching
-        query solutions. """
+        self.datalog = None
+        self._load_datalog(rules)
+
+    def _load_datalog(self, rules):
+        if self.mode == "datalog":
+            # The modules behind the optional features of the solver are only
+            # imported when they're used, which keeps the start up time of short
+            # lived processes down.
+            from prologpy.datalog import DatalogEngine, is_datalog_program
+
+            if is_datalog_program(rules):
+                self.datalog = DatalogEngine(rules)
+
+    def _parse_clauses(self, rules_text):
+        """Parse the rules text clause by clause and return its rules. Clauses
+        whose text was already parsed last time reuse the same rule objects, only
+        new or edited clauses are parsed again. """
+        previous_clause_rules = self.clause_rules or {}
+        clause_rules = {}
+        rules = []
+        for clause_text in split_clauses(rules_text):
+            parsed_rules = clause_rules.get(clause_text)
+            if parsed_rules is None:
+                parsed_rules = previous_clause_rules.get(clause_text)
+            if parsed_rules is None:
+                parsed_rules = Parser(clause_text).parse_rules()
+            clause_rules[clause_text] = parsed_rules
+            rules.extend(parsed_rules)
+
+        # The cache is only replaced once the whole text parsed successfully
+        self.clause_rules = clause_rules
+        return rules
+
+    @classmethod
+    def from_database(cls, database):
+        """Return a solver for an already built database, i.e. one shared with
+        another solver or loaded by a parent process. No rules text is parsed,
+        and queries are solved top-down. """
+        solver = cls.__new__(cls)
+        solver.database = database
+        solver.datalog = None
+        solver.mode = "prolog"
+        solver.clause_rules = None
+        return solver
+
+    def update_rules(self, rules_text):
+        """Replace the rules of the solver with those of the edited rules text.
+
+        Only the clauses whose text changed since the last update are parsed,
+        and the database is patched in place: predicates whose clauses are all
+        unchanged keep their argument indexes. The text of the clauses is only
+        kept from the first update on, so that update parses every clause. Facts
+        added with add_facts are replaced as well, while SQLite tables stay
+        attached. If the new text fails to parse, the solver is left as it
+        was. """
+        rules = self._parse_clauses(rules_text)
+        self.database.replace_rules(rules)
+
+        # Derived relations can't be retracted, so they're computed again
+        self.datalog = None
+        self._load_datalog(rules)
+
+    def add_facts(self, facts_text):
+        """Parse the facts text and add the facts to our database. In datalog mode
+        the materialized relations are updated incrementally. """
+        rules = Parser(facts_text).parse_rules()
+
+        if self.datalog is not None:
+            from prologpy.datalog import is_datalog_program
+
+            if not is_datalog_program(rules) or any(
+                not isinstance(rule.tail, TRUE) for rule in rules
+            ):
+                raise Exception(
+                    "Only ground facts can be added in datalog mode"
+                )
+            self.datalog.add_facts([rule.head for rule in rules])
+
+        self.database.add_rules(rules)
+
+    def add_sqlite_table(self, functor, path, table, columns=None, **options):
+        """Declare the functor as a predicate whose facts are the rows of a SQLite
+        table, with one column per argument. Bound query arguments are pushed
+        down to SQLite as WHERE conditions and the rows are streamed lazily.
+
+        The table is read-only: add_facts raises for its predicate unless
+        writable=True is passed, which makes it insert the facts and commit them
+        into the database file. Rules for the predicate can't be added. """
+        from prologpy.sqlite_tables import SQLiteFactTable
 
+        sqlite_table = SQLiteFactTable(
+            functor, path, table, columns=columns, **options
+        )
+        self.database.add_fact_table(sqlite_table)
+
+        # External facts can't be materialized bottom-up, so queries fall back
+        # to top-down resolution from here on.
+        self.datalog = None
+        self.mode = "prolog"
+
+        return sqlite_table
+
+    def _answers(self, query_text, context=None):
+        """Parse the query text and return the names of its variables along with
+        a generator over the answers to the query. """
         query = Parser(query_text).parse_query()
 
-        query_variable_map = {}
-        variables_in_query = False
-
-        # Find any variables within the query and return a map containing the
-        # variable name to actual Prolog variable mapping we can later use to query
-        # our database.
-        for argument in query.arguments:
-            if isinstance(argument, Variable):
-                variables_in_query = True
-                query_variable_map[argument.name] = argument
-
-        # Return a generator which iterates over the terms matching our query
-        matching_query_terms = [item for item in self.database.query(query)]
-
-        if matching_query_terms:
-            if query_variable_map:
-
-                # If our query has variables and we have matching query terms/items,
-                # we iterate over the query items and our list of query variables and
-                # construct a map containing the matching variable names and their
-                # values
-                solutions_map = defaultdict(list)
-                for matching_query_term in matching_query_terms:
-                    matching_variable_bindings = query.match_variable_bindings(
-                        matching_query_term
-                    )
-
-                    # Itarate over the query variables and bind them to the matched
-                    # database bindings
-                    for variable_name, variable in query_variable_map.items():
-                        solutions_map[variable_name].append(
-                            matching_variable_bindings.get(variable)
-                        )
-
-                return solutions_map
-
-            else:
-                # If we have matching query items / terms but no variables in our
-                # query, we simply return true to indicate that our query did match
-                # our goal. Otherwise, we return None
-                return True if not variables_in_query else None
-        else:
-            # If we have no variables in our query, it means our goal had no matches,
-            # so we return False. Otherwise simply return None to show no variable
-            # bindings were found.
-            return False if not variables_in_query else None
+        # Find the named variables within the query. These are the only values we
+        # read from each answer.
+        names = [variable.name for variable in query_variables(query)]
+
+        # Answer the query from the materialized relations when we can, otherwise
+        # fall back to searching our database rules top-down.
+        if self.datalog is not None and self.datalog.can_answer(query):
+            return names, self.datalog.answers(query)
+        return names, self.database.answers(query, context)
+
+    @staticmethod
+    def _answer_rows(names, answers, distinct, approximate_capacity):
+        """Return a generator over the values of the named variables for every
+        answer, with None for the variables an answer leaves unbound. """
+        seen_answers = None
+        if distinct:
+            from prologpy.distinct import BloomFilter, DistinctFilter
+
+            seen_answers = (
+                DistinctFilter()
+                if approximate_capacity is None
+                else BloomFilter(approximate_capacity)
+            )
+
+        for answer in answers:
+            values = []
+            for name in names:
+                value = answer[name]
+                values.append(None if isinstance(value, Variable) else value)
+
+            if seen_answers is not None and not seen_answers.add(
+                tuple(
+                    None if value is None else term_key(value)
+                    for value in values
+                )
+            ):
+                continue
+
+            yield values
+
+    def find_solutions(
+        self, query_text, distinct=False, approximate_capacity=None
+    ):
+        """Parse the query text and use our database rules to search for matching
+        query solutions.
+
+        With distinct=True, an answer is only reported the first time its values
+        for the query variables are found, no matter how many derivations lead
+        to it. Answers are compared by hashing their term keys. Passing an
+        approximate_capacity bounds the memory used for this with a Bloom filter
+        sized for that many distinct answers, at the cost of rarely dropping an
+        answer which wasn't actually seen before. """
+
+        names, answers = self._answers(query_text)
+
+        if not names:
+            # If we have no variables in our query, we only need to know whether
+            # the goal has at least one answer, so we stop at the first one.
+            first_answer = next(answers, None)
+            answers.close()
+            return first_answer is not None
+
+        # If our query has variables, we iterate over the answers and our list of
+        # query variables and construct a map containing the matching variable
+        # names and their values
+        solutions_map = defaultdict(list)
+        for values in self._answer_rows(
+            names, answers, distinct, approximate_capacity
+        ):
+            for name, value in zip(names, values):
+                solutions_map[name].append(value)
+
+        # If we have no answers, we simply return None to show no variable bindings
+        # were found.
+        return solutions_map if solutions_map else None
+
+    def iter_solutions(
+        self,
+        query_text,
+        distinct=False,
+        approximate_capacity=None,
+        limit=None,
+        context=None,
+    ):
+        """Return a generator over the solutions of the query, one dict of query
+        variable names to values per answer, with None for unbound values. Each
+        solution is generated as soon as it's found.
+
+        At most limit solutions are generated. A QueryContext can be passed to
+        give the search a timeout, to cancel it from another thread or to count
+        its inferences. """
+        names, answers = self._answers(query_text, context)
+        rows = self._answer_rows(
+            names, answers, distinct, approximate_capacity
+        )
+
+        for values in islice(rows, limit):
+            yield dict(zip(names, values))
+
+    def find_table(
+        self,
+        query_text,
+        distinct=False,
+        approximate_capacity=None,
+        batch_size=10000,
+    ):
+        """Parse the query text and return its answers as a ResultTable, with one
+        dictionary encoded column per query variable. Answers are read and
+        encoded batch_size at a time, so only the values of the current batch
+        are ever held as terms. The table can be exported with to_numpy() or
+        to_arrow(). """
+        from prologpy.columns import ResultTable
+
+        names, answers = self._answers(query_text)
+        rows = self._answer_rows(
+            names, answers, distinct, approximate_capacity
+        )
+
+        table = ResultTable(names)
+        batch = list(islice(rows, batch_size))
+        while batch:
+            table.append_batch(batch)
+            batch = list(islice(rows, batch_size))
+
+        return table
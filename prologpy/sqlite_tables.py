@@ -0,0 +1,234 @@
+"""Fact tables backed by a local SQLite database.
+
+A predicate can be declared as backed by a SQLite table with one column per
+argument. Goals on that predicate are translated into a SELECT statement whose
+WHERE clause holds the bound arguments, so SQLite can use its indexes to find
+the matching rows, and the rows are streamed back lazily as terms. The facts
+never need to be loaded into Python memory as a whole.
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from prologpy.interpreter import Term, Variable
+
+
+def _quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of SQLite connections to one database file.
+
+    Idle connections are reused by later queries. A query which finds the pool
+    empty opens a new connection instead of waiting, since a suspended query
+    generator keeps its connection while nested goals run their own queries.
+    At most max_idle connections are kept around once they are released. """
+
+    def __init__(self, path, max_idle=4):
+        self.path = path
+        self.max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Connections move between threads as they are handed out by the pool,
+        # but each one is only ever used by one query at a time.
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        """Lend out a connection and return it to the pool when done"""
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+
+        if connection is None:
+            connection = self._connect()
+
+        try:
+            yield connection
+        finally:
+            with self._lock:
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection in idle:
+            connection.close()
+
+
+class SQLiteFactTable(object):
+    """A predicate whose ground facts are the rows of a SQLite table.
+
+    Each argument of the predicate maps to one column of the table. When no
+    columns are given, all of the table columns are used in their declared
+    order. Rows are returned in rowid order, which is the order they were
+    inserted in for regular tables.
+
+    The table belongs to the database file, so it's read-only unless writable
+    is set, in which case facts added for the predicate are inserted and
+    committed into the file. """
+
+    def __init__(
+        self,
+        functor,
+        path,
+        table,
+        columns=None,
+        pool=None,
+        batch_size=1000,
+        create_indexes=False,
+        writable=False,
+    ):
+        self.functor = functor
+        self.table = table
+        self.writable = writable
+        self.pool = pool if pool is not None else ConnectionPool(path)
+        self.batch_size = batch_size
+        self.create_indexes = create_indexes
+
+        if columns is None:
+            with self.pool.connection() as connection:
+                columns = [
+                    column[1]
+                    for column in connection.execute(
+                        "PRAGMA table_info(" + _quote_identifier(table) + ")"
+                    )
+                ]
+            if not columns:
+                raise Exception("Unknown SQLite table: " + str(table))
+
+        self.columns = list(columns)
+        self.arity = len(self.columns)
+        self._indexed_columns = set()
+
+    def prepare(self):
+        """Close the idle connections before forking, since a SQLite connection
+        mustn't be used by more than one process. Workers open their own. """
+        self.pool.close()
+
+    def memory_usage(self):
+        """The rows stay in the database file, so they take no memory here and
+        aren't counted. """
+        return None, 0
+
+    def _selection(self, goal):
+        """Translate the goal arguments into a WHERE clause and its parameters.
+
+        Returns None if the goal can't match any row, i.e. when an argument is
+        bound to a compound term. """
+        conditions = []
+        parameters = []
+        variable_columns = {}
+
+        for column, argument in zip(self.columns, goal.arguments):
+            quoted_column = _quote_identifier(column)
+
+            if isinstance(argument, Variable):
+                if argument.name == "_":
+                    continue
+                first_column = variable_columns.setdefault(
+                    id(argument), quoted_column
+                )
+                if first_column != quoted_column:
+                    conditions.append(first_column + " = " + quoted_column)
+            elif argument.arguments:
+                return None
+            else:
+                conditions.append(quoted_column + " = ?")
+                parameters.append(argument.functor)
+                self._ensure_index(column)
+
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        return where, parameters
+
+    def _ensure_index(self, column):
+        """Create an index on the column the first time a goal binds it, if the
+        table was set up to create its own indexes. """
+        if not self.create_indexes or column in self._indexed_columns:
+            return
+
+        with self.pool.connection() as connection:
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS "
+                + _quote_identifier(
+                    "prologpy_" + str(self.table) + "_" + str(column)
+                )
+                + " ON "
+                + _quote_identifier(self.table)
+                + " ("
+                + _quote_identifier(column)
+                + ")"
+            )
+            connection.commit()
+
+        self._indexed_columns.add(column)
+
+    def query(self, goal):
+        """Return a generator streaming the facts which match the goal"""
+        selection = self._selection(goal)
+        if selection is None:
+            return
+
+        where, parameters = selection
+        statement = (
+            "SELECT "
+            + ", ".join(_quote_identifier(column) for column in self.columns)
+            + " FROM "
+            + _quote_identifier(self.table)
+            + where
+            + " ORDER BY rowid"
+        )
+
+        with self.pool.connection() as connection:
+            cursor = connection.execute(statement, parameters)
+            try:
+                rows = cursor.fetchmany(self.batch_size)
+                while rows:
+                    for row in rows:
+                        yield Term(
+                            self.functor, [Term(value) for value in row]
+                        )
+                    rows = cursor.fetchmany(self.batch_size)
+            finally:
+                cursor.close()
+
+    def join(self, goal, other_table, other_goal):
+        # Joins across SQLite tables go through the regular nested search, where
+        # each inner goal is still answered by an indexed selection.
+        return None
+
+    def append(self, head):
+        """Insert the ground fact head as a new row of the table, and commit it
+        to the database file. Tables are read-only unless they were created as
+        writable. """
+        if not self.writable:
+            raise Exception(
+                "Cannot add facts to the read-only SQLite table "
+                + str(self.table)
+                + " of "
+                + str(self.functor)
+                + "/"
+                + str(self.arity)
+            )
+
+        with self.pool.connection() as connection:
+            connection.execute(
+                "INSERT INTO "
+                + _quote_identifier(self.table)
+                + " ("
+                + ", ".join(
+                    _quote_identifier(column) for column in self.columns
+                )
+                + ") VALUES ("
+                + ", ".join("?" for _ in self.columns)
+                + ")",
+                [argument.functor for argument in head.arguments],
+            )
+            connection.commit()
@@ -0,0 +1,298 @@
+"""Column-oriented storage for large ground relations.
+
+Predicates which only consist of ground facts over atoms (i.e. edge(a, b)) can
+be stored as NumPy integer columns over interned symbols instead of one Rule per
+fact. Goals with bound arguments are then matched with a sorted search or a
+vectorized mask, and conjunctions of two such goals are joined in bulk. NumPy is
+only required when fact tables are enabled.
+"""
+
+import sys
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - depends on the environment
+    numpy = None
+
+from prologpy.interpreter import Conjunction, Term, TRUE, Variable
+
+
+def _is_atom(term):
+    return (
+        isinstance(term, Term)
+        and not isinstance(term, (Conjunction, TRUE))
+        and len(term.arguments) == 0
+    )
+
+
+def is_ground_fact(rule):
+    """Return True if the rule is a fact whose arguments are all atoms"""
+    return (
+        isinstance(rule.tail, TRUE)
+        and not isinstance(rule.head, (Variable, Conjunction))
+        and len(rule.head.arguments) > 0
+        and all(_is_atom(argument) for argument in rule.head.arguments)
+    )
+
+
+class SymbolTable(object):
+    """Interns atom names to dense integer ids and shares one Term per atom"""
+
+    def __init__(self):
+        self._ids = {}
+        self._atoms = []
+
+    def intern(self, value):
+        symbol_id = self._ids.get(value)
+        if symbol_id is None:
+            symbol_id = self._ids[value] = len(self._atoms)
+            self._atoms.append(Term(value))
+        return symbol_id
+
+    def lookup(self, value):
+        """Return the id of the value, or None if it was never interned"""
+        return self._ids.get(value)
+
+    def atom(self, symbol_id):
+        return self._atoms[symbol_id]
+
+    def __len__(self):
+        return len(self._atoms)
+
+
+class FactTable(object):
+    """A ground relation stored as one integer column per argument.
+
+    Rows keep their insertion order so queries return answers in the same order
+    as scanning the equivalent facts would. Appended rows are buffered and
+    merged into the columns the next time the table is read. """
+
+    def __init__(self, functor, arity, symbols):
+        if numpy is None:
+            raise ImportError("NumPy is required to use fact tables")
+
+        self.functor = functor
+        self.arity = arity
+        self.symbols = symbols
+        self.columns = [numpy.empty(0, dtype=numpy.int64)] * arity
+
+        self._pending = []
+        self._sorted_orders = {}
+
+    def append(self, head):
+        """Add the ground fact head to the table"""
+        self._pending.append(
+            [
+                self.symbols.intern(argument.functor)
+                for argument in head.arguments
+            ]
+        )
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        pending = numpy.array(self._pending, dtype=numpy.int64).reshape(
+            -1, self.arity
+        )
+        self.columns = [
+            numpy.concatenate((column, pending[:, position]))
+            for position, column in enumerate(self.columns)
+        ]
+        self._pending = []
+        self._sorted_orders = {}
+
+    def _sorted_order(self, position):
+        """Return the stable sort order of a column along with the sorted column
+        values. Both are computed once per column and reused by later queries. """
+        sorted_order = self._sorted_orders.get(position)
+        if sorted_order is None:
+            order = numpy.argsort(self.columns[position], kind="stable")
+            sorted_order = self._sorted_orders[position] = (
+                order,
+                self.columns[position][order],
+            )
+        return sorted_order
+
+    def prepare(self):
+        """Merge the buffered rows and sort every column now instead of on first
+        use, e.g. so forked workers share the sort orders. """
+        self._flush()
+        for position in range(self.arity):
+            self._sorted_order(position)
+
+    def __len__(self):
+        self._flush()
+        return len(self.columns[0]) if self.arity else 0
+
+    def memory_usage(self):
+        """Return the number of rows and the bytes held by the columns, the
+        sort orders and the buffered rows. The symbol table is shared by all of
+        the tables and isn't included. """
+        size = sum(column.nbytes for column in self.columns)
+        for order, sorted_column in self._sorted_orders.values():
+            size += order.nbytes + sorted_column.nbytes
+        size += sum(sys.getsizeof(row) for row in self._pending)
+        return len(self), size
+
+    def select(self, goal):
+        """Return the indexes of the rows matching the goal, in row order"""
+        self._flush()
+
+        bound = []
+        repeated = []
+        variable_positions = {}
+
+        for position, argument in enumerate(goal.arguments):
+            if isinstance(argument, Variable):
+                if argument.name == "_":
+                    continue
+                first_position = variable_positions.setdefault(
+                    id(argument), position
+                )
+                if first_position != position:
+                    repeated.append((first_position, position))
+            else:
+                symbol_id = (
+                    self.symbols.lookup(argument.functor)
+                    if _is_atom(argument)
+                    else None
+                )
+                if symbol_id is None:
+                    return numpy.empty(0, dtype=numpy.int64)
+                bound.append((position, symbol_id))
+
+        # Narrow the rows down with a binary search over the sorted order of the
+        # first bound column, then filter the remaining conditions with masks
+        # over the (much smaller) candidate set.
+        if bound:
+            position, symbol_id = bound[0]
+            order, column = self._sorted_order(position)
+            start, end = numpy.searchsorted(column, [symbol_id, symbol_id + 1])
+            rows = numpy.sort(order[start:end])
+            bound = bound[1:]
+        else:
+            rows = numpy.arange(len(self.columns[0]), dtype=numpy.int64)
+
+        for position, symbol_id in bound:
+            rows = rows[self.columns[position][rows] == symbol_id]
+
+        for first_position, position in repeated:
+            rows = rows[
+                self.columns[first_position][rows]
+                == self.columns[position][rows]
+            ]
+
+        return rows
+
+    def row_term(self, row):
+        """Return the fact stored at the row index as a term"""
+        return Term(
+            self.functor,
+            [self.symbols.atom(int(column[row])) for column in self.columns],
+        )
+
+    def query(self, goal):
+        """Return a generator over the facts matching the goal"""
+        for row in self.select(goal):
+            yield self.row_term(row)
+
+    def join(self, goal, other_table, other_goal):
+        """Return a generator over the (fact, other fact) pairs matching a
+        conjunction of the two goals, or None if the goals share no variables.
+
+        The join sorts the selected rows of the other table on the shared
+        variable key and finds each row's matches with a vectorized binary
+        search. Pairs are generated in the same order a nested scan over both
+        tables would produce them. """
+        if not isinstance(other_table, FactTable):
+            return None
+
+        shared_positions = []
+        positions_by_variable = {
+            id(argument): position
+            for position, argument in enumerate(goal.arguments)
+            if isinstance(argument, Variable) and argument.name != "_"
+        }
+        for other_position, argument in enumerate(other_goal.arguments):
+            position = positions_by_variable.get(id(argument))
+            if isinstance(argument, Variable) and position is not None:
+                shared_positions.append((position, other_position))
+
+        # Give up on the bulk join if the combined keys could overflow
+        base = max(len(self.symbols), len(other_table.symbols), 1)
+        if not shared_positions or base ** len(shared_positions) >= 2 ** 63:
+            return None
+
+        rows = self.select(goal)
+        other_rows = other_table.select(other_goal)
+
+        keys = _join_keys(
+            self, rows, [position for position, _ in shared_positions], base
+        )
+        other_keys = _join_keys(
+            other_table,
+            other_rows,
+            [position for _, position in shared_positions],
+            base,
+        )
+
+        order = numpy.argsort(other_keys, kind="stable")
+        sorted_keys = other_keys[order]
+        starts = numpy.searchsorted(sorted_keys, keys, side="left")
+        ends = numpy.searchsorted(sorted_keys, keys, side="right")
+        counts = ends - starts
+
+        left = numpy.repeat(rows, counts)
+        offsets = numpy.repeat(starts - numpy.cumsum(counts) + counts, counts)
+        right = other_rows[order[numpy.arange(len(left)) + offsets]]
+
+        return (
+            (self.row_term(row), other_table.row_term(other_row))
+            for row, other_row in zip(left, right)
+        )
+
+
+def _join_keys(table, rows, positions, base):
+    """Combine the values at the given positions into one integer key"""
+    keys = numpy.zeros(len(rows), dtype=numpy.int64)
+    for position in positions:
+        keys = keys * base + table.columns[position][rows]
+    return keys
+
+
+def build_fact_tables(rules):
+    """Split the rules into fact tables and the remaining rules.
+
+    Every predicate whose clauses are all ground facts over atoms is moved into a
+    FactTable keyed by its functor and arity. Returns the map of fact tables and
+    the list of rules which still need to be searched clause by clause. """
+    if numpy is None:
+        raise ImportError("NumPy is required to use fact tables")
+
+    candidates = {}
+    for rule in rules:
+        if isinstance(rule.head, (Variable, Conjunction)):
+            continue
+        key = (rule.head.functor, len(rule.head.arguments))
+        candidates[key] = candidates.get(key, True) and is_ground_fact(rule)
+
+    symbols = SymbolTable()
+    fact_tables = {}
+    remaining_rules = []
+
+    for rule in rules:
+        key = (
+            None
+            if isinstance(rule.head, (Variable, Conjunction))
+            else (rule.head.functor, len(rule.head.arguments))
+        )
+        if candidates.get(key):
+            table = fact_tables.get(key)
+            if table is None:
+                table = fact_tables[key] = FactTable(key[0], key[1], symbols)
+            table.append(rule.head)
+        else:
+            remaining_rules.append(rule)
+
+    return fact_tables, remaining_rules
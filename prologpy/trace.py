@@ -0,0 +1,214 @@
+"""Box model traces of a search, exported as Chrome trace events.
+
+Every goal the engine tries to prove goes through the four ports of the box
+model: call when it's first tried, exit each time it's proved, redo when the
+search backtracks into it for another proof, and fail once it has no proofs
+left. A QueryTrace records these events into a fixed size ring buffer of
+compact arrays, so tracing a huge search keeps only its most recent events
+instead of growing without bounds. Sampling and depth limits cut down on what
+is recorded even further.
+
+Since the goals being proved always form a stack, each call or redo opens a
+span which the next exit or fail of the same goal closes. The trace can be
+written as Chrome trace-event JSON and opened in chrome://tracing or Perfetto,
+which shows the search tree over time along with the hot predicates.
+"""
+
+import json
+import time
+from array import array
+
+CALL, EXIT, REDO, FAIL, ERROR = range(5)
+
+PORT_NAMES = ("call", "exit", "redo", "fail", "error")
+
+
+class QueryTrace(object):
+    """A ring buffer of the box model events of a query.
+
+    Only every sample_every-th call is recorded, along with all of the later
+    events of the same goal. Goals nested less than min_depth or more than
+    max_depth levels below the query aren't recorded at all. Once capacity
+    events have been recorded, each new one overwrites the oldest.
+
+    Besides the events, the trace counts the ports of each predicate over all
+    of the recorded calls, which survives the events being overwritten. """
+
+    def __init__(
+        self, capacity=100000, sample_every=1, min_depth=0, max_depth=None
+    ):
+        self.capacity = capacity
+        self.sample_every = sample_every
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+
+        # One column per event field, each holding capacity values
+        self.timestamps = array("q", bytes(8 * capacity))
+        self.ports = array("b", bytes(capacity))
+        self.depths = array("i", bytes(4 * capacity))
+        self.predicate_ids = array("i", bytes(4 * capacity))
+
+        self.predicates = []
+        self.port_counts = []
+        self._predicate_ids = {}
+
+        self.recorded = 0
+        self.depth = 0
+        self._calls = 0
+
+    @property
+    def dropped(self):
+        """Return the number of events overwritten by newer ones"""
+        return max(0, self.recorded - self.capacity)
+
+    def _predicate_id(self, goal):
+        key = (goal.functor, len(goal.arguments))
+        predicate_id = self._predicate_ids.get(key)
+        if predicate_id is None:
+            predicate_id = self._predicate_ids[key] = len(self.predicates)
+            self.predicates.append(str(key[0]) + "/" + str(key[1]))
+            self.port_counts.append([0] * len(PORT_NAMES))
+        return predicate_id
+
+    def _record(self, port, depth, predicate_id):
+        position = self.recorded % self.capacity
+        self.timestamps[position] = time.perf_counter_ns()
+        self.ports[position] = port
+        self.depths[position] = depth
+        self.predicate_ids[position] = predicate_id
+        self.recorded += 1
+        self.port_counts[predicate_id][port] += 1
+
+    def trace_goal(self, goal, proofs):
+        """Return a generator over the proofs of the goal which records its box
+        model events. The depth is kept up to date for every goal, recorded or
+        not, since the generators of the goals being proved always form a stack.
+        """
+        depth = self.depth + 1
+
+        self._calls += 1
+        recorded = (
+            self._calls % self.sample_every == 0
+            and depth >= self.min_depth
+            and (self.max_depth is None or depth <= self.max_depth)
+        )
+        predicate_id = self._predicate_id(goal) if recorded else None
+
+        return self._traced_proofs(proofs, depth, recorded, predicate_id)
+
+    def _traced_proofs(self, proofs, depth, recorded, predicate_id):
+        record = self._record
+        self.depth = depth
+        if recorded:
+            record(CALL, depth, predicate_id)
+
+        active = True
+        try:
+            for proof in proofs:
+                if recorded:
+                    record(EXIT, depth, predicate_id)
+                self.depth = depth - 1
+                active = False
+
+                yield proof
+
+                self.depth = depth
+                active = True
+                if recorded:
+                    record(REDO, depth, predicate_id)
+
+            if recorded:
+                record(FAIL, depth, predicate_id)
+            self.depth = depth - 1
+            active = False
+        finally:
+            # An exception or an abandoned search leaves the goal without an
+            # exit or fail, so its span is closed here.
+            if active:
+                if recorded:
+                    record(ERROR, depth, predicate_id)
+                self.depth = depth - 1
+
+    def events(self):
+        """Return the recorded events which haven't been overwritten, oldest
+        first, as (timestamp in ns, port name, depth, predicate) tuples. """
+        start = self.recorded - min(self.recorded, self.capacity)
+        events = []
+        for index in range(start, self.recorded):
+            position = index % self.capacity
+            events.append(
+                (
+                    self.timestamps[position],
+                    PORT_NAMES[self.ports[position]],
+                    self.depths[position],
+                    self.predicates[self.predicate_ids[position]],
+                )
+            )
+        return events
+
+    def predicate_report(self):
+        """Return a list with the number of events per port for each predicate,
+        most called first. Many redos and fails compared to exits point at
+        unexpected backtracking. """
+        report = [
+            dict(
+                {"predicate": predicate},
+                **{name: counts[port] for port, name in enumerate(PORT_NAMES)}
+            )
+            for predicate, counts in zip(self.predicates, self.port_counts)
+        ]
+        report.sort(key=lambda entry: -entry["call"])
+        return report
+
+    def to_chrome_trace(self):
+        """Return the events as a Chrome trace-event JSON object. Every call or
+        redo starts a span named after the predicate, closed by the following
+        exit, fail or error. Spans whose start was overwritten are left out, and
+        spans still open at the end are closed at the last event. """
+        trace_events = []
+        open_spans = []
+
+        events = self.events()
+        start = events[0][0] if events else 0
+
+        for timestamp, port, depth, predicate in events:
+            microseconds = (timestamp - start) / 1000.0
+
+            if port in ("call", "redo"):
+                open_spans.append(predicate)
+                phase = "B"
+            elif open_spans:
+                open_spans.pop()
+                phase = "E"
+            else:
+                continue
+
+            trace_events.append(
+                {
+                    "name": predicate,
+                    "ph": phase,
+                    "ts": microseconds,
+                    "pid": 1,
+                    "tid": 1,
+                    "args": {"port": port, "depth": depth},
+                }
+            )
+
+        end = (events[-1][0] - start) / 1000.0 if events else 0
+        while open_spans:
+            trace_events.append(
+                {
+                    "name": open_spans.pop(),
+                    "ph": "E",
+                    "ts": end,
+                    "pid": 1,
+                    "tid": 1,
+                }
+            )
+
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        """Write the Chrome trace-event JSON to the file at path"""
+        with open(path, "w") as trace_file:
+            json.dump(self.to_chrome_trace(), trace_file)
@@ -1,4 +1,14 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
 from prologpy import Solver
+from prologpy.parser import Parser
+from prologpy.persistent import PersistentMap
 
 
 def test_simple_goal_query():
@@ -236,6 +246,108 @@ def test_multiple_var_query():
     assert ("(amy, peter)" in str(solution) for solution in solutions)
 
 
+def test_recursive_rule_variables_are_fresh_per_call():
+
+    rules_text = """
+
+        append(nil, L, L).
+        append(cons(H, T), L, cons(H, R)) :- append(T, L, R).
+
+    """
+
+    query_text = """
+
+        append(X, Y, cons(a, cons(b, nil)))
+
+    """
+
+    solver = Solver(rules_text)
+    solutions = solver.find_solutions(query_text)
+
+    assert [
+        str(solution).replace(" ", "") for solution in solutions.get("X")
+    ] == ["nil", "cons(a,nil)", "cons(a,cons(b,nil))"]
+    assert [
+        str(solution).replace(" ", "") for solution in solutions.get("Y")
+    ] == ["cons(a,cons(b,nil))", "cons(b,nil)", "nil"]
+
+
+def test_answers_are_views_over_query_variables():
+
+    rules_text = """
+
+        owns(mark, car(red)).
+        owns(jane, bike(blue)).
+
+    """
+
+    solver = Solver(rules_text)
+    answers = list(
+        solver.database.answers(Parser("owns(X, car(C))").parse_query())
+    )
+
+    assert len(answers) == 1
+    assert str(answers[0]["C"]) == "red"
+    assert str(answers[0].term).replace(" ", "") == "owns(mark,car(red))"
+
+    # Variables nested inside compound terms are reported as well
+    solutions = solver.find_solutions("owns(X, bike(C))")
+
+    assert [str(solution) for solution in solutions.get("X")] == ["jane"]
+    assert [str(solution) for solution in solutions.get("C")] == ["blue"]
+
+    # A query whose only variables are nested reports them, rather than just
+    # answering whether it's true
+    solutions = solver.find_solutions("owns(mark, car(C))")
+    assert [str(solution) for solution in solutions["C"]] == ["red"]
+
+    # Anonymous variables are never reported, so a query whose only variables
+    # are '_' is answered with True or False
+    assert solver.find_solutions("owns(mark, _)") is True
+    assert solver.find_solutions("owns(mark, bike(_))") is False
+    assert "_" not in solver.find_solutions("owns(X, _)")
+
+
+def test_aliased_variables_share_one_binding():
+
+    rules_text = """
+
+        same(X, X).
+        chain(A, B, C, D, E) :-
+            same(A, B),
+            same(D, E),
+            same(B, C),
+            same(C, D),
+            same(E, done).
+
+    """
+
+    solver = Solver(rules_text)
+    solutions = solver.find_solutions("chain(P, Q, R, S, T)")
+
+    for variable in ["P", "Q", "R", "S", "T"]:
+        assert [str(solution) for solution in solutions.get(variable)] == [
+            "done"
+        ]
+
+    # Unbound aliases are reported as unbound
+    solutions = solver.find_solutions("same(P, Q)")
+
+    assert solutions.get("P") == [None]
+
+
+def test_persistent_map_versions_are_independent():
+
+    empty_map = PersistentMap()
+    first_map = empty_map.set(3, "three")
+    second_map = first_map.set(5000, "five thousand").set(3, "new three")
+
+    assert len(empty_map) == 0 and empty_map.get(3) is None
+    assert first_map.get(3) == "three" and 5000 not in first_map
+    assert second_map.get(3) == "new three"
+    assert dict(second_map.items()) == {3: "new three", 5000: "five thousand"}
+
+
 def test_einstein_puzzle():
 
     rules_text = """ 
@@ -373,3 +485,1020 @@ def test_alternate_einstein_puzzle():
     assert "german" in [
         str(solution) for solution in solutions.get("FishOwner")
     ]
+
+
+def test_finite_domain_constraints():
+
+    rules_text = """
+
+        next_to(A, B) :- A #= B + 1.
+        next_to(A, B) :- A #= B - 1.
+
+        houses([English, Spaniard, Ukrainian, Norwegian, Japanese],
+               [Red, Green, Ivory, Yellow, Blue],
+               [Dog, Snails, Fox, Horse, Zebra],
+               [Coffee, Tea, Milk, OrangeJuice, Water],
+               [OldGold, Kools, Chesterfield, LuckyStrike, Parliament]) :-
+            [English, Spaniard, Ukrainian, Norwegian, Japanese] ins 1..5,
+            [Red, Green, Ivory, Yellow, Blue] ins 1..5,
+            [Dog, Snails, Fox, Horse, Zebra] ins 1..5,
+            [Coffee, Tea, Milk, OrangeJuice, Water] ins 1..5,
+            [OldGold, Kools, Chesterfield, LuckyStrike, Parliament] ins 1..5,
+            all_different([English, Spaniard, Ukrainian, Norwegian, Japanese]),
+            all_different([Red, Green, Ivory, Yellow, Blue]),
+            all_different([Dog, Snails, Fox, Horse, Zebra]),
+            all_different([Coffee, Tea, Milk, OrangeJuice, Water]),
+            all_different([OldGold, Kools, Chesterfield, LuckyStrike, Parliament]),
+            English #= Red, Spaniard #= Dog, Coffee #= Green, Ukrainian #= Tea,
+            Green #= Ivory + 1, OldGold #= Snails, Kools #= Yellow, Milk #= 3,
+            Norwegian #= 1, next_to(Chesterfield, Fox), next_to(Kools, Horse),
+            LuckyStrike #= OrangeJuice, Japanese #= Parliament,
+            next_to(Norwegian, Blue),
+            label([English, Spaniard, Ukrainian, Norwegian, Japanese,
+                   Red, Green, Ivory, Yellow, Blue,
+                   Dog, Snails, Fox, Horse, Zebra,
+                   Coffee, Tea, Milk, OrangeJuice, Water]).
+
+        same(X, X).
+        aliased(X, Y) :- X in 1..5, Y in 3..9, same(X, Y), X #\\= 4, label([Y]).
+        linear(X, Y) :- [X, Y] ins 0..10, 2 * X + 3 * Y #= 12, label([X, Y]).
+        not_a_number(X) :- X in 1..3, same(X, a).
+
+    """
+
+    solver = Solver(rules_text)
+
+    # Propagation alone narrows most of the houses down before labelling
+    solutions = solver.find_solutions("houses(Nations, _, Pets, Drinks, _)")
+    assert len(solutions["Nations"]) == 1
+
+    nations, pets, drinks = [
+        [item.functor for item in solutions[name][0].items]
+        for name in ("Nations", "Pets", "Drinks")
+    ]
+    assert pets[4] == nations[4]  # the japanese owns the zebra
+    assert drinks[4] == nations[3]  # the norwegian drinks water
+
+    # Aliasing two constrained variables intersects their domains
+    solutions = solver.find_solutions("aliased(X, Y)")
+    assert [solution.functor for solution in solutions["X"]] == [3, 5]
+    assert [solution.functor for solution in solutions["Y"]] == [3, 5]
+
+    solutions = solver.find_solutions("linear(X, Y)")
+    assert [
+        (x.functor, y.functor) for x, y in zip(solutions["X"], solutions["Y"])
+    ] == [(0, 4), (3, 2), (6, 0)]
+
+    assert solver.find_solutions("not_a_number(X)") is None
+
+    # A variable narrowed down to a single value is bound to it
+    assert solver.find_solutions("X #= 3 + 4")["X"][0].functor == 7
+
+    with pytest.raises(Exception):
+        solver.find_solutions("X * Y #= 4")
+
+
+def test_datalog_mode():
+
+    rules_text = """
+
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- path(X, Y), edge(Y, Z).
+
+        edge(a, b).
+        edge(b, c).
+        edge(c, a).
+        edge(x, y).
+
+    """
+
+    query_text = """
+
+        path(x, X)
+
+    """
+
+    solver = Solver(rules_text, mode="datalog")
+
+    assert solver.datalog is not None
+    assert [
+        str(solution) for solution in solver.find_solutions(query_text)["X"]
+    ] == ["y"]
+    assert solver.find_solutions("path(a, a)")
+    assert not solver.find_solutions("path(a, x)")
+
+    # New facts only propagate their own consequences into the relations
+    solver.add_facts("edge(y, b).")
+    solutions = solver.find_solutions(query_text)
+
+    assert sorted(str(solution) for solution in solutions.get("X")) == [
+        "a",
+        "b",
+        "c",
+        "y",
+    ]
+
+
+def test_datalog_mode_repeated_variables():
+
+    rules_text = """
+
+        edge(a, a). edge(a, b). edge(b, b). edge(b, c).
+        same(X) :- edge(X, X).
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- path(X, Y), edge(Y, Z).
+        edge(c, a).
+
+    """
+
+    solver = Solver(rules_text, mode="datalog")
+    assert solver.datalog is not None
+
+    def values(query_text):
+        return sorted(
+            str(value) for value in solver.find_solutions(query_text)["X"]
+        )
+
+    # A variable repeated within a query goal and within a rule body goal
+    assert values("edge(X, X)") == ["a", "b"]
+    assert values("same(X)") == ["a", "b"]
+    assert values("path(X, X)") == ["a", "b", "c"]
+
+
+def test_datalog_delta_joins_start_from_new_tuples(monkeypatch):
+
+    from prologpy.datalog import Relation
+
+    rules_text = (
+        "".join("edge(c{0}, c{1}). ".format(i, i + 1) for i in range(20))
+        + "".join("edge(u{0}, v{0}). ".format(i) for i in range(1000))
+        + """
+        path(X, Y) :- edge(X, Y).
+        path(X, Y) :- edge(X, Z), path(Z, Y).
+        """
+    )
+
+    solver = Solver(rules_text, mode="datalog")
+    assert solver.datalog is not None
+
+    visited = []
+    lookup = Relation.lookup
+
+    def counting_lookup(relation, positions, key):
+        rows = lookup(relation, positions, key)
+        visited.append(len(rows))
+        return rows
+
+    monkeypatch.setattr(Relation, "lookup", counting_lookup)
+
+    # Every iteration joins the new path tuples with the edges leading to them,
+    # rather than scanning all of the unrelated edges once per iteration
+    solver.add_facts("edge(c20, c21).")
+    assert len(solver.find_solutions("path(c0, X)")["X"]) == 21
+    assert sum(visited) < 1000
+
+
+def test_datalog_mode_falls_back_for_non_datalog_programs():
+
+    rules_text = """
+
+        owns(mark, car(red)).
+        likes(X, Y) :- owns(X, Y).
+
+    """
+
+    solver = Solver(rules_text, mode="datalog")
+    solutions = solver.find_solutions("likes(mark, X)")
+
+    assert solver.datalog is None
+    assert str(solutions.get("X").pop()).replace(" ", "") == "car(red)"
+
+
+def test_fact_tables_match_rule_storage():
+
+    pytest.importorskip("numpy")
+
+    rules_text = """
+
+        edge(a, b).
+        edge(b, c).
+        edge(c, d).
+        edge(b, d).
+        edge(d, d).
+
+        color(a, red).
+        color(b, blue).
+        color(c, red).
+
+        two_steps(X, Z) :- edge(X, Y), edge(Y, Z).
+        red_step(X, Y) :- edge(X, Y), color(Y, red).
+        loop(X) :- edge(X, X).
+
+    """
+
+    solver = Solver(rules_text)
+    table_solver = Solver(rules_text, fact_tables=True)
+
+    assert set(table_solver.database.fact_tables) == {
+        ("edge", 2),
+        ("color", 2),
+    }
+
+    for query_text in ["two_steps(X, Z)", "red_step(X, Y)", "loop(X)"]:
+        solutions = solver.find_solutions(query_text)
+        table_solutions = table_solver.find_solutions(query_text)
+
+        assert {
+            variable: [str(value) for value in values]
+            for variable, values in solutions.items()
+        } == {
+            variable: [str(value) for value in values]
+            for variable, values in table_solutions.items()
+        }
+
+    assert table_solver.find_solutions("edge(b, d)")
+    assert not table_solver.find_solutions("edge(d, a)")
+
+
+def test_sqlite_fact_table(tmp_path):
+
+    database_path = str(tmp_path / "facts.db")
+
+    connection = sqlite3.connect(database_path)
+    connection.execute("CREATE TABLE edges (source TEXT, target TEXT)")
+    connection.executemany(
+        "INSERT INTO edges VALUES (?, ?)",
+        [("a", "b"), ("b", "c"), ("b", "d"), ("e", "e")],
+    )
+    connection.commit()
+    connection.close()
+
+    rules_text = """
+
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- edge(X, Y), path(Y, Z).
+        loop(X) :- edge(X, X).
+
+    """
+
+    solver = Solver(rules_text)
+    solver.add_sqlite_table("edge", database_path, "edges")
+
+    solutions = solver.find_solutions("path(a, X)")
+
+    assert [str(solution) for solution in solutions.get("X")] == [
+        "b",
+        "c",
+        "d",
+    ]
+    assert [
+        str(solution) for solution in solver.find_solutions("loop(X)")["X"]
+    ] == ["e"]
+    assert solver.find_solutions("edge(b, d)")
+    assert not solver.find_solutions("edge(d, b)")
+
+    # The table is read-only, and rules can't be added to its predicate
+    with pytest.raises(Exception):
+        solver.add_facts("edge(d, f).")
+    with pytest.raises(Exception):
+        solver.add_facts("edge(X, f) :- loop(X).")
+    assert not solver.find_solutions("edge(d, f)")
+
+    # Facts added for the predicate of a writable table are inserted into it
+    solver = Solver(rules_text)
+    solver.add_sqlite_table("edge", database_path, "edges", writable=True)
+    solver.add_facts("edge(d, f).")
+
+    assert "f" in [
+        str(solution) for solution in solver.find_solutions("path(a, X)")["X"]
+    ]
+
+
+def test_occurs_check():
+
+    rules_text = """
+
+        eq(X, X).
+        twice(A, B) :- eq(A, f(A)), eq(B, f(B)), eq(A, B).
+
+    """
+
+    # Without the occurs check the binding is cyclic, which can be unified with
+    # other cyclic terms but can't be instantiated as an answer.
+    solver = Solver(rules_text)
+    assert solver.find_solutions("twice(_, _)")
+    with pytest.raises(Exception):
+        solver.find_solutions("eq(Y, f(Y))")
+
+    solver = Solver(rules_text, occurs_check="on")
+    assert solver.find_solutions("eq(Y, f(Y))") is None
+    assert not solver.find_solutions("twice(_, _)")
+    assert [
+        str(solution) for solution in solver.find_solutions("eq(Y, f(Z))")["Y"]
+    ] == ["f ( Z ) "]
+
+    solver = Solver(rules_text, occurs_check="error")
+    with pytest.raises(Exception):
+        solver.find_solutions("eq(Y, f(Y))")
+
+    with pytest.raises(Exception):
+        Solver(rules_text, occurs_check="sometimes")
+
+
+def test_lists():
+
+    rules_text = """
+
+        append([], L, L).
+        append([H | T], L, [H | R]) :- append(T, L, R).
+
+        member(X, [X | _]).
+        member(X, [_ | T]) :- member(X, T).
+
+        last([X], X).
+        last([_ | T], X) :- last(T, X).
+
+    """
+
+    solver = Solver(rules_text)
+
+    solutions = solver.find_solutions("append(X, Y, [a, b, c])")
+    assert [str(solution) for solution in solutions["X"]] == [
+        "[]",
+        "[a]",
+        "[a, b]",
+        "[a, b, c]",
+    ]
+    assert [str(solution) for solution in solutions["Y"]] == [
+        "[a, b, c]",
+        "[b, c]",
+        "[c]",
+        "[]",
+    ]
+
+    # Partial lists keep their open tail
+    solutions = solver.find_solutions("append([a, b], [c | T], Z)")
+    assert [str(solution) for solution in solutions["Z"]] == ["[a, b, c | T]"]
+
+    assert [
+        str(solution)
+        for solution in solver.find_solutions("member(X, [a, f(b), [c]])")["X"]
+    ] == ["a", "f ( b ) ", "[c]"]
+    assert solver.find_solutions("append([a], [b], [a | [b]])")
+    assert not solver.find_solutions("member(d, [a, b, c])")
+
+    items = ", ".join("item" + str(index) for index in range(50))
+    assert [
+        str(solution)
+        for solution in solver.find_solutions("last([" + items + "], X)")["X"]
+    ] == ["item49"]
+
+    parsed_list = Parser("[a, b | [c]]").parse_query()
+    assert str(parsed_list) == "[a, b, c]"
+
+    # The tail of a list shares the elements instead of copying them
+    assert parsed_list.arguments[1].items is parsed_list.items
+
+
+def test_recursion_depth():
+
+    # Every level of recursion costs a few Python stack frames, so an extra
+    # frame per goal shows up as a much lower depth limit
+    solver = Solver(
+        """
+        last([X], X).
+        last([_ | T], X) :- last(T, X).
+        """
+    )
+
+    items = ", ".join("e{0}".format(index) for index in range(300))
+    solutions = solver.find_solutions("last([{0}], X)".format(items))
+    assert str(solutions["X"][0]) == "e299"
+
+
+def test_aggregation_builtins():
+
+    rules_text = """
+
+        age(peter, 7).
+        age(ann, 11).
+        age(pat, 8).
+        age(tom, 5).
+        age(mike, 11).
+
+        class(a, peter).
+        class(b, ann).
+        class(a, pat).
+        class(b, tom).
+        class(b, mike).
+
+        has_age(A) :- age(_, A).
+
+    """
+
+    solver = Solver(rules_text)
+
+    def values(query_text, variable):
+        return [
+            str(value) for value in solver.find_solutions(query_text)[variable]
+        ]
+
+    assert values("findall(X, age(X, 11), L)", "L") == ["[ann, mike]"]
+    assert values("findall(X, age(X, 99), L)", "L") == ["[]"]
+
+    # bagof groups the solutions by the free variables of the goal
+    assert values("bagof(X, class(C, X), L)", "C") == ["a", "b"]
+    assert values("bagof(X, class(C, X), L)", "L") == [
+        "[peter, pat]",
+        "[ann, tom, mike]",
+    ]
+    assert not solver.find_solutions("bagof(X, age(X, 99), L)")
+
+    # setof sorts each set and removes duplicates
+    assert values("setof(A, has_age(A), L)", "L") == ["[5, 7, 8, 11]"]
+    assert values("setof(A, age(X, A), L)", "X") == [
+        "ann",
+        "mike",
+        "pat",
+        "peter",
+        "tom",
+    ]
+
+    assert values("aggregate_all(count, age(_, _), N)", "N") == ["5"]
+    assert values("aggregate_all(sum(A), age(_, A), N)", "N") == ["42"]
+    assert values("aggregate_all(max(A), age(_, A), N)", "N") == ["11"]
+    assert values("aggregate_all(min(A), age(_, A), N)", "N") == ["5"]
+    assert not solver.find_solutions("aggregate_all(max(A), age(x, A), N)")
+
+
+def test_distinct_answers():
+
+    rules_text = """
+
+        edge(a, b).
+        edge(a, c).
+        edge(b, d).
+        edge(c, d).
+        edge(d, e).
+
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- edge(X, Y), path(Y, Z).
+
+    """
+
+    solver = Solver(rules_text)
+
+    # d and e can each be reached from a along two paths
+    assert len(solver.find_solutions("path(a, X)")["X"]) == 6
+
+    solutions = solver.find_solutions("path(a, X)", distinct=True)
+    assert [str(solution) for solution in solutions["X"]] == [
+        "b",
+        "c",
+        "d",
+        "e",
+    ]
+
+    solutions = solver.find_solutions(
+        "path(a, X)", distinct=True, approximate_capacity=100
+    )
+    assert [str(solution) for solution in solutions["X"]] == [
+        "b",
+        "c",
+        "d",
+        "e",
+    ]
+
+
+def test_result_table():
+
+    rules_text = """
+
+        age(peter, 7).
+        age(ann, 11).
+        age(pat, 8).
+        age(bob, _).
+
+    """
+
+    solver = Solver(rules_text)
+    table = solver.find_table("age(X, A)", batch_size=3)
+
+    assert len(table) == 4
+    assert table.column("X") == ["peter", "ann", "pat", "bob"]
+    assert table.column("A") == [7, 11, 8, None]
+
+    # Every distinct value is stored once and shared between the columns
+    assert sorted(map(str, table.symbols)) == sorted(
+        ["peter", "ann", "pat", "bob", "7", "11", "8"]
+    )
+
+    numpy = pytest.importorskip("numpy")
+
+    result = solver.find_table("age(X, A)").to_numpy()
+    assert list(result["X"]) == ["peter", "ann", "pat", "bob"]
+    assert list(result["A"]) == ["7", "11", "8", ""]
+
+    result = solver.find_table("age(peter, A)").to_numpy()
+    assert result["A"].dtype == numpy.int64
+    assert list(result["A"]) == [7]
+
+
+def test_argument_indexes_from_call_patterns():
+
+    facts = "".join(
+        "parent(p{0}, c{0}).\n".format(index) for index in range(50)
+    )
+    rules_text = (
+        facts
+        + """
+
+        parent(X, everyone) :- root(X).
+        root(p0).
+
+        grandparent(X, Z) :- parent(X, Y), parent(Y, Z).
+
+    """
+    )
+
+    solver = Solver(rules_text)
+
+    for index in range(20):
+        solutions = solver.find_solutions("parent(X, c{0})".format(index))
+        assert [str(solution) for solution in solutions["X"]] == [
+            "p" + str(index)
+        ]
+
+    # The clause with a variable in the indexed position is still found, in
+    # clause order
+    assert [
+        str(solution)
+        for solution in solver.find_solutions("parent(p0, Y)")["Y"]
+    ] == ["c0", "everyone"]
+
+    report = solver.database.index_report()
+    assert [(entry["predicate"], entry["position"]) for entry in report] == [
+        ("parent/2", 1)
+    ]
+    assert report[0]["hits"] > 0
+    assert report[0]["keys"] == 51
+
+    # Calls from several threads at once count every call and build each
+    # index once
+    import threading
+
+    solver = Solver(rules_text)
+    predicate = solver.database.clause_index.get("parent", 2)
+
+    def run_queries():
+        for index in range(50):
+            solver.find_solutions("parent(p{0}, X)".format(index))
+
+    threads = [threading.Thread(target=run_queries) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert predicate.call_count == 8 * 50
+    assert predicate.bound_counts[0] == 8 * 50
+    assert list(predicate.indexes) == [0]
+    assert solver.database.clause_index.used_entries == (
+        predicate.indexes[0].entries
+    )
+
+    # Adding a clause drops the indexes until they're needed again
+    solver.add_facts("parent(p50, c50).")
+    assert solver.database.index_report() == []
+    assert solver.find_solutions("parent(p50, c50)")
+
+    # Indexes which don't fit in the budget aren't built
+    solver = Solver(rules_text)
+    solver.database.clause_index.budget = 10
+    for index in range(20):
+        assert solver.find_solutions("parent(p{0}, c{0})".format(index))
+    assert solver.database.index_report() == []
+
+
+def test_incremental_rule_updates():
+
+    facts = "".join(
+        "parent(p{0}, c{0}).\n".format(index) for index in range(20)
+    )
+    rules_text = (
+        facts
+        + """
+        /* Grandparents
+           of everyone */
+        grandparent(X, Z) :- parent(X, Y), parent(Y, Z).
+        sibling(a, b).
+    """
+    )
+
+    # A solver only keeps the clause texts once its rules have been updated
+    solver = Solver(rules_text)
+    assert solver.clause_rules is None
+    solver.update_rules(rules_text)
+    for index in range(10):
+        assert solver.find_solutions("parent(p{0}, X)".format(index))
+    assert solver.database.index_report()
+
+    parent_clauses = solver.database.clause_index.get("parent", 2).clauses
+    grandparent_rule = solver.clause_rules[
+        "grandparent(X, Z) :- parent(X, Y), parent(Y, Z)."
+    ]
+
+    # Editing one clause only parses that clause, and the unchanged parent
+    # predicate keeps its clauses and index
+    solver.update_rules(rules_text.replace("sibling(a, b)", "sibling(a, c)"))
+    assert solver.find_solutions("sibling(a, X)")["X"][0].functor == "c"
+    parent = solver.database.clause_index.get("parent", 2)
+    assert parent.clauses is parent_clauses
+    assert (
+        grandparent_rule
+        is solver.clause_rules[
+            "grandparent(X, Z) :- parent(X, Y), parent(Y, Z)."
+        ]
+    )
+    assert solver.database.index_report()
+
+    # Removing clauses removes their answers, and a predicate with no clauses
+    # left is gone
+    solver.update_rules(facts.replace("parent(p3, c3).", "parent(p3, x)."))
+    assert not solver.find_solutions("parent(p3, c3)")
+    assert solver.find_solutions("parent(p3, x)")
+    assert not solver.find_solutions("sibling(a, X)")
+    assert solver.database.clause_index.get("sibling", 2) is None
+
+    # A text which doesn't parse leaves the solver as it was
+    with pytest.raises(Exception):
+        solver.update_rules(facts + "broken(")
+    assert solver.find_solutions("parent(p3, x)")
+
+    solver = Solver(rules_text, mode="datalog")
+    solver.update_rules(rules_text + "parent(c0, d0).")
+    assert solver.datalog is not None
+    assert str(solver.find_solutions("grandparent(p0, X)")["X"][0]) == "d0"
+
+
+def test_freeze_before_fork():
+
+    import gc
+
+    facts = "".join(
+        "parent(p{0}, c{0}).\n".format(index) for index in range(20)
+    )
+    solver = Solver(facts + "root(p0).")
+
+    # Workers share the indexes built before forking instead of building
+    # their own
+    solver.database.freeze()
+    try:
+        assert gc.get_freeze_count() > 0
+        assert [
+            (entry["predicate"], entry["position"])
+            for entry in solver.database.index_report()
+        ] == [("parent/2", 0), ("parent/2", 1)]
+        assert str(solver.find_solutions("parent(X, c3)")["X"][0]) == "p3"
+    finally:
+        solver.database.unfreeze()
+    assert gc.get_freeze_count() == 0
+
+
+def test_lazy_import_and_solver_from_database():
+
+    # Importing the package doesn't load any of the submodules yet
+    loaded_modules = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, prologpy; "
+            "print(sorted(m for m in sys.modules if m.startswith('prologpy')))",
+        ],
+        check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    ).stdout
+    assert loaded_modules.strip() == "['prologpy']"
+
+    solver = Solver("parent(a, b). parent(b, c).")
+    other_solver = Solver.from_database(solver.database)
+
+    assert [
+        str(solution)
+        for solution in other_solver.find_solutions("parent(X, c)")["X"]
+    ] == ["b"]
+
+    # Both solvers share the database
+    other_solver.add_facts("parent(c, d).")
+    assert solver.find_solutions("parent(c, d)")
+
+
+def test_command_line_runner(tmp_path, capsys):
+
+    from prologpy.__main__ import main
+
+    rules_path = tmp_path / "rules.pl"
+    rules_path.write_text(
+        """
+        edge(a, b). edge(b, c).
+        /* comments can span
+           several lines. */
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- edge(X, Y), path(Y, Z).
+        """
+    )
+    queries_path = tmp_path / "queries.txt"
+    queries_path.write_text("path(a, X)\n\nedge(c, a)\n")
+
+    main([str(rules_path), "--queries", str(queries_path), "--limit", "5"])
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert [line.get("answer") for line in lines] == [
+        {"X": "b"},
+        {"X": "c"},
+        None,
+        None,
+    ]
+    assert [line.get("answers") for line in lines[2:]] == [2, 0]
+
+    main(
+        [str(rules_path), "--queries", str(queries_path), "--limit", "1"]
+        + ["--jobs", "2"]
+    )
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert [line["query"] for line in lines] == [
+        "path(a, X)",
+        "path(a, X)",
+        "edge(c, a)",
+    ]
+    assert lines[0]["answer"] == {"X": "b"}
+
+
+def test_query_server():
+
+    import asyncio
+    import socket
+    import threading
+
+    from prologpy.client import QueryClient, QueryError
+    from prologpy.server import QueryServer
+
+    digits = "".join("digit({0}). ".format(digit) for digit in range(60))
+    solver = Solver(
+        digits
+        + """
+        edge(a, b). edge(b, c). edge(c, d).
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- edge(X, Y), path(Y, Z).
+        slow(A) :- digit(A), digit(B), digit(C), digit(D), edge(D, A).
+        """
+    )
+
+    started = threading.Event()
+    addresses = []
+
+    async def run_server():
+        server = await QueryServer(solver, max_workers=4).start(port=0)
+        addresses.append(server.sockets[0].getsockname())
+        started.set()
+        await server.serve_forever()
+
+    threading.Thread(
+        target=asyncio.run, args=(run_server(),), daemon=True
+    ).start()
+    assert started.wait(10)
+
+    client = QueryClient(port=addresses[0][1])
+
+    assert list(client.query("path(a, X)")) == [
+        {"X": "b"},
+        {"X": "c"},
+        {"X": "d"},
+    ]
+    assert list(client.query("path(a, X)", limit=1)) == [{"X": "b"}]
+
+    # The connection was given back to the pool and is reused
+    assert len(client._idle) == 1
+    list(client.query("edge(X, Y)"))
+    assert len(client._idle) == 1
+
+    # A query which fails on the server leaves its connection in the pool
+    with pytest.raises(QueryError):
+        list(client.query("path(a, X"))
+    assert len(client._idle) == 1
+
+    # Pipelined queries are answered concurrently, and a query which never
+    # finishes times out without holding up the others
+    results = client.query_all(
+        ["slow(X)", "path(b, X)", "edge(d, X)"], timeout=0.5
+    )
+    assert results[0][1]["error"] == "Query timed out"
+    assert results[1][0] == [{"X": "c"}, {"X": "d"}]
+    assert results[1][1]["answers"] == 2
+    assert results[2][0] == [] and results[2][1]["answers"] == 0
+
+    # Closing the connection stops the queries still running on it, even when
+    # the client ends its requests cleanly
+    connection = client._connect()
+    connection.send({"id": 1, "query": "slow(X)"})
+    connection.socket.shutdown(socket.SHUT_WR)
+    assert connection.receive()["error"] == "Query cancelled"
+    connection.close()
+
+    client.close()
+
+
+def test_query_trace(tmp_path):
+
+    from prologpy.context import QueryContext
+    from prologpy.trace import QueryTrace
+
+    solver = Solver(
+        """
+        edge(a, b). edge(b, c).
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- edge(X, Y), path(Y, Z).
+        """
+    )
+
+    trace = QueryTrace()
+    solutions = solver.iter_solutions(
+        "path(a, X)", context=QueryContext(trace=trace)
+    )
+    assert len(list(solutions)) == 2
+
+    events = [(port, depth, name) for _, port, depth, name in trace.events()]
+    assert events[:7] == [
+        ("call", 1, "path/2"),
+        ("call", 2, "edge/2"),
+        ("exit", 2, "edge/2"),
+        ("exit", 1, "path/2"),
+        ("redo", 1, "path/2"),
+        ("redo", 2, "edge/2"),
+        ("fail", 2, "edge/2"),
+    ]
+    assert events[-1] == ("fail", 1, "path/2")
+
+    report = {entry["predicate"]: entry for entry in trace.predicate_report()}
+    assert report["path/2"]["call"] == 3 and report["path/2"]["exit"] == 3
+
+    # Every span opened by a call or redo is closed again
+    trace.write_chrome_trace(str(tmp_path / "trace.json"))
+    with open(str(tmp_path / "trace.json")) as trace_file:
+        trace_events = json.load(trace_file)["traceEvents"]
+    phases = [event["ph"] for event in trace_events]
+    assert phases.count("B") == phases.count("E") == len(events) // 2
+
+    # The ring buffer keeps the most recent events, and the depth limit leaves
+    # out the nested goals
+    trace = QueryTrace(capacity=4, max_depth=1)
+    list(
+        solver.iter_solutions("path(a, X)", context=QueryContext(trace=trace))
+    )
+    assert trace.recorded == 6 and trace.dropped == 2
+    assert [port for _, port, _, _ in trace.events()] == [
+        "redo",
+        "exit",
+        "redo",
+        "fail",
+    ]
+
+    # Sampling records every other call along with the rest of its ports
+    trace = QueryTrace(sample_every=2)
+    list(
+        solver.iter_solutions("path(a, X)", context=QueryContext(trace=trace))
+    )
+    assert sum(entry["call"] for entry in trace.predicate_report()) == 4
+
+
+def test_query_timeout():
+
+    from prologpy.context import QueryContext, QueryTimeout
+
+    solver = Solver(
+        """
+        count(zero).
+        count(s(X)) :- count(X).
+        """
+    )
+
+    context = QueryContext(timeout=0, check_interval=1)
+    with pytest.raises(QueryTimeout):
+        list(solver.iter_solutions("count(X)", context=context))
+
+    # The query has infinitely many answers, the limit stops it after three
+    solutions = solver.iter_solutions("count(X)", limit=3)
+    assert [str(solution["X"]) for solution in solutions] == [
+        "zero",
+        "s ( zero ) ",
+        "s ( s ( zero )  ) ",
+    ]
+
+
+def test_negation_and_if_then_else():
+
+    solver = Solver(
+        """
+        bird(tweety). bird(pingu). penguin(pingu).
+        same(X, X).
+        flies(X) :- bird(X), \\+ penguin(X).
+        kind(X, K) :- ( penguin(X) -> same(K, walker)
+                      ; bird(X) -> same(K, flier)
+                      ; same(K, unknown) ).
+        choice(X) :- same(X, a) ; same(X, b).
+        loop(a).
+        loop(X) :- loop(X).
+        """
+    )
+
+    def values(query_text, variable):
+        return [
+            str(value) for value in solver.find_solutions(query_text)[variable]
+        ]
+
+    assert values("flies(X)", "X") == ["tweety"]
+    assert solver.find_solutions("\\+ bird(rex)") is True
+    assert not solver.find_solutions("\\+ (bird(X), penguin(X))")
+
+    assert values("kind(pingu, K)", "K") == ["walker"]
+    assert values("kind(tweety, K)", "K") == ["flier"]
+    assert values("kind(rex, K)", "K") == ["unknown"]
+    assert values("choice(X)", "X") == ["a", "b"]
+
+    # The condition stops at its first solution, so the endless loop/1 clauses
+    # are never tried
+    assert values("( bird(X) -> same(X, X) )", "X") == ["tweety"]
+    assert values("( loop(a) -> same(X, y) ; same(X, n) )", "X") == ["y"]
+    assert solver.find_solutions("\\+ \\+ loop(a)") is True
+
+
+def test_memory_accounting(monkeypatch):
+
+    import tracemalloc
+
+    from prologpy.context import QueryContext
+    from prologpy.memory import QueryMemory
+
+    solver = Solver(
+        "".join("edge(n%d, n%d). " % (i, i + 1) for i in range(40))
+        + """
+        path(X, Y) :- edge(X, Y).
+        path(X, Z) :- edge(X, Y), path(Y, Z).
+        """
+    )
+
+    stats = solver.database.memory_stats()
+    assert [entry["predicate"] for entry in stats] == ["edge/2", "path/2"]
+    assert stats[0]["clauses"] == 40 and stats[1]["clauses"] == 2
+    assert stats[0]["terms"] > 3 * 40
+    assert stats[0]["bytes"] > stats[1]["bytes"] > 0
+
+    memory = QueryMemory()
+    solutions = solver.iter_solutions(
+        "path(n0, X)", context=QueryContext(memory=memory)
+    )
+    assert len(list(solutions)) == 40
+
+    # Every edge along the path leaves a choice point in path/2 and edge/2
+    report = memory.report()
+    assert report["peak_open_goals"] >= 2 * 40
+    assert report["peak_slots"] >= report["peak_binding_entries"] >= 40
+    assert memory.open_goals == 0
+    assert "peak_bytes" not in report
+
+    memory = QueryMemory(allocations=True)
+    list(
+        solver.iter_solutions(
+            "path(n0, X)", context=QueryContext(memory=memory)
+        )
+    )
+    report = memory.report()
+    assert report["peak_bytes"] >= report["retained_bytes"]
+    assert report["allocations"]
+    assert not tracemalloc.is_tracing()
+
+    # When tracemalloc is already tracing it keeps running, also on Python 3.8
+    # where its peak can't be reset
+    monkeypatch.delattr(tracemalloc, "reset_peak", raising=False)
+    tracemalloc.start()
+    try:
+        earlier_peak = bytearray(10000000)
+        del earlier_peak
+
+        memory = QueryMemory(allocations=True)
+        list(
+            solver.iter_solutions(
+                "path(n0, X)", context=QueryContext(memory=memory)
+            )
+        )
+        report = memory.report()
+        assert 0 <= report["peak_bytes"] < 10000000
+        assert report["peak_bytes"] >= report["retained_bytes"]
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()